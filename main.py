@@ -8,14 +8,67 @@
     python main.py homework/week15 -r 2021001 2021002 # 重新批改指定学生
     python main.py homework/week15 -f                 # 重新批改失败学生
     python main.py homework/week15 -r 2021001 -f      # 组合使用
+    python main.py homework/week15 -i                 # 只批改有变化的学生
+    python main.py homework/week15 --resume           # 从中断处继续
+    python main.py homework/week15 --batch            # 通过 Batch API 离线批改
+    python main.py homework/week15 --dedup            # 重复提交只批改一次
+    python main.py homework/week15 --similarity       # 生成相似提交报告
+    python main.py homework/week15 -j 8               # 8 个并发请求批改
+    python main.py homework/week15 --refresh-cache    # 忽略已有缓存重新请求
+    python main.py homework/week15 -j 8 --hedge       # 慢请求发对冲请求，降低尾延迟
+    python main.py homework/week15 --cascade-model gpt-4o-mini  # 先用便宜模型批改，必要时升级
+    python main.py homework/week15 --pack             # 多名学生打包进一个请求，节省题目 token
+    python main.py homework/week15 --checks           # 先本地编译并运行测试用例
+    python main.py homework/week15 --plan -j 16       # 只预估 token、费用和耗时，不调用 API
+    python main.py homework/week14 homework/week15    # 同时批改多个作业
+    python main.py "homework/week*"                   # 通配符匹配多个作业
+    python main.py homework/week15 -o /mnt/share/w15 --worker  # 多台机器分布式批改
+    python main.py report homework/week15             # 从已有结果重新生成报告（不调用 API）
+    python main.py export homework/week15 --file grades.csv  # 导出成绩表
+    python main.py status homework/week15             # 查看批改进度和失败的学生
 """
 
 import argparse
 import sys
 from pathlib import Path
 
+from src.commands import COMMANDS, expand_homework_paths
+
+
+def validate_homework_dir(homework_path: Path):
+    """检查作业目录结构，不符合要求时打印错误并退出"""
+    if not homework_path.exists():
+        print(f"错误: 目录不存在: {homework_path}")
+        sys.exit(1)
+
+    if not homework_path.is_dir():
+        print(f"错误: 路径不是目录: {homework_path}")
+        sys.exit(1)
+
+    # 验证必要的文件和目录存在
+    statements_dir = homework_path / "statements"
+    if not statements_dir.exists():
+        print(f"错误: 找不到题目描述目录: {statements_dir}")
+        sys.exit(1)
+
+    homework_md = statements_dir / "homework.md"
+    if not homework_md.exists():
+        print(f"错误: 找不到作业描述文件: {homework_md}")
+        sys.exit(1)
+
+    assignments_dir = homework_path / "assignments"
+    if not assignments_dir.exists():
+        print(f"错误: 找不到学生作业目录: {assignments_dir}")
+        sys.exit(1)
+
 
 def main():
+    # 只读取已有结果的子命令不加载批改流程，也不需要 API Key；
+    # 当前目录下存在同名目录时仍按作业目录批改，与没有子命令时的行为一致
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS and not Path(sys.argv[1]).is_dir():
+        from src.commands import main as command_main
+        sys.exit(command_main(sys.argv[1:]))
+
     parser = argparse.ArgumentParser(
         description="自动批改编程作业的 Pipeline",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -26,12 +79,33 @@ def main():
     python main.py homework/week15 -r 2021001 2021002   # 重新批改指定学生
     python main.py homework/week15 --regrade-failed     # 重新批改失败学生
     python main.py homework/week15 -r 2021001 -f        # 组合使用
+    python main.py homework/week15 --incremental        # 只批改新增或修改过提交的学生
+    python main.py homework/week15 --resume             # 中断后继续，只批改尚未完成的学生
+    python main.py homework/week15 --batch              # 通过 Batch API 离线批改（更便宜，不要求实时）
+    python main.py homework/week15 --dedup              # 去除注释和空白后相同的提交只批改一次
+    python main.py homework/week15 --similarity         # 额外生成相似提交报告 similarity.md
+    python main.py homework/week15 -j 8                 # 8 个并发请求批改
+    python main.py homework/week15 --no-cache           # 不读写响应缓存
+    python main.py homework/week15 -j 8 --hedge         # 慢请求发对冲请求，降低尾延迟
+    python main.py homework/week15 --cascade-model gpt-4o-mini  # 先用便宜模型批改，必要时升级到强模型
+    python main.py homework/week15 --pack               # 小提交打包进同一个请求，题目只发送一次
+    python main.py homework/week15 --checks             # 先本地编译并运行 statements/tests/ 中的测试用例
+    python main.py "homework/week*" --plan -j 16 --pack # 预估 token、各模型费用和耗时，不调用 API
+    python main.py homework/week14 homework/week15      # 多个作业共享并发和限流，一起批改
+    python main.py "homework/week*" -o output/          # 结果写入 output/week14/、output/week15/ ...
+    python main.py homework/week15 -o /mnt/share/w15 --worker  # 每台机器运行同一命令，共享任务队列
+    python main.py report homework/week15               # 从结果存储重新生成 results.json 和 report.md
+    python main.py export homework/week15 --file grades.csv    # 导出成绩表（CSV / JSON）
+    python main.py status homework/week15               # 查看批改进度、失败的学生和未完成的任务
+    （report / export / status 只读取已有结果，不需要 OPENAI_API_KEY，详见 python main.py status -h）
 
 作业目录结构要求:
     homework/week15/
     ├── statements/          # 题目描述目录
     │   ├── homework.md      # 作业描述和评分标准
-    │   └── *.h/*.cpp/...    # 附件文件（可选）
+    │   ├── *.h/*.cpp/...    # 附件文件（可选）
+    │   ├── link/            # 与学生提交一起编译的源文件（可选，用于 --checks）
+    │   └── tests/           # 测试用例 *.in / *.out（可选，用于 --checks）
     ├── assignments/         # 学生作业目录
     │   ├── 学号1/
     │   └── 学号2/
@@ -43,7 +117,8 @@ def main():
     parser.add_argument(
         "homework_dir",
         type=str,
-        help="作业目录路径，例如 homework/week15"
+        nargs="+",
+        help="作业目录路径，例如 homework/week15；可指定多个或使用通配符"
     )
     parser.add_argument(
         "--regrade", "-r",
@@ -56,65 +131,202 @@ def main():
         action="store_true",
         help="自动重新批改所有上次批改失败的学生"
     )
+    parser.add_argument(
+        "--incremental", "-i",
+        action="store_true",
+        help="只批改提交内容（或题目）自上次批改后发生变化的学生，以及新增的学生"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断的结果日志（journal.jsonl）继续，只批改尚未完成的学生；需使用与上次相同的参数"
+    )
     parser.add_argument(
         "--output-dir", "-o",
         type=str,
         metavar="DIR",
         help="指定输出目录，默认为作业目录下的 results/"
     )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="通过 Batch API 提交所有请求并轮询结果（价格更低、配额独立，但可能需要数小时）；"
+             "与 --resume 同用时继续轮询上次未完成的 batch"
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="检测重复提交（去除注释和空白后相同），每组只批改一次并把结果复用给组内所有学生"
+    )
+    parser.add_argument(
+        "--similarity",
+        action="store_true",
+        help="基于 MinHash/LSH 检测全体学生中的相似提交，在输出目录生成 similarity.md 和 similarity.json"
+    )
+    parser.add_argument(
+        "--worker",
+        action="store_true",
+        help="作为分布式工作进程运行：多台机器使用同一个（共享文件系统上的）输出目录，从任务队列领取学生"
+    )
+    parser.add_argument(
+        "--concurrency", "-j",
+        type=int,
+        metavar="N",
+        help="同时进行的 LLM 请求数，默认读取环境变量 CONCURRENCY（未设置时为 1）"
+    )
+    parser.add_argument(
+        "--prompt-layout",
+        choices=["classic", "prefix"],
+        help="prompt 布局：classic 为原始布局；prefix 将题目和附件放在所有学生相同的前缀中，"
+             "以命中服务商的前缀缓存。默认读取环境变量 PROMPT_LAYOUT（未设置时为 classic）"
+    )
+    parser.add_argument(
+        "--response-format",
+        choices=["text", "json_object", "json_schema"],
+        help="要求模型使用的响应格式：json_schema 使用结构化输出严格约束字段（需服务商支持）。"
+             "默认读取环境变量 RESPONSE_FORMAT（未设置时为 text）"
+    )
+    parser.add_argument(
+        "--checks",
+        action="store_true",
+        help="调用 LLM 之前在本地编译 C/C++ 提交并运行 statements/tests/ 中的测试用例，结果附在 prompt 中；"
+             "设置 CHECK_SHORT_CIRCUIT 后编译失败的提交不再调用 LLM"
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="只读取文件、渲染 prompt 并统计 token，预估各模型的费用和按当前并发、限流的耗时，不调用 API；"
+             "结果写入输出目录的 plan.json，未变化的学生下次直接复用"
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="把多名学生（匿名）的提交打包进同一个请求，题目和附件只发送一次；"
+             "每个请求的提交 token 上限和人数由 PACK_MAX_TOKENS、PACK_MAX_STUDENTS 控制"
+    )
+    parser.add_argument(
+        "--cascade-model",
+        metavar="MODEL",
+        default=None,
+        help="级联批改：先用该（便宜、快速的）模型批改，分数处于临界区间、置信度低、"
+             "结果自相矛盾或批改失败时再交给 OPENAI_MODEL。默认读取环境变量 CASCADE_MODEL"
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        default=None,
+        help="启用对冲请求：请求耗时超过近期 p95 延迟时再发一次相同请求，采用先返回的结果。"
+             "默认读取环境变量 HEDGE_REQUESTS"
+    )
+    cache_group = parser.add_mutually_exclusive_group()
+    cache_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不读取也不写入响应缓存"
+    )
+    cache_group.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="忽略已有缓存重新调用 API，并用新结果更新缓存"
+    )
 
     args = parser.parse_args()
 
-    # 验证目录存在
-    homework_path = Path(args.homework_dir)
-    if not homework_path.exists():
-        print(f"错误: 目录不存在: {homework_path}")
-        sys.exit(1)
+    homework_paths = expand_homework_paths(args.homework_dir)
 
-    if not homework_path.is_dir():
-        print(f"错误: 路径不是目录: {homework_path}")
+    if args.concurrency is not None and args.concurrency < 1:
+        print(f"错误: 并发数必须为正整数: {args.concurrency}")
         sys.exit(1)
 
-    # 验证必要的文件和目录存在
-    statements_dir = homework_path / "statements"
-    if not statements_dir.exists():
-        print(f"错误: 找不到题目描述目录: {statements_dir}")
+    if args.worker and (args.batch or args.resume):
+        print("错误: --worker 不能与 --batch 或 --resume 同时使用（任务队列本身即可断点续批）")
         sys.exit(1)
 
-    homework_md = statements_dir / "homework.md"
-    if not homework_md.exists():
-        print(f"错误: 找不到作业描述文件: {homework_md}")
+    if args.pack and (args.batch or args.worker or args.cascade_model):
+        print("错误: --pack 不能与 --batch、--worker 或 --cascade-model 同时使用")
         sys.exit(1)
 
-    assignments_dir = homework_path / "assignments"
-    if not assignments_dir.exists():
-        print(f"错误: 找不到学生作业目录: {assignments_dir}")
+    if args.plan and (args.batch or args.worker or args.regrade or args.regrade_failed
+                      or args.incremental or args.resume):
+        print("错误: --plan 预估全部学生的批改，不能与 --batch、--worker、-r、-f、-i 或 --resume 同时使用")
         sys.exit(1)
 
-    # 确定输出目录
-    output_dir = Path(args.output_dir) if args.output_dir else homework_path / "results"
+    homeworks = []
+    for homework_path in homework_paths:
+        validate_homework_dir(homework_path)
+
+        # 确定输出目录：多个作业时在指定目录下按作业名分开
+        if args.output_dir:
+            output_dir = Path(args.output_dir)
+            if len(homework_paths) > 1:
+                output_dir = output_dir / homework_path.name
+        else:
+            output_dir = homework_path / "results"
 
-    # 重新批改模式需要检查结果文件是否存在
-    is_regrade_mode = bool(args.regrade) or args.regrade_failed
-    if is_regrade_mode:
-        result_file = output_dir / "results.json"
-        if not result_file.exists():
-            print(f"错误: 重新批改模式需要先有批改结果，但未找到: {result_file}")
-            print("提示: 请先运行全量批改：python main.py " + str(homework_path))
+        # 重新批改模式需要检查结果文件是否存在
+        is_regrade_mode = bool(args.regrade) or args.regrade_failed
+        if is_regrade_mode:
+            result_file = output_dir / "results.json"
+            if not result_file.exists() and not (output_dir / "results.sqlite3").exists():
+                print(f"错误: 重新批改模式需要先有批改结果，但未找到: {result_file}")
+                print("提示: 请先运行全量批改：python main.py " + str(homework_path))
+                sys.exit(1)
+
+        homeworks.append((str(homework_path), output_dir))
+
+    if args.plan:
+        from src.config import Config
+        from src.planner import plan_homeworks, print_plan, summarize_plans
+
+        try:
+            plans = plan_homeworks(homeworks, layout=args.prompt_layout, pack=args.pack)
+            summary = summarize_plans(
+                plans, concurrency=args.concurrency or Config.CONCURRENCY,
+                cascade_model=args.cascade_model or Config.CASCADE_MODEL
+            )
+        except ValueError as e:
+            print(f"配置错误: {e}")
             sys.exit(1)
+        print_plan(plans, summary)
+        return
 
     # 运行批改流程
     try:
         from src.pipeline import GradingPipeline
 
-        pipeline = GradingPipeline()
-        pipeline.run(
-            str(homework_path),
-            output_dir=str(output_dir),
+        if args.no_cache:
+            cache_mode = "off"
+        elif args.refresh_cache:
+            cache_mode = "refresh"
+        else:
+            cache_mode = "use"
+
+        pipeline = GradingPipeline(
+            concurrency=args.concurrency,
+            cache_mode=cache_mode,
+            prompt_layout=args.prompt_layout,
+            response_format=args.response_format,
+            hedge=args.hedge,
+            cascade_model=args.cascade_model
+        )
+        pipeline.run_many(
+            homeworks,
             regrade_students=args.regrade,
-            regrade_failed=args.regrade_failed
+            regrade_failed=args.regrade_failed,
+            incremental=args.incremental,
+            resume=args.resume,
+            batch=args.batch,
+            dedup=args.dedup,
+            similarity=args.similarity,
+            distributed=args.worker,
+            pack=args.pack,
+            checks=args.checks
         )
 
+    except KeyboardInterrupt:
+        print("\n批改已中断，已完成的结果保存在输出目录的 journal.jsonl 中")
+        print("提示: 使用相同参数加上 --resume 继续批改")
+        sys.exit(130)
     except ValueError as e:
         print(f"配置错误: {e}")
         sys.exit(1)
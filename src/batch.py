@@ -0,0 +1,170 @@
+"""Batch API 批改模块：离线批量提交请求，轮询完成后回填批改结果"""
+
+import json
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from .config import Config
+from .grader import Grader, GradingResult
+from .output_writer import atomic_write
+
+# Batch 的终止状态
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchGrader:
+    """
+    通过 OpenAI Batch API 批改
+
+    流程：渲染每个学生的请求写入 JSONL → 上传文件 → 创建 batch →
+    轮询直到结束 → 下载输出，用 Grader 的解析逻辑转换为 GradingResult。
+    batch 信息保存在 state_file 中，进程中断后可以继续轮询同一个 batch。
+    """
+
+    def __init__(self, grader: Grader, work_dir: Path,
+                 poll_interval: Optional[float] = None):
+        self.grader = grader
+        self.work_dir = Path(work_dir)
+        self.input_file = self.work_dir / "batch_input.jsonl"
+        self.state_file = self.work_dir / "batch_state.json"
+        self.poll_interval = poll_interval if poll_interval is not None else Config.BATCH_POLL_INTERVAL
+
+    def grade(self, requests: Dict[str, List[Dict[str, str]]],
+              resume: bool = False,
+              on_status: Optional[Callable[[str], None]] = None) -> Dict[str, GradingResult]:
+        """
+        批改一组请求
+
+        Args:
+            requests: {student_id: messages}
+            resume: 是否继续轮询 state_file 中记录的未完成 batch
+            on_status: 轮询时的状态回调
+
+        Returns:
+            {student_id: GradingResult}，输出中缺失的学生以错误结果返回
+        """
+        if not requests:
+            return {}
+
+        batch_id = self._load_batch_id() if resume else None
+        if batch_id is None:
+            batch_id = self.submit(requests)
+
+        batch = self.wait(batch_id, on_status=on_status)
+        results = self.collect(batch, requests)
+        self.state_file.unlink(missing_ok=True)
+        self.input_file.unlink(missing_ok=True)
+        return results
+
+    def write_input_file(self, requests: Dict[str, List[Dict[str, str]]]) -> Path:
+        """将请求渲染为 Batch API 的 JSONL 输入文件"""
+        with atomic_write(self.input_file) as f:
+            for student_id, messages in requests.items():
+                line = {
+                    "custom_id": student_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.grader.build_request_body(messages)
+                }
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return self.input_file
+
+    def submit(self, requests: Dict[str, List[Dict[str, str]]]) -> str:
+        """上传输入文件并创建 batch，返回 batch id"""
+        input_path = self.write_input_file(requests)
+        with open(input_path, "rb") as f:
+            uploaded = self.grader.client.files.create(file=f, purpose="batch")
+
+        batch = self.grader.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window=Config.BATCH_COMPLETION_WINDOW
+        )
+
+        with atomic_write(self.state_file) as f:
+            json.dump({"batch_id": batch.id, "input_file_id": uploaded.id}, f)
+        return batch.id
+
+    def wait(self, batch_id: str, on_status: Optional[Callable[[str], None]] = None):
+        """轮询 batch 直到进入终止状态"""
+        while True:
+            batch = self.grader.client.batches.retrieve(batch_id)
+            if on_status is not None:
+                counts = batch.request_counts
+                progress = f" ({counts.completed}/{counts.total})" if counts else ""
+                on_status(f"{batch.status}{progress}")
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            time.sleep(self.poll_interval)
+
+    def collect(self, batch, requests: Dict[str, List[Dict[str, str]]]) -> Dict[str, GradingResult]:
+        """下载 batch 输出并解析为批改结果"""
+        results: Dict[str, GradingResult] = {}
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.grader.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                student_id = entry.get("custom_id")
+                if student_id in requests:
+                    results[student_id] = self._parse_entry(student_id, requests[student_id], entry)
+
+        for student_id in requests:
+            if student_id not in results:
+                results[student_id] = GradingResult(
+                    student_id=student_id,
+                    score=0,
+                    comments="",
+                    deductions=[],
+                    error=f"批量请求未返回结果 (batch 状态: {batch.status})"
+                )
+
+        return results
+
+    def _parse_entry(self, student_id: str, messages: List[Dict[str, str]],
+                     entry: Dict) -> GradingResult:
+        """解析 batch 输出中的一行"""
+        response = entry.get("response") or {}
+        body = response.get("body") or {}
+        if entry.get("error") or response.get("status_code") != 200:
+            error = entry.get("error") or body.get("error") or response.get("status_code")
+            return GradingResult(
+                student_id=student_id,
+                score=0,
+                comments="",
+                deductions=[],
+                error=f"API 调用失败: {error}"
+            )
+
+        result_text = (body["choices"][0]["message"]["content"] or "").strip()
+        usage = None
+        if body.get("usage"):
+            details = body["usage"].get("prompt_tokens_details") or {}
+            usage = {
+                "prompt_tokens": body["usage"].get("prompt_tokens", 0),
+                "completion_tokens": body["usage"].get("completion_tokens", 0),
+                "cached_tokens": details.get("cached_tokens") or 0
+            }
+
+        try:
+            return self.grader.result_from_response(student_id, messages, result_text, usage)
+        except json.JSONDecodeError as e:
+            return GradingResult(
+                student_id=student_id,
+                score=0,
+                comments="",
+                deductions=[],
+                error=f"JSON 解析失败: {e}. 原始响应: {result_text[:500]}",
+                usage=usage
+            )
+
+    def _load_batch_id(self) -> Optional[str]:
+        if not self.state_file.exists():
+            return None
+        with open(self.state_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("batch_id")
@@ -0,0 +1,214 @@
+"""
+批改流水线压测：在子进程中启动本地模拟服务，生成合成作业目录，运行 GradingPipeline 并报告吞吐量、尾延迟和内存
+
+用法:
+    python -m src.benchmark --students 500 -j 16 --latency lognormal:0.8,0.5
+    python -m src.benchmark --students 200 -j 8 --error-429 0.05 --error-500 0.02 --malformed 0.03 --rpm 600
+    python -m src.benchmark --students 1000 -j 32 --json bench.json    # 保存结果，便于对比不同版本
+"""
+
+import argparse
+import json
+import multiprocessing
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，不统计内存
+    resource = None
+
+from .mock_server import FaultConfig, add_fault_arguments, create_server, fault_config_from_args
+
+_STATEMENT = """# 压测作业：整数集合
+
+实现 IntegerSet 类，支持插入、删除、并集、交集和打印。
+
+## 评分标准（满分100分）
+- 插入和删除：30分
+- 并集和交集：40分
+- 打印格式：10分
+- 代码风格：20分
+"""
+
+_FUNCTION_TEMPLATE = """// {comment}
+int {name}(int a, int b) {{
+    int result = 0;
+    for (int i = 0; i < a; ++i) {{
+        result += (i * {factor} + b) % {modulus};
+    }}
+    return result;
+}}
+"""
+
+
+def generate_homework(root: Path, name: str = "bench", students: int = 100,
+                      files_per_student: int = 2, functions_per_file: int = 20,
+                      duplicate_rate: float = 0.0, seed: int = 0) -> Path:
+    """
+    生成合成作业目录 root/name/{statements,assignments}
+
+    每个学生 files_per_student 个 .cpp 文件，每个文件 functions_per_file 个函数；
+    duplicate_rate 比例的学生复制前一个学生的提交（用于测试 --dedup）
+    """
+    rng = random.Random(seed)
+    homework_dir = Path(root) / name
+    statements_dir = homework_dir / "statements"
+    statements_dir.mkdir(parents=True, exist_ok=True)
+    (statements_dir / "homework.md").write_text(_STATEMENT, encoding="utf-8")
+
+    previous: Optional[Dict[str, str]] = None
+    for index in range(students):
+        student_dir = homework_dir / "assignments" / f"{2025000000 + index}"
+        student_dir.mkdir(parents=True, exist_ok=True)
+        if previous is not None and rng.random() < duplicate_rate:
+            files = previous
+        else:
+            files = {
+                f"part{file_index}.cpp": "\n".join(
+                    _FUNCTION_TEMPLATE.format(
+                        comment=f"student {index} function {fn}",
+                        name=f"f{file_index}_{fn}",
+                        factor=rng.randint(1, 97),
+                        modulus=rng.randint(2, 1009)
+                    )
+                    for fn in range(functions_per_file)
+                )
+                for file_index in range(files_per_student)
+            }
+        for filename, content in files.items():
+            (student_dir / filename).write_text(content, encoding="utf-8")
+        previous = files
+
+    return homework_dir
+
+
+def _serve(faults: FaultConfig, port_queue, stats_queue, stop_event):
+    """子进程入口：启动模拟服务，收到停止信号后回传统计"""
+    server = create_server("127.0.0.1", 0, faults=faults)
+    port_queue.put(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    stop_event.wait()
+    server.shutdown()
+    stats_queue.put(dict(server.RequestHandlerClass.state.stats))
+
+
+def _peak_rss_mb() -> Optional[float]:
+    """当前进程的峰值常驻内存（MB）"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    """按参数运行一次压测，返回报告字典"""
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="grade-bench-"))
+    print(f"生成合成作业: {args.students} 名学生 → {work_dir}")
+    homework_dir = generate_homework(
+        work_dir, students=args.students, files_per_student=args.files,
+        functions_per_file=args.functions, duplicate_rate=args.duplicate_rate, seed=args.seed or 0
+    )
+
+    context = multiprocessing.get_context("spawn")
+    port_queue, stats_queue, stop_event = context.Queue(), context.Queue(), context.Event()
+    server_process = context.Process(
+        target=_serve, args=(fault_config_from_args(args), port_queue, stats_queue, stop_event)
+    )
+    server_process.start()
+    port = port_queue.get(timeout=30)
+
+    # Config 在导入时读取环境变量，压测时直接指向本地模拟服务
+    from .config import Config
+    Config.OPENAI_API_KEY = Config.OPENAI_API_KEY or "benchmark"
+    Config.OPENAI_BASE_URL = f"http://127.0.0.1:{port}/v1"
+
+    from .metrics import summarize_metrics
+    from .pipeline import GradingPipeline
+
+    try:
+        pipeline = GradingPipeline(concurrency=args.concurrency, cache_mode="off",
+                                   response_format=args.response_format)
+        started = time.monotonic()
+        results = pipeline.run(str(homework_dir), output_dir=str(work_dir / "results"),
+                               dedup=args.dedup, pack=args.pack)
+        elapsed = time.monotonic() - started
+    finally:
+        stop_event.set()
+        server_stats = stats_queue.get(timeout=30)
+        server_process.join(timeout=30)
+        if not args.work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    metrics = summarize_metrics(results, elapsed)
+    return {
+        "students": len(results),
+        "concurrency": args.concurrency,
+        "faults": {
+            "latency": args.latency, "error_429": args.error_429, "error_500": args.error_500,
+            "malformed": args.malformed, "rpm": args.rpm
+        },
+        "elapsed": round(elapsed, 3),
+        "students_per_second": round(len(results) / elapsed, 2) if elapsed else None,
+        "failed": sum(1 for r in results if r.error is not None),
+        "attempts": metrics["attempts"],
+        "rate_limited": metrics["rate_limited"],
+        "json_repairs": metrics["json_repairs"],
+        "wall_time": metrics["wall_time"],
+        "latency": metrics["latency"],
+        "peak_rss_mb": _peak_rss_mb(),
+        "server": server_stats,
+    }
+
+
+def print_report(report: Dict):
+    print("\n" + "=" * 50)
+    print("压测结果")
+    print("=" * 50)
+    print(f"学生数: {report['students']}，并发数: {report['concurrency']}，失败: {report['failed']}")
+    print(f"总耗时: {report['elapsed']:.2f}s，吞吐量: {report['students_per_second']} 人/秒")
+    for name, label in (("wall_time", "单个学生耗时"), ("latency", "请求延迟")):
+        q = report[name]
+        if q["p50"] is not None:
+            print(f"{label}: p50 {q['p50']:.3f}s / p95 {q['p95']:.3f}s / p99 {q['p99']:.3f}s")
+    print(f"API 请求: {report['attempts']} 次，被限流 {report['rate_limited']} 次，"
+          f"JSON 修复请求 {report['json_repairs']} 次")
+    print(f"模拟服务响应: {report['server']}")
+    if report["peak_rss_mb"] is not None:
+        print(f"峰值内存: {report['peak_rss_mb']:.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批改流水线压测（使用本地模拟服务，不消耗 API 额度）")
+    parser.add_argument("--students", type=int, default=200, help="合成学生数")
+    parser.add_argument("--files", type=int, default=2, help="每个学生的文件数")
+    parser.add_argument("--functions", type=int, default=20, help="每个文件的函数数（控制提交大小）")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="重复提交的学生比例")
+    parser.add_argument("--concurrency", "-j", type=int, default=8, help="并发请求数")
+    parser.add_argument("--dedup", action="store_true", help="启用重复提交检测")
+    parser.add_argument("--pack", action="store_true", help="启用多名学生打包请求")
+    parser.add_argument("--response-format", choices=["text", "json_object", "json_schema"], default=None)
+    parser.add_argument("--work-dir", help="合成作业和结果的目录（指定时不会删除），默认使用临时目录")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    parser.add_argument("--json", dest="json_path", help="把压测结果写入 JSON 文件")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"压测结果已保存: {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""级联批改模块：先用便宜的快速模型批改，满足升级条件时再交给强模型"""
+
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from .config import Config
+
+# 升级原因及说明（写入 results.json 的 escalation 字段，并在摘要中统计）
+ESCALATION_REASONS = {
+    "failed": "便宜模型批改失败（请求失败或输出无法解析）",
+    "borderline": "分数落在临界区间",
+    "low_confidence": "模型自评置信度低",
+    "inconsistent": "分数与扣分项不一致",
+    "check_mismatch": "分数与确定性检查结果不一致",
+}
+
+
+@lru_cache(maxsize=None)
+def parse_band(spec: str) -> Optional[Tuple[int, int]]:
+    """解析临界分数区间，如 "55,75"；空字符串表示不按分数升级（按字符串缓存，每个配置值只解析一次）"""
+    if not spec.strip():
+        return None
+    try:
+        low, high = (int(part) for part in spec.split(","))
+    except ValueError:
+        raise ValueError(f"无效的临界分数区间: {spec}（格式为 LOW,HIGH，如 55,75）")
+    return min(low, high), max(low, high)
+
+
+def escalation_reason(score: int, deductions: list, error: Optional[str],
+                      confidence: Optional[float] = None,
+                      check_score: Optional[int] = None) -> Optional[str]:
+    """
+    判断便宜模型的批改结果是否需要交给强模型重新批改，返回升级原因（ESCALATION_REASONS 的键）
+
+    Args:
+        score / deductions / error: 便宜模型的批改结果
+        confidence: 模型自评置信度（0~1），未给出时不作为判断依据
+        check_score: 确定性检查（如编译、测试）给出的参考分数（可选）
+
+    Returns:
+        不需要升级时返回 None
+    """
+    if error is not None:
+        return "failed"
+
+    band = parse_band(Config.CASCADE_BORDERLINE)
+    if band is not None and band[0] <= score <= band[1]:
+        return "borderline"
+
+    if confidence is not None and confidence < Config.CASCADE_MIN_CONFIDENCE:
+        return "low_confidence"
+
+    # 满分 100 减去扣分合计应等于总分，明显不符说明模型输出自相矛盾
+    try:
+        deducted = sum(int(d.get("points", 0)) for d in deductions)
+    except (TypeError, ValueError, AttributeError):
+        return "inconsistent"
+    if deductions and abs(100 - deducted - score) > Config.CASCADE_SCORE_TOLERANCE:
+        return "inconsistent"
+
+    if check_score is not None and abs(check_score - score) > Config.CASCADE_SCORE_TOLERANCE:
+        return "check_mismatch"
+
+    return None
@@ -0,0 +1,259 @@
+"""确定性检查模块：在调用 LLM 之前用本地工具链编译学生提交并运行题目提供的测试用例"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from tqdm import tqdm
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块，无法限制内存
+    resource = None
+
+from .config import Config
+from .file_reader import is_ignored, load_ignore_patterns
+
+# 测试用例目录（位于 statements/ 下）：<名称>.in 为标准输入，<名称>.out 为期望输出
+TESTS_DIR_NAME = "tests"
+# 需要与学生提交一起编译的题目源文件目录（位于 statements/ 下），如测试驱动、库实现
+LINK_DIR_NAME = "link"
+
+_CXX_SUFFIXES = (".cpp", ".cc", ".cxx")
+_C_SUFFIXES = (".c",)
+_HEADER_SUFFIXES = (".h", ".hpp", ".hh")
+
+# 编译错误和程序输出写入报告时保留的最大字符数
+_MAX_MESSAGE_CHARS = 2000
+
+TEST_STATUS_LABELS = {
+    "passed": "通过",
+    "wrong_answer": "输出错误",
+    "timeout": "超时",
+    "runtime_error": "运行错误",
+}
+
+
+def load_test_cases(homework_dir: str) -> List[Tuple[str, Path, Path]]:
+    """读取 statements/tests/ 中成对的 .in / .out 测试用例，返回 [(名称, 输入文件, 期望输出文件), ...]"""
+    tests_dir = Path(homework_dir) / "statements" / TESTS_DIR_NAME
+    if not tests_dir.is_dir():
+        return []
+    cases = []
+    for input_file in sorted(tests_dir.glob("*.in")):
+        expected_file = input_file.with_suffix(".out")
+        if expected_file.exists():
+            cases.append((input_file.stem, input_file, expected_file))
+    return cases
+
+
+def normalize_output(text: str) -> str:
+    """比较输出时忽略行尾空白和末尾空行"""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def _limit_resources():
+    """子进程中执行：限制内存和输出文件大小"""
+    if resource is None:
+        return
+    memory = Config.CHECK_MEMORY_LIMIT_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    output = Config.CHECK_OUTPUT_LIMIT_MB * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_FSIZE, (output, output))
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= _MAX_MESSAGE_CHARS:
+        return text
+    return text[:_MAX_MESSAGE_CHARS] + "\n...[已截断]"
+
+
+def _compile_command(files: List[Path], binary: Path) -> Optional[List[str]]:
+    """根据源文件类型选择编译器，没有可编译的源文件时返回 None"""
+    sources = [path for path in files if path.suffix in _CXX_SUFFIXES + _C_SUFFIXES]
+    if any(path.suffix in _CXX_SUFFIXES for path in sources):
+        compiler, flags = Config.CHECK_CXX, Config.CHECK_CXXFLAGS
+    elif sources:
+        compiler, flags = Config.CHECK_CC, Config.CHECK_CFLAGS
+    else:
+        return None
+    return [compiler, *flags.split(), *(path.name for path in sources), "-o", binary.name]
+
+
+def _run_test(binary: Path, work_dir: Path, name: str, input_file: Path,
+              expected_file: Path) -> Dict:
+    with open(input_file, "rb") as stdin, tempfile.TemporaryFile() as stdout:
+        try:
+            process = subprocess.run(
+                [str(binary)], stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL,
+                cwd=str(work_dir), timeout=Config.CHECK_TIME_LIMIT,
+                preexec_fn=_limit_resources if resource is not None else None
+            )
+        except subprocess.TimeoutExpired:
+            return {"name": name, "status": "timeout"}
+        stdout.seek(0)
+        output = stdout.read().decode("utf-8", errors="replace")
+
+    if process.returncode != 0:
+        return {"name": name, "status": "runtime_error", "exit_code": process.returncode}
+    expected = expected_file.read_text(encoding="utf-8", errors="replace")
+    if normalize_output(output) != normalize_output(expected):
+        return {"name": name, "status": "wrong_answer", "output": _truncate(output)}
+    return {"name": name, "status": "passed"}
+
+
+def run_checks(homework_dir: str, student_id: str) -> Optional[Dict]:
+    """
+    编译单个学生的提交并运行测试用例（在进程池中执行）
+
+    statements/ 中的头文件和 statements/link/ 中的文件先复制到临时构建目录，学生文件再覆盖同名文件，
+    构建目录中的所有源文件一起编译。statements/ 下的其他源文件（如带 main 的参考答案）不参与编译。学生提交中没有 C/C++ 源文件或本机没有编译器时返回 None（不做检查）
+
+    Returns:
+        {"compiled": bool, "compile_error": str, "tests": [...], "passed": int, "total": int, "score": int | None}
+    """
+    student_dir = Path(homework_dir) / "assignments" / student_id
+    statements_dir = Path(homework_dir) / "statements"
+    patterns = load_ignore_patterns(homework_dir)
+    student_files = [
+        path for path in sorted(student_dir.iterdir())
+        if path.is_file() and not is_ignored(path.name, patterns)
+    ]
+    if not any(path.suffix in _CXX_SUFFIXES + _C_SUFFIXES for path in student_files):
+        return None
+
+    cases = load_test_cases(homework_dir)
+    with tempfile.TemporaryDirectory(prefix="grade_check_") as temp_dir:
+        work_dir = Path(temp_dir)
+        for path in sorted(statements_dir.iterdir()):
+            if path.is_file() and path.suffix in _HEADER_SUFFIXES:
+                shutil.copy(path, work_dir / path.name)
+        link_dir = statements_dir / LINK_DIR_NAME
+        if link_dir.is_dir():
+            for path in sorted(link_dir.iterdir()):
+                if path.is_file():
+                    shutil.copy(path, work_dir / path.name)
+        for path in student_files:
+            shutil.copy(path, work_dir / path.name)
+
+        binary = work_dir / "solution"
+        command = _compile_command(sorted(work_dir.iterdir()), binary)
+        try:
+            compiled = subprocess.run(
+                command, cwd=str(work_dir), capture_output=True,
+                timeout=Config.CHECK_COMPILE_TIMEOUT
+            )
+            compile_error = compiled.stderr.decode("utf-8", errors="replace")
+            ok = compiled.returncode == 0
+        except subprocess.TimeoutExpired:
+            compile_error, ok = f"编译超时（{Config.CHECK_COMPILE_TIMEOUT} 秒）", False
+        except FileNotFoundError:
+            # 本机没有安装编译器：不做检查，而不是把所有学生判为编译失败
+            return None
+
+        if not ok:
+            return {
+                "compiled": False,
+                "compile_error": _truncate(compile_error),
+                "tests": [],
+                "passed": 0,
+                "total": len(cases),
+                "score": 0 if cases else None
+            }
+
+        tests = [_run_test(binary, work_dir, *case) for case in cases]
+
+    passed = sum(1 for test in tests if test["status"] == "passed")
+    return {
+        "compiled": True,
+        "compile_error": "",
+        "tests": tests,
+        "passed": passed,
+        "total": len(tests),
+        # 测试通过率折算的参考分，供级联批改判断模型分数是否可信
+        "score": round(100 * passed / len(tests)) if tests else None
+    }
+
+
+def short_circuit_reason(check: Optional[Dict]) -> Optional[str]:
+    """
+    按 CHECK_SHORT_CIRCUIT 判断是否可以不调用 LLM 直接给出结果，返回原因说明
+
+    - compile：编译失败
+    - tests：编译失败，或有测试用例但一个都没有通过
+    """
+    mode = Config.CHECK_SHORT_CIRCUIT
+    if check is None or mode == "off":
+        return None
+    if not check["compiled"]:
+        return "程序无法编译"
+    if mode == "tests" and check["total"] and check["passed"] == 0:
+        return "所有测试用例均未通过"
+    return None
+
+
+def format_check_report(check: Dict) -> str:
+    """将检查结果格式化为附加在学生文件之后的 prompt 片段"""
+    lines = ["## 自动编译和测试结果（本地实际运行，供评分参考）"]
+    if not check["compiled"]:
+        lines.append("编译: 失败")
+        lines.append(f"```\n{check['compile_error']}\n```")
+        return "\n".join(lines)
+
+    lines.append("编译: 成功")
+    if check["total"]:
+        lines.append(f"测试用例: 通过 {check['passed']}/{check['total']}")
+        for test in check["tests"]:
+            lines.append(f"- {test['name']}: {TEST_STATUS_LABELS[test['status']]}")
+            if test.get("output"):
+                lines.append(f"  实际输出:\n```\n{test['output']}\n```")
+    return "\n".join(lines)
+
+
+class CheckRunner:
+    """
+    在进程池中对学生提交运行确定性检查（多个作业共享同一个进程池）
+
+    schedule() 按顺序提交检查任务，批改线程调用 get() 时通常已经完成；
+    编译和测试都在子进程中运行，受 CHECK_TIME_LIMIT / CHECK_MEMORY_LIMIT_MB 限制
+    """
+
+    def __init__(self, max_workers: int = 0):
+        self._executor = ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self._futures: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, homework_dir: str, student_ids: List[str]):
+        with self._lock:
+            for student_id in student_ids:
+                self._submit(homework_dir, student_id)
+
+    def _submit(self, homework_dir: str, student_id: str) -> Future:
+        """提交检查任务（需持有锁）"""
+        future = self._executor.submit(run_checks, homework_dir, student_id)
+        self._futures[(homework_dir, student_id)] = future
+        return future
+
+    def get(self, homework_dir: str, student_id: str) -> Optional[Dict]:
+        """获取检查结果（阻塞直到完成，未提交过的学生立即提交），检查本身出错时返回 None"""
+        with self._lock:
+            future = self._futures.get((homework_dir, student_id))
+            if future is None:
+                future = self._submit(homework_dir, student_id)
+        try:
+            return future.result()
+        except Exception as e:
+            tqdm.write(f"警告: {student_id} 的编译测试检查失败: {e}")
+            return None
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=False)
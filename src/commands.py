@@ -0,0 +1,250 @@
+"""
+只读取已有批改结果的子命令（report / export / status）
+
+这些命令不导入 openai、不检查 API Key、不建立网络连接，在没有配置 API 的机器上也能使用
+"""
+
+import argparse
+import csv
+import glob
+import json
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .file_reader import list_student_folders
+from .result_manager import ResultManager
+from .work_queue import QUEUE_FILE_NAME, STATUS_DONE, STATUS_LEASED, STATUS_PENDING, WorkQueue
+
+COMMANDS = ("report", "export", "status")
+
+# 结果目录中标识已有批改结果的文件
+_RESULT_FILES = ("results.sqlite3", "results.json")
+
+
+def expand_homework_paths(patterns: List[str]) -> List[Path]:
+    """展开通配符（Windows 等 shell 不会自动展开），去除重复目录，没有匹配时打印错误并退出"""
+    homework_paths: List[Path] = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"错误: 没有匹配的目录: {pattern}")
+            sys.exit(1)
+        homework_paths.extend(Path(m) for m in matches if Path(m) not in homework_paths)
+    return homework_paths
+
+
+def _homework_name(output_dir: Path) -> Optional[str]:
+    """从报告片段索引或调用指标中读取作业名（不读取可能很大的 results.json）"""
+    for path in (output_dir / "report.d" / "index.json", output_dir / "metrics.json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)["homework"]
+        except (OSError, json.JSONDecodeError, KeyError):
+            continue
+    return None
+
+
+def resolve_targets(paths: List[Path], output_dir: Optional[str]) -> List[Tuple[str, Optional[Path], Path]]:
+    """
+    确定每个作业的结果目录，规则与批改时相同；也可以直接指定结果目录
+
+    Returns:
+        [(作业名, 作业目录（直接指定结果目录时为 None）, 结果目录), ...]
+    """
+    targets = []
+    for path in paths:
+        if any((path / name).exists() for name in _RESULT_FILES):
+            # 默认位置的结果目录（<作业目录>/results）可以找到学生目录，用于统计未批改的学生
+            in_homework = path.name == "results" and (path.parent / "assignments").is_dir()
+            name = _homework_name(path) or (path.parent.name if in_homework else path.name)
+            targets.append((name, path.parent if in_homework else None, path))
+            continue
+        if output_dir:
+            result_dir = Path(output_dir) / path.name if len(paths) > 1 else Path(output_dir)
+        else:
+            result_dir = path / "results"
+        targets.append((path.name, path, result_dir))
+    return targets
+
+
+def _open_results(result_dir: Path) -> Optional[ResultManager]:
+    manager = ResultManager(result_dir / "results.json")
+    if not manager.has_results():
+        print(f"错误: 没有找到批改结果: {result_dir}")
+        return None
+    return manager
+
+
+def cmd_report(args) -> int:
+    """从结果存储重新生成 results.json 和 report.md（沿用 metrics.json 中上次批改的调用指标）"""
+    targets = resolve_targets(expand_homework_paths(args.homework_dir), args.output_dir)
+    status = 0
+    for name, _, result_dir in targets:
+        manager = _open_results(result_dir)
+        if manager is None:
+            status = 1
+            continue
+        metrics = None
+        try:
+            with open(result_dir / "metrics.json", "r", encoding="utf-8") as f:
+                metrics = json.load(f).get("metrics")
+        except (OSError, json.JSONDecodeError):
+            pass
+        json_path, md_path = manager.export(name, str(result_dir), metrics=metrics)
+        manager.close()
+        print(f"{name}: 已重新生成 {json_path}、{md_path}")
+        if (result_dir / "journal.jsonl").exists():
+            print("  提示: 上次批改未完成，journal.jsonl 中的结果尚未写入报告（使用 --resume 继续批改）")
+    return status
+
+
+def cmd_export(args) -> int:
+    """导出成绩表（CSV 或 JSON），多个作业时附带作业名"""
+    targets = resolve_targets(expand_homework_paths(args.homework_dir), args.output_dir)
+    rows: List[Dict] = []
+    for name, _, result_dir in targets:
+        manager = _open_results(result_dir)
+        if manager is None:
+            return 1
+        for r in manager.iter_results():
+            if args.failed and r.error is None:
+                continue
+            row = {"student_id": r.student_id, "score": r.score, "error": r.error}
+            if len(targets) > 1:
+                row = dict(homework=name, **row)
+            rows.append(row)
+        manager.close()
+
+    keys = (["homework"] if len(targets) > 1 else []) + ["student_id", "score", "error"]
+    # CSV 文件带 BOM，Excel 可以直接打开中文内容
+    encoding = "utf-8-sig" if args.format == "csv" else "utf-8"
+    out = open(args.file, "w", encoding=encoding, newline="") if args.file else sys.stdout
+    try:
+        if args.format == "json":
+            json.dump(rows, out, ensure_ascii=False, indent=2)
+            out.write("\n")
+        else:
+            headers = {"homework": "作业", "student_id": "学号", "score": "分数", "error": "状态"}
+            writer = csv.writer(out)
+            writer.writerow([headers[key] for key in keys])
+            for row in rows:
+                error = row["error"]
+                row = dict(row, error="成功" if error is None else f"失败: {error}")
+                writer.writerow([row[key] for key in keys])
+    finally:
+        if args.file:
+            out.close()
+            print(f"已导出 {len(rows)} 条成绩: {args.file}")
+    return 0
+
+
+def cmd_status(args) -> int:
+    """打印每个作业的批改进度：已批改 / 失败 / 未批改人数，以及未完成的批改任务"""
+    targets = resolve_targets(expand_homework_paths(args.homework_dir), args.output_dir)
+    status = 0
+    for name, homework_dir, result_dir in targets:
+        manager = ResultManager(result_dir / "results.json")
+        has_assignments = homework_dir is not None and (homework_dir / "assignments").is_dir()
+        if not manager.has_results() and not has_assignments:
+            print(f"错误: 没有找到批改结果或作业目录: {result_dir}")
+            status = 1
+            continue
+        print(f"{name}（{result_dir}）")
+        graded: Dict[str, Optional[str]] = {}
+        scores: List[int] = []
+        if manager.has_results():
+            for r in manager.iter_results():
+                graded[r.student_id] = r.error
+                if r.error is None:
+                    scores.append(r.score)
+            manager.close()
+
+        failed = sorted(sid for sid, error in graded.items() if error is not None)
+        line = f"  已批改: {len(graded)} 人（成功 {len(scores)}，失败 {len(failed)}）"
+        if has_assignments:
+            students = list_student_folders(str(homework_dir))
+            line += f"，未批改: {sum(1 for sid in students if sid not in graded)} 人"
+        print(line)
+        if scores:
+            print(f"  平均分: {sum(scores) / len(scores):.2f}，最高分: {max(scores)}，最低分: {min(scores)}")
+        if failed:
+            print("  失败的学生:")
+            for sid in failed:
+                print(f"    - {sid}: {graded[sid]}")
+            status = 1 if args.check else status
+
+        journal_file = result_dir / "journal.jsonl"
+        if journal_file.exists():
+            with open(journal_file, "r", encoding="utf-8") as f:
+                done = sum(1 for line in f if line.strip())
+            print(f"  未完成的批改: 结果日志中已有 {done} 人（使用 --resume 继续）")
+        queue_file = result_dir / QUEUE_FILE_NAME
+        if queue_file.exists():
+            queue = WorkQueue(queue_file)
+            counts = queue.counts()
+            finalized = queue.is_finalized()
+            queue.close()
+            print(f"  分布式任务队列: 待领取 {counts[STATUS_PENDING]}，批改中 {counts[STATUS_LEASED]}，"
+                  f"已完成 {counts[STATUS_DONE]}" + ("（已汇总）" if finalized else ""))
+        batch_state = result_dir / "batch_state.json"
+        if batch_state.exists():
+            with open(batch_state, "r", encoding="utf-8") as f:
+                batch_id = json.load(f).get("batch_id")
+            print(f"  未完成的 Batch 任务: {batch_id}（使用 --batch --resume 继续轮询）")
+    return status
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="main.py",
+        description="读取已有批改结果（不调用 API，不需要 OPENAI_API_KEY）",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+示例:
+    python main.py report homework/week15               # 从 results.sqlite3 重新生成 results.json 和 report.md
+    python main.py export homework/week15 --file grades.csv  # 导出成绩表
+    python main.py export "homework/week*" --format json     # 多个作业的成绩输出到标准输出
+    python main.py status homework/week15               # 查看批改进度和失败的学生
+    python main.py status homework/week15/results       # 也可以直接指定结果目录
+        """
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name: str, help_text: str) -> argparse.ArgumentParser:
+        command = subparsers.add_parser(name, help=help_text, description=help_text)
+        command.add_argument(
+            "homework_dir",
+            nargs="+",
+            help="作业目录（或结果目录）路径，可指定多个或使用通配符"
+        )
+        command.add_argument(
+            "--output-dir", "-o",
+            metavar="DIR",
+            help="批改时指定的输出目录，默认为作业目录下的 results/"
+        )
+        return command
+
+    report = add_command("report", "从结果存储重新生成 results.json 和 report.md")
+    report.set_defaults(handler=cmd_report)
+
+    export = add_command("export", "导出成绩表")
+    export.add_argument("--format", choices=["csv", "json"], default="csv", help="导出格式，默认 csv")
+    export.add_argument("--file", metavar="FILE", help="导出到文件，默认输出到标准输出")
+    export.add_argument("--failed", action="store_true", help="只导出批改失败的学生")
+    export.set_defaults(handler=cmd_export)
+
+    status = add_command("status", "查看批改进度、失败的学生和未完成的批改任务")
+    status.add_argument("--check", action="store_true", help="有批改失败的学生时以状态码 1 退出（用于脚本）")
+    status.set_defaults(handler=cmd_status)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
@@ -11,6 +11,95 @@ class Config:
     MAX_TOKENS: int = int(os.getenv("MAX_TOKENS", "2000"))
     TEMPERATURE: float = float(os.getenv("TEMPERATURE", "0.3"))
     MAX_RETRIES: int = 3
+    CONCURRENCY: int = int(os.getenv("CONCURRENCY", "1"))
+    # 速率限制（0 表示不限制），与服务商配额保持一致
+    RPM_LIMIT: int = int(os.getenv("RPM_LIMIT", "0"))
+    TPM_LIMIT: int = int(os.getenv("TPM_LIMIT", "0"))
+    # 被限流（429）时的最大重试次数，不占用 MAX_RETRIES
+    MAX_RATE_LIMIT_RETRIES: int = int(os.getenv("MAX_RATE_LIMIT_RETRIES", "10"))
+    # 可重试错误的退避：第 n 次失败后在 [0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^(n-1))] 中随机等待
+    RETRY_BASE_DELAY: float = float(os.getenv("RETRY_BASE_DELAY", "1"))
+    RETRY_MAX_DELAY: float = float(os.getenv("RETRY_MAX_DELAY", "30"))
+    # 熔断器：连续 CIRCUIT_FAILURE_THRESHOLD 次服务端错误后暂停 CIRCUIT_RESET_SECONDS 秒（0 表示不启用），
+    # 单个请求等待服务恢复超过 CIRCUIT_MAX_OPEN_SECONDS 秒后失败
+    CIRCUIT_FAILURE_THRESHOLD: int = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+    CIRCUIT_RESET_SECONDS: float = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+    CIRCUIT_MAX_OPEN_SECONDS: float = float(os.getenv("CIRCUIT_MAX_OPEN_SECONDS", "300"))
+    # HTTP 连接超时和读取超时（秒），避免单个卡住的请求长时间阻塞批改
+    HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+    HTTP_READ_TIMEOUT: float = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+    # 是否启用 HTTP/2（需要安装 h2）
+    HTTP2: bool = os.getenv("HTTP2", "0").lower() in ("1", "true", "yes")
+    # 对冲请求：请求耗时超过最近成功请求的 HEDGE_PERCENTILE 分位延迟时再发一次，至少积累 HEDGE_MIN_SAMPLES 个样本后生效
+    HEDGE_REQUESTS: bool = os.getenv("HEDGE_REQUESTS", "0").lower() in ("1", "true", "yes")
+    HEDGE_PERCENTILE: float = float(os.getenv("HEDGE_PERCENTILE", "95"))
+    HEDGE_MIN_SAMPLES: int = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
+    # 响应缓存（SQLite），大小上限和过期时间为 0 表示不限制
+    CACHE_PATH: str = os.getenv("CACHE_PATH", ".grade_cache/responses.sqlite3")
+    CACHE_MAX_MB: float = float(os.getenv("CACHE_MAX_MB", "500"))
+    CACHE_MAX_AGE_DAYS: float = float(os.getenv("CACHE_MAX_AGE_DAYS", "30"))
+
+    # 预读学生文件的 I/O 线程数
+    IO_WORKERS: int = int(os.getenv("IO_WORKERS", "8"))
+    # 单个学生提交内容的 token 预算（0 表示不限制），超出部分截断
+    MAX_STUDENT_TOKENS: int = int(os.getenv("MAX_STUDENT_TOKENS", "32000"))
+
+    # 相似提交报告的 Jaccard 相似度阈值
+    SIMILARITY_THRESHOLD: float = float(os.getenv("SIMILARITY_THRESHOLD", "0.8"))
+
+    # 响应格式：text / json_object / json_schema（结构化输出，需服务商支持）
+    RESPONSE_FORMAT: str = os.getenv("RESPONSE_FORMAT", "text")
+    # 级联批改：CASCADE_MODEL 不为空时先用该模型批改，满足升级条件（分数在 CASCADE_BORDERLINE 区间内、
+    # 自评置信度低于 CASCADE_MIN_CONFIDENCE、分数与扣分项或确定性检查相差超过 CASCADE_SCORE_TOLERANCE、
+    # 批改失败）时再交给 OPENAI_MODEL
+    CASCADE_MODEL: str = os.getenv("CASCADE_MODEL", "")
+    CASCADE_BORDERLINE: str = os.getenv("CASCADE_BORDERLINE", "55,75")
+    CASCADE_MIN_CONFIDENCE: float = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.7"))
+    CASCADE_SCORE_TOLERANCE: int = int(os.getenv("CASCADE_SCORE_TOLERANCE", "10"))
+
+    # 请求打包：每个请求中学生提交的 token 合计上限和最多学生数
+    PACK_MAX_TOKENS: int = int(os.getenv("PACK_MAX_TOKENS", "6000"))
+    PACK_MAX_STUDENTS: int = int(os.getenv("PACK_MAX_STUDENTS", "8"))
+
+    # 编译测试预检查（--checks）：编译器和参数、编译超时（秒）、每个测试用例的运行时间（秒）、内存和输出上限（MB）、
+    # 进程数（0 表示 CPU 核数）；CHECK_SHORT_CIRCUIT 为 compile / tests 时编译失败（或测试全部未通过）不调用 LLM
+    CHECK_CXX: str = os.getenv("CHECK_CXX", "g++")
+    CHECK_CXXFLAGS: str = os.getenv("CHECK_CXXFLAGS", "-std=c++17 -O2")
+    CHECK_CC: str = os.getenv("CHECK_CC", "gcc")
+    CHECK_CFLAGS: str = os.getenv("CHECK_CFLAGS", "-std=c11 -O2")
+    CHECK_COMPILE_TIMEOUT: float = float(os.getenv("CHECK_COMPILE_TIMEOUT", "30"))
+    CHECK_TIME_LIMIT: float = float(os.getenv("CHECK_TIME_LIMIT", "2"))
+    CHECK_MEMORY_LIMIT_MB: int = int(os.getenv("CHECK_MEMORY_LIMIT_MB", "256"))
+    CHECK_OUTPUT_LIMIT_MB: int = int(os.getenv("CHECK_OUTPUT_LIMIT_MB", "16"))
+    CHECK_WORKERS: int = int(os.getenv("CHECK_WORKERS", "0"))
+    CHECK_SHORT_CIRCUIT: str = os.getenv("CHECK_SHORT_CIRCUIT", "off")
+
+    # 输出无法在本地修复时，先发送只包含该输出的修复请求，而不是重发完整 prompt
+    JSON_REPAIR_REQUEST: bool = os.getenv("JSON_REPAIR_REQUEST", "1").lower() in ("1", "true", "yes")
+
+    # Batch API 轮询间隔（秒）和完成时限
+    BATCH_POLL_INTERVAL: float = float(os.getenv("BATCH_POLL_INTERVAL", "30"))
+    BATCH_COMPLETION_WINDOW: str = os.getenv("BATCH_COMPLETION_WINDOW", "24h")
+
+    # 模型单价（每百万 token，用于估算费用），均为 0 时不估算；缓存命中的输入单价未设置时按普通输入计
+    PRICE_INPUT_PER_1M: float = float(os.getenv("PRICE_INPUT_PER_1M", "0"))
+    PRICE_CACHED_INPUT_PER_1M: float = float(os.getenv("PRICE_CACHED_INPUT_PER_1M", "0"))
+    PRICE_OUTPUT_PER_1M: float = float(os.getenv("PRICE_OUTPUT_PER_1M", "0"))
+    # 按模型配置单价，用于 --plan 对比不同模型的费用，格式为 "模型=输入/缓存输入/输出,..."，
+    # 如 "gpt-4o=2.5/1.25/10,gpt-4o-mini=0.15/0.075/0.6"；OPENAI_MODEL 未列出时使用上面的单价
+    MODEL_PRICES: str = os.getenv("MODEL_PRICES", "")
+    # --plan 估算时每个请求的输出 token 数和请求延迟（秒），结果目录中有上次批改的记录时优先使用实际值
+    PLAN_OUTPUT_TOKENS: int = int(os.getenv("PLAN_OUTPUT_TOKENS", "500"))
+    PLAN_LATENCY_SECONDS: float = float(os.getenv("PLAN_LATENCY_SECONDS", "20"))
+
+    # 分布式任务队列：租约时长（秒，崩溃的工作进程的任务在过期后被重新领取）和等待其他进程时的轮询间隔（秒）
+    QUEUE_LEASE_SECONDS: float = float(os.getenv("QUEUE_LEASE_SECONDS", "300"))
+    QUEUE_POLL_INTERVAL: float = float(os.getenv("QUEUE_POLL_INTERVAL", "5"))
+
+    SYSTEM_MESSAGE: str = "你是一个专业的编程作业批改助手。请严格按照要求返回 JSON 格式的批改结果。"
+    # prompt 布局：classic 全部放在 user 消息；prefix 把题目放进字节稳定的 system 前缀，便于服务商前缀缓存
+    PROMPT_LAYOUT: str = os.getenv("PROMPT_LAYOUT", "classic")
 
     GRADING_PROMPT_TEMPLATE: str = """你是一个编程作业批改助手。请根据以下作业要求和评分标准，对学生提交的代码进行批改。
 
@@ -35,8 +124,136 @@ class Config:
     ]
 }}"""
 
+    # prefix 布局：所有学生共享的部分（题目、附件、批改要求、输出格式）
+    GRADING_PREFIX_TEMPLATE: str = """{system_message}
+
+## 作业要求和评分标准
+{homework_description}
+{attachments_section}
+## 批改要求
+1. 仔细阅读学生提交的每个文件的内容
+2. 根据作业要求检查代码是否正确实现了所需功能
+3. 按照评分标准给出分数和评语
+4. 如果有扣分，请明确说明扣分原因和扣分点数
+
+## 请返回以下 JSON 格式的批改结果（只返回 JSON，不要其他内容）:
+{{
+    "score": <分数，整数，满分100>,
+    "comments": "<总体评语>",
+    "deductions": [
+        {{"reason": "<扣分原因>", "points": <扣分数>}}
+    ]
+}}"""
+
+    # prefix 布局：每个学生不同的部分，放在最后
+    GRADING_STUDENT_TEMPLATE: str = """## 学生提交的文件
+{student_files}
+
+请按照上述作业要求和评分标准批改以上文件，只返回 JSON。"""
+
+    # 打包请求（classic 布局）：一个请求批改多名匿名学生
+    GRADING_PACKED_TEMPLATE: str = """你是一个编程作业批改助手。请根据以下作业要求和评分标准，分别批改下面 {count} 名学生提交的代码。
+每名学生用编号（S1、S2 ...）区分，请各自独立评分，不要相互比较。
+
+## 作业要求和评分标准
+{homework_description}
+{attachments_section}
+## 学生提交
+{submissions}
+
+## 批改要求
+1. 仔细阅读每名学生的每个文件的内容
+2. 根据作业要求检查代码是否正确实现了所需功能
+3. 按照评分标准给出分数和评语
+4. 如果有扣分，请明确说明扣分原因和扣分点数
+
+## 请返回以下 JSON 格式的批改结果（只返回 JSON，不要其他内容），results 中每名学生一项:
+{{
+    "results": [
+        {{
+            "id": "<学生编号，如 S1>",
+            "score": <分数，整数，满分100>,
+            "comments": "<总体评语>",
+            "deductions": [
+                {{"reason": "<扣分原因>", "points": <扣分数>}}
+            ]
+        }}
+    ]
+}}"""
+
+    # 打包请求（prefix 布局）：沿用共享的 system 前缀，在 user 消息中改为按学生返回结果数组
+    GRADING_PACKED_STUDENTS_TEMPLATE: str = """## 学生提交
+本次共有 {count} 名学生，用编号（S1、S2 ...）区分，请各自独立评分，不要相互比较。
+
+{submissions}
+
+请按照上述作业要求和评分标准分别批改每名学生。不要返回单个批改结果，而是只返回以下 JSON，results 中每名学生一项:
+{{
+    "results": [
+        {{"id": "<学生编号，如 S1>", "score": <分数>, "comments": "<总体评语>", "deductions": [...]}}
+    ]
+}}"""
+
+    # 级联批改时附加在便宜模型请求末尾，要求自评置信度
+    CASCADE_CONFIDENCE_INSTRUCTION: str = """
+
+另外请在 JSON 中增加 "confidence" 字段（0 到 1 之间的小数），表示你对这个分数的把握程度；
+代码难以判断对错、评分标准存在歧义时请给出较低的值。"""
+
+    # JSON 修复请求：只包含无法解析的模型输出
+    JSON_REPAIR_TEMPLATE: str = """下面是一段批改结果，但不是合法的 JSON。请只修正格式，不要修改分数、评语和扣分项的内容。
+如果文本中没有给出分数，请返回 {{"error": "no score"}}。
+
+## 需要修正的批改结果
+{output}
+
+## 请返回以下 JSON 格式（只返回 JSON，不要其他内容）:
+{{
+    "score": <分数，整数，满分100>,
+    "comments": "<总体评语>",
+    "deductions": [
+        {{"reason": "<扣分原因>", "points": <扣分数>}}
+    ]
+}}"""
+
+    # json_schema 响应格式使用的批改结果结构
+    GRADING_RESPONSE_SCHEMA: dict = {
+        "type": "object",
+        "properties": {
+            "score": {"type": "integer", "description": "分数，满分100"},
+            "comments": {"type": "string", "description": "总体评语"},
+            "deductions": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "reason": {"type": "string", "description": "扣分原因"},
+                        "points": {"type": "integer", "description": "扣分数"}
+                    },
+                    "required": ["reason", "points"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["score", "comments", "deductions"],
+        "additionalProperties": False
+    }
+
     @classmethod
     def validate(cls) -> bool:
         if not cls.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY is not set. Please set it in .env file or environment variable.")
+        if cls.PROMPT_LAYOUT not in ("classic", "prefix"):
+            raise ValueError("PROMPT_LAYOUT must be 'classic' or 'prefix'.")
+        if cls.RESPONSE_FORMAT not in ("text", "json_object", "json_schema"):
+            raise ValueError("RESPONSE_FORMAT must be 'text', 'json_object' or 'json_schema'.")
+        if cls.CHECK_SHORT_CIRCUIT not in ("off", "compile", "tests"):
+            raise ValueError("CHECK_SHORT_CIRCUIT must be 'off', 'compile' or 'tests'.")
+        if cls.CONCURRENCY < 1:
+            raise ValueError("CONCURRENCY must be a positive integer.")
+        from .cascade import parse_band
+        try:
+            parse_band(cls.CASCADE_BORDERLINE)
+        except ValueError:
+            raise ValueError("CASCADE_BORDERLINE must be empty or 'LOW,HIGH' (e.g. '55,75').")
         return True
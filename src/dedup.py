@@ -0,0 +1,82 @@
+"""重复提交检测模块：规范化代码后按哈希分组，每组只批改一次"""
+
+import hashlib
+import re
+from typing import Dict, List
+
+# 字符串/字符字面量、注释、空白、标识符及其他字符
+_TOKEN_PATTERN = re.compile(
+    r'"(?:\\.|[^"\\\n])*"'          # 字符串字面量
+    r"|'(?:\\.|[^'\\\n])*'"         # 字符字面量
+    r"|//[^\n]*"                    # 单行注释
+    r"|/\*.*?(?:\*/|\Z)"            # 多行注释
+    r"|\s+"                         # 空白
+    r"|\w+"                         # 标识符、数字
+    r"|.",                          # 其他字符
+    re.DOTALL
+)
+
+
+def normalize_source(text: str) -> str:
+    """
+    去掉注释和多余空白，得到用于比较的规范化代码
+
+    字符串字面量保持原样；只在两个标识符之间保留一个空格
+    """
+    tokens: List[str] = []
+    pending_space = False
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group(0)
+        if token.startswith("//") or token.startswith("/*") or token.isspace():
+            pending_space = True
+            continue
+        if pending_space and tokens and (tokens[-1][-1:].isalnum() or tokens[-1][-1:] == "_") \
+                and (token[:1].isalnum() or token[:1] == "_"):
+            tokens.append(" ")
+        tokens.append(token)
+        pending_space = False
+    return "".join(tokens)
+
+
+def submission_fingerprint(files: List[Dict]) -> str:
+    """
+    计算提交的指纹：各文件规范化内容的哈希排序后再哈希
+
+    与文件名无关，只要所有文件的规范化内容相同即视为重复
+    """
+    file_digests = sorted(
+        hashlib.sha256(normalize_source(f["content"]).encode("utf-8")).hexdigest()
+        for f in files
+    )
+    return hashlib.sha256("\n".join(file_digests).encode("ascii")).hexdigest()
+
+
+def find_duplicates(fingerprints: Dict[str, str]) -> Dict[str, str]:
+    """
+    根据指纹分组
+
+    Returns:
+        {重复学生学号: 代表学号}，每组以学号最小的学生为代表，代表本身不在结果中
+    """
+    representatives: Dict[str, str] = {}
+    duplicate_of: Dict[str, str] = {}
+    for student_id in sorted(fingerprints):
+        fingerprint = fingerprints[student_id]
+        if fingerprint in representatives:
+            duplicate_of[student_id] = representatives[fingerprint]
+        else:
+            representatives[fingerprint] = student_id
+    return duplicate_of
+
+
+def build_duplicate_groups(students: List[Dict]) -> List[List[str]]:
+    """根据结果中的 duplicate_of 字段还原重复提交分组（代表在前）"""
+    groups: Dict[str, List[str]] = {}
+    for student in students:
+        representative = student.get("duplicate_of")
+        if representative:
+            groups.setdefault(representative, []).append(student["student_id"])
+    return [
+        [representative] + sorted(members)
+        for representative, members in sorted(groups.items())
+    ]
@@ -1,6 +1,151 @@
+import codecs
+import fnmatch
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict, Optional, Set, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # 可选依赖，未安装时使用估算
+    tiktoken = None
+
+# 默认忽略的文件：编译产物、IDE 配置、压缩包等
+# 只忽略 a.out 而不是 *.out：sample.out、expected.out 等常是 I/O 作业提交的期望输出，
+# 其他名字的二进制可执行文件由二进制检测处理
+DEFAULT_IGNORE_PATTERNS = [
+    "*.o", "*.obj", "*.exe", "a.out", "*.a", "*.so", "*.dll", "*.dylib",
+    "*.class", "*.pyc", "*.pdb", "*.ilk", "*.gch", "*.zip", "*.rar", "*.7z",
+    ".DS_Store", "Thumbs.db", ".vscode", ".idea", "*.swp",
+]
+
+# 作业目录下的忽略规则文件，每行一个 glob 模式，# 开头为注释
+IGNORE_FILE_NAME = ".gradeignore"
+
+# 判断二进制文件时读取的字节数
+BINARY_SNIFF_BYTES = 8192
+
+# 按 token 预算限制读取字节数时每个 token 对应的字节数上限：
+# 中文 UTF-8 约 3 字节/token，代码约 4 字节/token，缩进较多的代码可能更多，留出余量
+_MAX_BYTES_PER_TOKEN = 6
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """统计文本的 token 数（安装 tiktoken 时精确计算，否则按字符估算）"""
+    if tiktoken is not None:
+        return len(_get_encoding().encode(text, disallowed_special=()))
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截取文本开头不超过 max_tokens 个 token 的部分"""
+    if max_tokens <= 0:
+        return ""
+    if tiktoken is not None:
+        tokens = _get_encoding().encode(text, disallowed_special=())
+        return _get_encoding().decode(tokens[:max_tokens])
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    return text[:max(0, len(text) * max_tokens // total)]
+
+
+def load_ignore_patterns(homework_dir: str) -> List[str]:
+    """读取默认忽略规则和作业目录下 .gradeignore 中的规则"""
+    patterns = list(DEFAULT_IGNORE_PATTERNS)
+    ignore_file = Path(homework_dir) / IGNORE_FILE_NAME
+    if ignore_file.exists():
+        with open(ignore_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    patterns.append(line)
+    return patterns
+
+
+def is_ignored(filename: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in patterns)
+
+
+# 按 BOM 识别编码，UTF-32 需排在 UTF-16 前面（UTF-32 LE 的 BOM 以 UTF-16 LE 的 BOM 开头）
+_BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+# 无 BOM 且不是合法 UTF-8 时依次尝试的编码（学生代码常见 GBK）
+FALLBACK_ENCODINGS = ["gbk", "gb18030"]
+
+
+def is_binary_data(data: bytes) -> bool:
+    """数据开头包含 NUL 字节即视为二进制（UTF-16/32 的 BOM 文本除外）"""
+    if any(data.startswith(bom) for bom, _ in _BOM_ENCODINGS):
+        return False
+    return b"\0" in data[:BINARY_SNIFF_BYTES]
+
+
+def decode_bytes(data: bytes) -> str:
+    """根据字节内容识别编码并解码：BOM → UTF-8 校验 → GBK/GB18030 → UTF-8 替换非法字节"""
+    for bom, encoding in _BOM_ENCODINGS:
+        if data.startswith(bom):
+            return data.decode(encoding, errors="replace")
+
+    for encoding in ["utf-8"] + FALLBACK_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+
+    return data.decode("utf-8", errors="replace")
+
+
+def _decode_prefix(data: bytes) -> str:
+    """解码被截断的文件开头：依次尝试各编码，允许末尾有被截断的不完整字符"""
+    if not any(data.startswith(bom) for bom, _ in _BOM_ENCODINGS):
+        for encoding in ["utf-8"] + FALLBACK_ENCODINGS:
+            for cut in range(4):
+                try:
+                    return data[:len(data) - cut].decode(encoding)
+                except UnicodeDecodeError:
+                    continue
+    return decode_bytes(data)
+
+
+def read_text_prefix(path: Path, max_bytes: int = 0) -> Tuple[str, int, bool]:
+    """
+    读取文件并解码，max_bytes > 0 时最多读取 max_bytes 字节
+
+    Returns:
+        (内容, 文件字节数, 是否被截断)；二进制文件返回占位说明
+    """
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            data = f.read(max_bytes) if max_bytes > 0 else f.read()
+    except OSError as e:
+        return f"[无法读取文件: {e}]", 0, False
+
+    if is_binary_data(data):
+        return f"[已跳过二进制文件，大小 {size} 字节]", size, False
+    if max_bytes > 0 and size > len(data):
+        return _decode_prefix(data), size, True
+    return decode_bytes(data), size, False
+
+
+def read_text_file(path: Path) -> str:
+    """一次性读取文件字节并解码；二进制文件返回占位说明"""
+    return read_text_prefix(path)[0]
 
 
 def read_homework_description(homework_dir: str) -> str:
@@ -9,8 +154,8 @@ def read_homework_description(homework_dir: str) -> str:
     if not homework_path.exists():
         raise FileNotFoundError(f"Homework description file not found: {homework_path}")
 
-    with open(homework_path, "r", encoding="utf-8") as f:
-        return f.read()
+    with open(homework_path, "rb") as f:
+        return decode_bytes(f.read())
 
 
 def read_statement_attachments(homework_dir: str) -> List[Dict[str, str]]:
@@ -27,27 +172,10 @@ def read_statement_attachments(homework_dir: str) -> List[Dict[str, str]]:
     for item in sorted(statements_dir.iterdir()):
         # 排除 homework.md 和目录
         if item.is_file() and item.name.lower() != "homework.md":
-            try:
-                with open(item, "r", encoding="utf-8") as f:
-                    content = f.read()
-                attachments.append({
-                    "filename": item.name,
-                    "content": content
-                })
-            except UnicodeDecodeError:
-                # 尝试其他编码
-                try:
-                    with open(item, "r", encoding="gbk") as f:
-                        content = f.read()
-                    attachments.append({
-                        "filename": item.name,
-                        "content": content
-                    })
-                except Exception as e:
-                    attachments.append({
-                        "filename": item.name,
-                        "content": f"[无法读取文件: {e}]"
-                    })
+            attachments.append({
+                "filename": item.name,
+                "content": read_text_file(item)
+            })
 
     return attachments
 
@@ -78,40 +206,58 @@ def list_student_folders(homework_dir: str) -> List[str]:
     return student_folders
 
 
-def read_student_files(homework_dir: str, student_id: str) -> List[Dict[str, str]]:
+def read_student_files(homework_dir: str, student_id: str,
+                       token_budget: int = 0,
+                       ignore_patterns: Optional[List[str]] = None) -> List[Dict[str, Any]]:
     """
     读取单个学生的所有作业文件
 
-    返回格式: [{"filename": "Time.cpp", "content": "..."}, ...]
+    - 跳过匹配忽略规则的文件（默认规则 + 作业目录下的 .gradeignore）
+    - 二进制文件只保留占位说明
+    - token_budget > 0 时，超出预算的部分会被截断并加上明确的截断标记
+
+    返回格式: [{"filename": "Time.cpp", "content": "...", "tokens": 123}, ...]
     """
     student_dir = Path(homework_dir) / "assignments" / student_id
     if not student_dir.exists():
         raise FileNotFoundError(f"Student directory not found: {student_dir}")
 
+    if ignore_patterns is None:
+        ignore_patterns = load_ignore_patterns(homework_dir)
+
     files = []
+    remaining_budget = token_budget
     for item in sorted(student_dir.iterdir()):
-        if item.is_file():
-            try:
-                with open(item, "r", encoding="utf-8") as f:
-                    content = f.read()
-                files.append({
-                    "filename": item.name,
-                    "content": content
-                })
-            except UnicodeDecodeError:
-                # 尝试其他编码
-                try:
-                    with open(item, "r", encoding="gbk") as f:
-                        content = f.read()
-                    files.append({
-                        "filename": item.name,
-                        "content": content
-                    })
-                except Exception as e:
-                    files.append({
-                        "filename": item.name,
-                        "content": f"[无法读取文件: {e}]"
-                    })
+        if not item.is_file() or is_ignored(item.name, ignore_patterns):
+            continue
+
+        if token_budget <= 0:
+            content = read_text_file(item)
+            tokens = count_tokens(content)
+        elif remaining_budget <= 0:
+            # 预算已用完：不读取文件内容
+            content = (f"[已省略：该文件 {item.stat().st_size} 字节，"
+                       f"超出单个学生 {token_budget} tokens 的预算]")
+            tokens = count_tokens(content)
+            remaining_budget -= tokens
+        else:
+            # 只读取剩余预算可能用到的字节，避免把超大文件整个读入、解码并计算 token
+            content, size, truncated = read_text_prefix(item, remaining_budget * _MAX_BYTES_PER_TOKEN)
+            tokens = count_tokens(content)
+            if truncated or tokens > remaining_budget:
+                content = (
+                    truncate_to_tokens(content, remaining_budget)
+                    + f"\n[已截断：该文件共 {size} 字节，"
+                      f"超出单个学生 {token_budget} tokens 的预算]"
+                )
+                tokens = count_tokens(content)
+            remaining_budget -= tokens
+
+        files.append({
+            "filename": item.name,
+            "content": content,
+            "tokens": tokens
+        })
 
     return files
 
@@ -123,3 +269,71 @@ def format_student_files_for_prompt(files: List[Dict[str, str]]) -> str:
         formatted_parts.append(f"### 文件: {file_info['filename']}\n```\n{file_info['content']}\n```")
 
     return "\n\n".join(formatted_parts)
+
+
+class SubmissionLoader:
+    """
+    在线程池中预读学生文件
+
+    按批改顺序提前读取后续 prefetch 个学生的文件，批改线程调用 get() 时
+    通常已读取完成，文件 I/O 不再占用批改时间。
+    preloaded 为之前已读取的学生文件（如检测重复提交时读取的），这些学生不再读取，get() 后释放。
+    """
+
+    def __init__(self, homework_dir: str, student_ids: List[str],
+                 token_budget: int = 0, max_workers: int = 8, prefetch: int = 16,
+                 preloaded: Optional[Dict[str, List[Dict[str, Any]]]] = None):
+        self.homework_dir = homework_dir
+        self.student_ids = list(student_ids)
+        self.token_budget = token_budget
+        self.prefetch = max(1, prefetch)
+        self.ignore_patterns = load_ignore_patterns(homework_dir)
+        self._preloaded = dict(preloaded or {})
+        self._index = {sid: i for i, sid in enumerate(self.student_ids)}
+        self._futures: Dict[str, Future] = {}
+        self._submitted: Set[str] = set()
+        self._next_to_submit = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._schedule_until(self.prefetch)
+
+    def _schedule_until(self, end: int):
+        """提交读取任务直到第 end 个学生（需持有锁或在构造时调用）"""
+        end = min(end, len(self.student_ids))
+        while self._next_to_submit < end:
+            student_id = self.student_ids[self._next_to_submit]
+            if student_id not in self._submitted and student_id not in self._preloaded:
+                self._futures[student_id] = self._submit(student_id)
+            self._next_to_submit += 1
+
+    def _submit(self, student_id: str) -> Future:
+        self._submitted.add(student_id)
+        return self._executor.submit(
+            read_student_files, self.homework_dir, student_id,
+            self.token_budget, self.ignore_patterns
+        )
+
+    def get(self, student_id: str) -> List[Dict[str, Any]]:
+        """获取学生文件（阻塞直到读取完成），异常与 read_student_files 一致"""
+        with self._lock:
+            position = self._index.get(student_id, -1)
+            files = self._preloaded.pop(student_id, None)
+            future = None if files is not None else self._futures.pop(student_id, None)
+            if files is None and future is None:
+                future = self._submit(student_id)
+            self._schedule_until(position + 1 + self.prefetch)
+        return files if files is not None else future.result()
+
+    def close(self):
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._preloaded.clear()
+        self._executor.shutdown(wait=False)
+
+    def __enter__(self) -> "SubmissionLoader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
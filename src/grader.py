@@ -1,122 +1,631 @@
 import json
+import threading
 import time
-from typing import Dict, List, Optional
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from openai import APIError, OpenAI, RateLimitError
 
 from .config import Config
+from .cascade import escalation_reason
+from .json_repair import extract_json_object
+from .result import GradingResult
+from .packing import pack_label, packed_response_schema, split_packed_results
+from .prompts import build_messages, build_packed_messages
+from .rate_limiter import RateLimiter, estimate_tokens
+from .response_cache import ResponseCache, make_cache_key
+from .retry_policy import (
+    FATAL,
+    RATE_LIMITED,
+    RETRYABLE,
+    CircuitBreaker,
+    backoff_delay,
+    classify_error,
+    retry_after
+)
+from .transport import LatencyTracker, build_http_client, build_timeout, hedged_call
 
+# 缓存模式：use 读写缓存；refresh 忽略已有缓存但写入新结果；off 完全不使用
+CACHE_MODES = ("use", "refresh", "off")
 
-class GradingResult:
-    def __init__(self, student_id: str, score: int, comments: str,
-                 deductions: List[Dict], error: Optional[str] = None):
-        self.student_id = student_id
-        self.score = score
-        self.comments = comments
-        self.deductions = deductions
-        self.error = error
-
-    def to_dict(self) -> Dict:
-        return {
-            "student_id": self.student_id,
-            "score": self.score,
-            "comments": self.comments,
-            "deductions": self.deductions,
-            "error": self.error
-        }
+# 响应格式：text 不约束；json_object 要求输出 JSON；json_schema 使用结构化输出严格约束字段
+RESPONSE_FORMATS = ("text", "json_object", "json_schema")
 
 
 class Grader:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 1, cache_mode: str = "use",
+                 prompt_layout: Optional[str] = None,
+                 response_format: Optional[str] = None,
+                 hedge: Optional[bool] = None,
+                 cascade_model: Optional[str] = None):
         Config.validate()
-        client_kwargs = {"api_key": Config.OPENAI_API_KEY}
-        if Config.OPENAI_BASE_URL:
-            client_kwargs["base_url"] = Config.OPENAI_BASE_URL
-        self.client = OpenAI(**client_kwargs)
+        if cache_mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {cache_mode}")
+        self.prompt_layout = prompt_layout or Config.PROMPT_LAYOUT
+        if self.prompt_layout not in ("classic", "prefix"):
+            raise ValueError(f"未知的 prompt 布局: {self.prompt_layout}")
+        self.response_format = response_format or Config.RESPONSE_FORMAT
+        if self.response_format not in RESPONSE_FORMATS:
+            raise ValueError(f"未知的响应格式: {self.response_format}")
+        self.hedge = Config.HEDGE_REQUESTS if hedge is None else hedge
+        # 收到响应头时记录时间，用于计算首字节时间（TTFB）
+        self._timing = threading.local()
+        self._max_concurrency = max_concurrency
+        self._client: Optional[OpenAI] = None
+        self._client_lock = threading.Lock()
         self.model = Config.OPENAI_MODEL
+        # 级联批改的便宜模型，为空时只使用 self.model
+        self.cascade_model = (cascade_model if cascade_model is not None else Config.CASCADE_MODEL) or None
+        if self.cascade_model == self.model:
+            self.cascade_model = None
+        # 打包请求得到的结果单独缓存，不与单独批改的结果混用
+        self._packed_cache_model = f"{self.model}#packed"
         self.max_tokens = Config.MAX_TOKENS
         self.temperature = Config.TEMPERATURE
         self.max_retries = Config.MAX_RETRIES
+        self.max_rate_limit_retries = Config.MAX_RATE_LIMIT_RETRIES
+        self.rate_limiter = RateLimiter(
+            max_concurrency=max_concurrency,
+            rpm=Config.RPM_LIMIT,
+            tpm=Config.TPM_LIMIT
+        )
+        self.cache_mode = cache_mode
+        self.cache: Optional[ResponseCache] = None
+        if cache_mode != "off":
+            self.cache = ResponseCache(
+                Config.CACHE_PATH,
+                max_bytes=int(Config.CACHE_MAX_MB * 1024 * 1024),
+                max_age_days=Config.CACHE_MAX_AGE_DAYS
+            )
+        self.cache_hits = 0
+        # 服务连续出错时暂停发送请求，而不是让每个学生各自耗尽重试次数
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=Config.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=Config.CIRCUIT_RESET_SECONDS,
+            max_open=Config.CIRCUIT_MAX_OPEN_SECONDS
+        )
+        # 对冲请求：请求耗时超过近期 p95 延迟时再发一次相同请求，采用先返回的结果
+        self.latency_tracker = LatencyTracker(min_samples=Config.HEDGE_MIN_SAMPLES)
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        if self.hedge:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=max_concurrency * 2)
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def client(self) -> OpenAI:
+        """所有批改线程共享的客户端，第一次发送请求时才创建（全部命中缓存时不建立连接池）"""
+        with self._client_lock:
+            if self._client is None:
+                # 关闭 SDK 内置重试，429 交给调度器统一处理；连接池和超时按并发数配置
+                client_kwargs = {
+                    "api_key": Config.OPENAI_API_KEY,
+                    "max_retries": 0,
+                    "timeout": build_timeout(),
+                    "http_client": build_http_client(
+                        self._max_concurrency, hedge=self.hedge,
+                        event_hooks={"response": [self._on_response_headers]}
+                    )
+                }
+                if Config.OPENAI_BASE_URL:
+                    client_kwargs["base_url"] = Config.OPENAI_BASE_URL
+                self._client = OpenAI(**client_kwargs)
+            return self._client
 
     def grade_assignment(self, student_id: str, homework_description: str,
                          student_files_formatted: str,
-                         attachments_formatted: str = "") -> GradingResult:
-        """调用 LLM 批改单个学生的作业"""
-        # 构建附件部分
-        attachments_section = ""
-        if attachments_formatted:
-            attachments_section = f"\n## 作业附件（参考文件）\n{attachments_formatted}\n\n"
-
-        prompt = Config.GRADING_PROMPT_TEMPLATE.format(
-            homework_description=homework_description,
-            attachments_section=attachments_section,
-            student_files=student_files_formatted
+                         attachments_formatted: str = "",
+                         check_score: Optional[int] = None) -> GradingResult:
+        """
+        调用 LLM 批改单个学生的作业，结果附带调用指标
+
+        启用级联批改时先用便宜模型批改，满足升级条件时再用强模型重新批改；
+        check_score 为确定性检查给出的参考分数（可选），与便宜模型的分数相差过大时升级
+        """
+        messages = self.build_messages(
+            homework_description, student_files_formatted, attachments_formatted
         )
+        if self.cascade_model is None:
+            return self._count_cache_hit(self._grade_with_model(student_id, messages, self.model))
 
-        for attempt in range(self.max_retries):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "你是一个专业的编程作业批改助手。请严格按照要求返回 JSON 格式的批改结果。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=self.max_tokens,
-                    temperature=self.temperature
-                )
+        cheap_messages = [dict(m) for m in messages]
+        cheap_messages[-1]["content"] += Config.CASCADE_CONFIDENCE_INSTRUCTION
+        cheap = self._grade_with_model(student_id, cheap_messages, self.cascade_model, confidence=True)
+        reason = escalation_reason(
+            cheap.score, cheap.deductions, cheap.error, cheap.confidence, check_score
+        )
+        if reason is None:
+            cheap.tier = "cheap"
+            cheap.metrics["cheap_wall_time"] = cheap.metrics["wall_time"]
+            return self._count_cache_hit(cheap)
 
-                result_text = response.choices[0].message.content.strip()
+        strong = self._grade_with_model(student_id, messages, self.model)
+        strong.tier = "strong"
+        strong.escalation = reason
+        strong.confidence = cheap.confidence
+        if cheap.usage is not None and strong.usage is not None:
+            strong.usage = {key: cheap.usage[key] + strong.usage[key] for key in strong.usage}
+        else:
+            strong.usage = strong.usage or cheap.usage
+        cheap_metrics, strong_metrics = cheap.metrics, strong.metrics
+        strong.metrics = dict(
+            strong_metrics,
+            attempts=cheap_metrics.get("attempts", 0) + strong_metrics.get("attempts", 0),
+            # 升级到强模型的那次请求不是重试，只累计两个模型各自的重试次数
+            retries=(max(cheap_metrics.get("attempts", 0) - 1, 0)
+                     + max(strong_metrics.get("attempts", 0) - 1, 0)),
+            rate_limited=cheap_metrics.get("rate_limited", 0) + strong_metrics.get("rate_limited", 0),
+            wall_time=round(cheap_metrics["wall_time"] + strong_metrics["wall_time"], 3),
+            cheap_wall_time=cheap_metrics["wall_time"],
+            strong_wall_time=strong_metrics["wall_time"]
+        )
+        # 两个模型都命中缓存才算没有调用 API
+        strong.metrics.pop("cache_hit", None)
+        if cheap_metrics.get("cache_hit") and strong_metrics.get("cache_hit"):
+            strong.metrics["cache_hit"] = True
+        if cheap_metrics.get("repairs") or strong_metrics.get("repairs"):
+            strong.metrics["repairs"] = cheap_metrics.get("repairs", 0) + strong_metrics.get("repairs", 0)
+        return self._count_cache_hit(strong)
 
-                # 尝试解析 JSON
-                result_json = self._parse_json_response(result_text)
+    def _count_cache_hit(self, result: GradingResult) -> GradingResult:
+        """最终结果完全来自缓存时计入缓存命中（每个学生最多一次，级联批改的两次查询不重复计数）"""
+        if result.metrics and result.metrics.get("cache_hit"):
+            self.record_cache_hit()
+        return result
 
-                return GradingResult(
-                    student_id=student_id,
-                    score=result_json.get("score", 0),
-                    comments=result_json.get("comments", ""),
-                    deductions=result_json.get("deductions", [])
-                )
+    def record_cache_hit(self):
+        with self._stats_lock:
+            self.cache_hits += 1
+
+    def _grade_with_model(self, student_id: str, messages: List[Dict[str, str]], model: str,
+                          confidence: bool = False) -> GradingResult:
+        """用指定模型批改（先查询缓存），结果附带调用指标"""
+        started = time.monotonic()
+        cached_result = self.lookup_cache(student_id, messages, model, confidence)
+        if cached_result is not None:
+            cached_result.metrics = {
+                "wall_time": round(time.monotonic() - started, 3),
+                "attempts": 0,
+                "cache_hit": True
+            }
+            return cached_result
+
+        metrics = {"attempts": 0, "rate_limited": 0}
+        result = self._grade_with_retries(student_id, messages, metrics, model, confidence)
+        metrics["wall_time"] = round(time.monotonic() - started, 3)
+        result.metrics = metrics
+        return result
+
+    def grade_packed(self, homework_description: str, submissions: List[Tuple[str, str]],
+                     attachments_formatted: str = "") -> Dict[str, GradingResult]:
+        """
+        在一个请求中批改多名学生，题目和附件只发送一次
+
+        Args:
+            submissions: [(学号, 格式化后的学生文件), ...]。学号不会出现在 prompt 中，模型只看到 S1、S2 ... 编号
+
+        Returns:
+            {学号: 批改结果}。请求失败、输出无法解析、条目缺失或不合法的学生不在其中，由调用方单独批改
+        """
+        started = time.monotonic()
+        results: Dict[str, GradingResult] = {}
+        pending = []
+        for student_id, files_formatted in submissions:
+            single_messages = self.build_messages(
+                homework_description, files_formatted, attachments_formatted
+            )
+            cached_result = self.lookup_cache(student_id, single_messages, self._packed_cache_model)
+            if cached_result is not None:
+                cached_result.metrics = {
+                    "wall_time": round(time.monotonic() - started, 3),
+                    "attempts": 0,
+                    "cache_hit": True
+                }
+                self.record_cache_hit()
+                results[student_id] = cached_result
+            else:
+                pending.append((student_id, files_formatted, single_messages))
+        if len(pending) < 2:
+            return results
+
+        labels = [pack_label(i) for i in range(len(pending))]
+        messages = self.build_packed_messages(
+            homework_description,
+            [(label, files_formatted) for label, (_, files_formatted, _) in zip(labels, pending)],
+            attachments_formatted
+        )
+        body = self.build_request_body(messages, packed=len(pending))
+        estimated_tokens = sum(estimate_tokens(m["content"]) for m in messages) + body["max_tokens"]
+        metrics = {"attempts": 0, "rate_limited": 0}
+        try:
+            result_text, usage = self._request_with_retries(body, estimated_tokens, metrics)
+            entries = split_packed_results(self._parse_json_response(result_text, "results"), labels)
+        except Exception:
+            return results
+
+        metrics["wall_time"] = round(time.monotonic() - started, 3)
+        metrics["pack_size"] = len(pending)
+        for index, (label, (student_id, _, single_messages)) in enumerate(zip(labels, pending)):
+            entry = entries.get(label)
+            if entry is None:
+                continue
+            if self.cache is not None:
+                cache_key = self._cache_key(single_messages, self._packed_cache_model)
+                self.cache.put(cache_key, self.model, json.dumps(entry, ensure_ascii=False))
+            results[student_id] = GradingResult(
+                student_id=student_id,
+                score=entry["score"],
+                comments=entry["comments"],
+                deductions=entry["deductions"],
+                usage=self._share_usage(usage, index, len(pending)),
+                metrics=dict(metrics)
+            )
+        return results
+
+    @staticmethod
+    def _share_usage(usage: Optional[Dict[str, int]], index: int,
+                     count: int) -> Optional[Dict[str, int]]:
+        """把打包请求的 token 用量平均分给 count 名学生（余数分给前几名），合计与原用量一致"""
+        if usage is None:
+            return None
+        return {key: value // count + (1 if index < value % count else 0) for key, value in usage.items()}
+
+    def _grade_with_retries(self, student_id: str, messages: List[Dict[str, str]],
+                            metrics: Dict, model: Optional[str] = None,
+                            confidence: bool = False) -> GradingResult:
+        """
+        发送请求并解析批改结果，metrics 中累计请求次数、限流次数和最后一次请求的耗时
+
+        输出无法解析时，先只把这段输出发给模型修正格式，仍失败时再重发完整 prompt
+        """
+        model = model or self.model
+        body = self.build_request_body(messages, model, confidence)
+        estimated_tokens = sum(estimate_tokens(m["content"]) for m in messages) + self.max_tokens
+        attempt = 0
+        while True:
+            try:
+                result_text, usage = self._request_with_retries(body, estimated_tokens, metrics)
+            except Exception as e:
+                return self._failed_result(student_id, self._api_error_message(e, metrics))
 
+            try:
+                return self.result_from_response(
+                    student_id, messages, result_text, usage, model, confidence
+                )
             except json.JSONDecodeError as e:
-                if attempt < self.max_retries - 1:
-                    time.sleep(1)
+                repaired = self._repair_response(
+                    student_id, messages, result_text, usage, metrics, model, confidence
+                )
+                if repaired is not None:
+                    return repaired
+                attempt += 1
+                if attempt < self.max_retries:
                     continue
-                return GradingResult(
-                    student_id=student_id,
-                    score=0,
-                    comments="",
-                    deductions=[],
-                    error=f"JSON 解析失败: {e}. 原始响应: {result_text[:500]}"
+                metrics["error_class"] = type(e).__name__
+                return self._failed_result(
+                    student_id, f"JSON 解析失败: {e}. 原始响应: {result_text[:500]}"
                 )
 
+    def _request_with_retries(self, body: Dict, estimated_tokens: int,
+                              metrics: Dict) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        发送请求，按错误类型重试，返回模型输出文本和 token 用量；放弃时抛出最后一次的异常
+
+        - 限流（429）：调度器已降低并发并暂停，直接重试，不占用 MAX_RETRIES
+        - 可重试错误（5xx、超时、连接错误）：full jitter 退避，服务端给出 Retry-After 时至少等待该时长
+        - 不可重试错误（401、400 上下文超长等）：立即放弃
+        """
+        attempt = 0
+        while True:
+            try:
+                metrics["attempts"] += 1
+                return self._request_completion(body, estimated_tokens, metrics)
             except Exception as e:
-                if attempt < self.max_retries - 1:
-                    time.sleep(2 ** attempt)  # 指数退避
-                    continue
-                return GradingResult(
-                    student_id=student_id,
-                    score=0,
-                    comments="",
-                    deductions=[],
-                    error=f"API 调用失败: {e}"
-                )
+                kind = classify_error(e)
+                if kind == RATE_LIMITED:
+                    metrics["rate_limited"] += 1
+                    if metrics["rate_limited"] <= self.max_rate_limit_retries:
+                        continue
+                else:
+                    attempt += 1
+                    if kind == RETRYABLE and attempt < self.max_retries:
+                        time.sleep(backoff_delay(
+                            attempt, Config.RETRY_BASE_DELAY, Config.RETRY_MAX_DELAY, retry_after(e)
+                        ))
+                        continue
+                metrics["error_class"] = type(e).__name__
+                raise
+
+    @staticmethod
+    def _api_error_message(error: Exception, metrics: Dict) -> str:
+        kind = classify_error(error)
+        if kind == RATE_LIMITED:
+            return f"API 调用失败: 连续被限流 {metrics['rate_limited']} 次: {error}"
+        if kind == FATAL:
+            return f"API 调用失败（不可重试）: {error}"
+        return f"API 调用失败: {error}"
+
+    def _repair_response(self, student_id: str, messages: List[Dict[str, str]],
+                         bad_text: str, usage: Optional[Dict[str, int]],
+                         metrics: Dict, model: str,
+                         confidence: bool = False) -> Optional[GradingResult]:
+        """
+        请模型把无法解析的输出改写为合法 JSON
+
+        请求中只包含这段输出，不重发题目和学生文件；修复后的结果以原始请求为键写入缓存。
+        请求失败或仍无法解析时返回 None
+        """
+        if not Config.JSON_REPAIR_REQUEST or not bad_text.strip():
+            return None
+        repair_messages = [
+            {"role": "system", "content": Config.SYSTEM_MESSAGE},
+            {"role": "user", "content": Config.JSON_REPAIR_TEMPLATE.format(output=bad_text)}
+        ]
+        estimated_tokens = sum(estimate_tokens(m["content"]) for m in repair_messages) + self.max_tokens
+        metrics["repairs"] = metrics.get("repairs", 0) + 1
+        try:
+            repaired_text, repair_usage = self._request_completion(
+                self.build_request_body(repair_messages, model), estimated_tokens
+            )
+        except Exception:
+            return None
+
+        if usage is not None and repair_usage is not None:
+            usage = {key: usage[key] + repair_usage[key] for key in usage}
+        else:
+            usage = usage or repair_usage
+        try:
+            return self.result_from_response(
+                student_id, messages, repaired_text, usage, model, confidence
+            )
+        except json.JSONDecodeError:
+            return None
+
+    @staticmethod
+    def _failed_result(student_id: str, error: str) -> GradingResult:
+        return GradingResult(
+            student_id=student_id,
+            score=0,
+            comments="",
+            deductions=[],
+            error=error
+        )
+
+    def lookup_cache(self, student_id: str, messages: List[Dict[str, str]],
+                     model: Optional[str] = None, confidence: bool = False) -> Optional[GradingResult]:
+        """查询响应缓存，命中时直接返回批改结果（不计入 cache_hits，由调用方在确定最终结果后计数）"""
+        if self.cache is None or self.cache_mode != "use":
+            return None
+
+        cached_text = self.cache.get(self._cache_key(messages, model or self.model, confidence))
+        if cached_text is None:
+            return None
 
-    def _parse_json_response(self, text: str) -> Dict:
-        """解析 LLM 返回的 JSON 响应"""
-        # 尝试直接解析
         try:
-            return json.loads(text)
+            result_json = self._parse_json_response(cached_text)
         except json.JSONDecodeError:
-            pass
+            return None
+
+        return GradingResult(
+            student_id=student_id,
+            score=result_json.get("score", 0),
+            comments=result_json.get("comments", ""),
+            deductions=result_json.get("deductions", []),
+            confidence=self._parse_confidence(result_json)
+        )
+
+    def result_from_response(self, student_id: str, messages: List[Dict[str, str]],
+                             result_text: str,
+                             usage: Optional[Dict[str, int]] = None,
+                             model: Optional[str] = None,
+                             confidence: bool = False) -> GradingResult:
+        """
+        将模型输出解析为批改结果，并写入响应缓存
+
+        解析失败时抛出 json.JSONDecodeError
+        """
+        model = model or self.model
+        result_json = self._parse_json_response(result_text)
+        if self.cache is not None:
+            self.cache.put(self._cache_key(messages, model, confidence), model, result_text)
+
+        return GradingResult(
+            student_id=student_id,
+            score=result_json.get("score", 0),
+            comments=result_json.get("comments", ""),
+            deductions=result_json.get("deductions", []),
+            usage=usage,
+            confidence=self._parse_confidence(result_json)
+        )
+
+    @staticmethod
+    def _parse_confidence(result_json: Dict) -> Optional[float]:
+        """读取模型自评置信度（级联批改时要求便宜模型给出），缺失或无效时返回 None"""
+        try:
+            confidence = float(result_json["confidence"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        return min(1.0, max(0.0, confidence))
+
+    def build_messages(self, homework_description: str,
+                       student_files_formatted: str,
+                       attachments_formatted: str = "") -> List[Dict[str, str]]:
+        """渲染批改请求的消息列表（按当前 prompt 布局，见 prompts.build_messages）"""
+        return build_messages(
+            self.prompt_layout, homework_description, student_files_formatted, attachments_formatted
+        )
+
+    def build_packed_messages(self, homework_description: str,
+                              submissions: List[Tuple[str, str]],
+                              attachments_formatted: str = "") -> List[Dict[str, str]]:
+        """渲染打包请求的消息列表，submissions 为 [(匿名编号, 格式化后的学生文件), ...]"""
+        return build_packed_messages(
+            self.prompt_layout, homework_description, submissions, attachments_formatted
+        )
+
+    def _on_response_headers(self, response):
+        """httpx 响应钩子：收到响应头（读取响应体之前）时调用"""
+        self._timing.headers_at = time.monotonic()
 
-        # 尝试提取 JSON 块
-        import re
-        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(1))
+    def _request_completion(self, body: Dict, estimated_tokens: int,
+                            timing: Optional[Dict] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        经过调度器发送一次请求（开启对冲时可能发送两次），返回模型输出文本和 token 用量
 
-        # 尝试找到 JSON 对象
-        json_match = re.search(r'\{[^{}]*"score"[^{}]*\}', text, re.DOTALL)
-        if json_match:
-            return json.loads(json_match.group(0))
+        timing 不为空时写入本次请求的 latency（发送到解析完成）和 ttfb（发送到收到响应头），单位秒，
+        不包含在调度器中排队的时间
+        """
+        if self._hedge_executor is None:
+            return self._send(body, estimated_tokens, timing)
+
+        delay = self.latency_tracker.percentile(Config.HEDGE_PERCENTILE)
+        call_timings: List[Dict] = []
+
+        def call(cancelled: threading.Event):
+            call_timing: Dict = {}
+            call_timings.append(call_timing)
+            return self._send(body, estimated_tokens, call_timing, cancelled), call_timing
+
+        try:
+            (result, winner_timing), hedge_sent, hedge_won = hedged_call(
+                call, delay, self._hedge_executor
+            )
+        except BaseException:
+            if timing is not None and call_timings:
+                timing.update(call_timings[0])
+            raise
+        with self._stats_lock:
+            self.hedges_sent += hedge_sent
+            self.hedges_won += hedge_won
+        if timing is not None:
+            timing.update(winner_timing)
+            if hedge_sent:
+                timing["hedged"] = True
+        return result
+
+    def _send(self, body: Dict, estimated_tokens: int, timing: Optional[Dict] = None,
+              cancelled: Optional[threading.Event] = None) -> Tuple[str, Optional[Dict[str, int]]]:
+        """
+        发送一次 HTTP 请求
+
+        cancelled 在排队期间被设置时（对冲的另一次请求已经成功）不再发送，抛出 RuntimeError；
+        熔断器打开期间等待，持续打开超过时限时抛出 CircuitOpenError
+        """
+        if cancelled is not None and cancelled.is_set():
+            raise RuntimeError("对冲请求已不再需要")
+        probe = self.circuit_breaker.before_request()
+        try:
+            self.rate_limiter.acquire(estimated_tokens)
+            if cancelled is not None and cancelled.is_set():
+                self.rate_limiter.release(estimated_tokens, 0)
+                raise RuntimeError("对冲请求已不再需要")
+        except BaseException:
+            # 请求没有发出：探测名额不能一直占着，否则其他线程会一直等到熔断超时
+            if probe:
+                self.circuit_breaker.release_probe()
+            raise
+
+        usage = None
+        self._timing.headers_at = None
+        sent_at = time.monotonic()
+        succeeded = False
+        try:
+            raw_response = self.client.chat.completions.with_raw_response.create(**body)
+            response = raw_response.parse()
+            usage = self._extract_usage(response)
+            self.rate_limiter.on_success(raw_response.headers)
+            self.circuit_breaker.on_success()
+            succeeded = True
+            return response.choices[0].message.content.strip(), usage
+        except RateLimitError as e:
+            self.rate_limiter.on_rate_limited(e.response.headers)
+            self.circuit_breaker.on_success()
+            raise
+        except Exception as e:
+            # 只有服务端或网络的临时故障计入熔断，4xx 说明服务仍在正常响应
+            if isinstance(e, APIError) and classify_error(e) == RETRYABLE:
+                self.circuit_breaker.on_failure()
+            else:
+                self.circuit_breaker.on_success()
+            raise
+        finally:
+            latency = time.monotonic() - sent_at
+            if succeeded:
+                self.latency_tracker.record(latency)
+            if timing is not None:
+                timing["latency"] = round(latency, 3)
+                headers_at = self._timing.headers_at
+                timing["ttfb"] = round(headers_at - sent_at, 3) if headers_at is not None else None
+            used_tokens = None
+            if usage is not None:
+                used_tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+            self.rate_limiter.release(estimated_tokens, used_tokens)
+
+    @staticmethod
+    def _extract_usage(response) -> Optional[Dict[str, int]]:
+        """提取 token 用量，cached_tokens 来自 usage.prompt_tokens_details（服务商不支持时为 0）"""
+        if response.usage is None:
+            return None
+        details = getattr(response.usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+        return {
+            "prompt_tokens": response.usage.prompt_tokens or 0,
+            "completion_tokens": response.usage.completion_tokens or 0,
+            "cached_tokens": cached_tokens
+        }
+
+    def build_request_body(self, messages: List[Dict[str, str]], model: Optional[str] = None,
+                           confidence: bool = False, packed: int = 0) -> Dict:
+        """
+        构建 chat completions 请求参数（在线请求和 Batch API 共用）
+
+        confidence 为 True 时（级联批改的便宜模型）结构化输出中增加 confidence 字段；
+        packed 为打包请求中的学生数，输出 token 上限按人数放大，结构化输出改为结果数组
+        """
+        body = {
+            "model": model or self.model,
+            "messages": messages,
+            "max_tokens": self.max_tokens * max(1, packed),
+            "temperature": self.temperature
+        }
+        response_format = self._response_format_param(confidence, packed)
+        if response_format is not None:
+            body["response_format"] = response_format
+        return body
+
+    def _response_format_param(self, confidence: bool = False, packed: int = 0) -> Optional[Dict]:
+        """请求参数中的 response_format（text 格式时为 None）"""
+        if self.response_format == "json_schema":
+            schema = Config.GRADING_RESPONSE_SCHEMA
+            if packed:
+                schema = packed_response_schema()
+            elif confidence:
+                schema = dict(
+                    schema,
+                    properties=dict(schema["properties"], confidence={
+                        "type": "number", "description": "对分数的把握程度，0 到 1"
+                    }),
+                    required=schema["required"] + ["confidence"]
+                )
+            return {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "packed_grading_result" if packed else "grading_result",
+                    "strict": True,
+                    "schema": schema
+                }
+            }
+        if self.response_format == "json_object":
+            return {"type": "json_object"}
+        return None
+
+    def _cache_key(self, messages: List[Dict[str, str]], model: str, confidence: bool = False) -> str:
+        """单个学生请求的缓存键（包含该请求实际使用的 response_format）"""
+        return make_cache_key(
+            model, self.temperature, self.max_tokens, messages,
+            self._response_format_param(confidence)
+        )
 
-        raise json.JSONDecodeError("Cannot find valid JSON in response", text, 0)
+    def _parse_json_response(self, text: str, required_key: str = "score") -> Dict:
+        """解析 LLM 返回的 JSON 响应（本地修复常见格式问题，无法修复时抛出 JSONDecodeError）"""
+        return extract_json_object(text, required_key=required_key)
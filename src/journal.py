@@ -0,0 +1,62 @@
+"""批改结果日志模块：每完成一个学生立即追加写入 JSONL 并 fsync"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict
+
+from .result import GradingResult
+
+
+class ResultJournal:
+    """
+    崩溃安全的结果日志
+
+    每行一个学生的结果，写入后立即 fsync；进程中断后可以通过 replay()
+    恢复已完成的学生，只批改缺失的部分。
+    """
+
+    def __init__(self, journal_file: Path):
+        self.journal_file = Path(journal_file)
+        self._lock = threading.Lock()
+
+    def replay(self) -> Dict[str, Dict]:
+        """读取日志，返回 {student_id: 结果字典}，同一学生以最后一条为准"""
+        entries: Dict[str, Dict] = {}
+        if not self.journal_file.exists():
+            return entries
+
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半，忽略即可
+                    continue
+                entries[entry["student_id"]] = entry
+
+        return entries
+
+    def append(self, result: GradingResult):
+        """追加一条结果并落盘"""
+        line = json.dumps(result.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def reset(self):
+        """清空日志，开始新的一次批改"""
+        with self._lock:
+            if self.journal_file.exists():
+                self.journal_file.unlink()
+
+    def remove(self):
+        """结果已写入最终文件后删除日志"""
+        self.reset()
@@ -0,0 +1,93 @@
+"""JSON 修复模块：从模型输出中提取并修复批改结果 JSON，避免因格式问题重新请求"""
+
+import json
+import re
+from typing import Dict, Iterator, List, Optional
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+_TRAILING_COMMA_PATTERN = re.compile(r",(\s*[}\]])")
+
+
+def _scan_object(text: str, start: int) -> str:
+    """
+    从 text[start]（必须是 '{'）开始做括号配对扫描，返回完整的对象文本
+
+    会跳过字符串内部的括号；如果文本在对象结束前被截断，补全未闭合的字符串和括号
+    """
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        ch = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return text[start:index + 1]
+
+    # 输出被截断：补全字符串和括号
+    tail = text[start:]
+    if in_string:
+        tail += '"'
+    return tail + "".join(reversed(stack))
+
+
+def _candidates(text: str) -> Iterator[str]:
+    """依次产生可能的 JSON 对象文本：代码块内容优先，其次是正文中每个 '{' 开始的对象"""
+    for match in _FENCE_PATTERN.finditer(text):
+        block = match.group(1)
+        start = block.find("{")
+        if start != -1:
+            yield _scan_object(block, start)
+
+    start = text.find("{")
+    while start != -1:
+        yield _scan_object(text, start)
+        start = text.find("{", start + 1)
+
+
+def _loads_with_repair(candidate: str) -> Optional[Dict]:
+    """尝试解析候选文本，失败时去掉尾随逗号再试"""
+    for attempt in (candidate, _TRAILING_COMMA_PATTERN.sub(r"\1", candidate)):
+        try:
+            value = json.loads(attempt)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(value, dict):
+            return value
+    return None
+
+
+def extract_json_object(text: str, required_key: str = "score") -> Dict:
+    """
+    从模型输出中提取包含 required_key 的 JSON 对象
+
+    依次尝试：直接解析 → 代码块 → 括号配对扫描出的每个对象（含尾随逗号、截断修复），
+    都失败时抛出 json.JSONDecodeError
+    """
+    try:
+        value = json.loads(text)
+        if isinstance(value, dict) and required_key in value:
+            return value
+    except json.JSONDecodeError:
+        pass
+
+    for candidate in _candidates(text):
+        value = _loads_with_repair(candidate)
+        if value is not None and required_key in value:
+            return value
+
+    raise json.JSONDecodeError("Cannot find valid JSON in response", text, 0)
@@ -0,0 +1,89 @@
+"""提交内容哈希模块：带 mtime/size 预过滤的文件哈希清单"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from .output_writer import atomic_write
+
+
+class SubmissionManifest:
+    """
+    计算学生提交和题目目录的内容哈希
+
+    每个文件的 (size, mtime_ns, sha256) 缓存在 manifest.json 中，
+    size 和 mtime 都未变化的文件直接复用上次的哈希，不再读取内容。
+    """
+
+    def __init__(self, manifest_file: Path):
+        self.manifest_file = Path(manifest_file)
+        self._files: Dict[str, List] = {}
+        self._dirty = False
+        if self.manifest_file.exists():
+            try:
+                with open(self.manifest_file, "r", encoding="utf-8") as f:
+                    self._files = json.load(f).get("files", {})
+            except (json.JSONDecodeError, OSError):
+                # 清单只是缓存，损坏时重新计算即可
+                self._files = {}
+
+    def statement_hash(self, homework_dir: str) -> str:
+        """计算 statements/ 目录（包括 tests/ 等子目录）的内容哈希"""
+        return self._hash_directory(Path(homework_dir) / "statements", recursive=True)
+
+    def submission_hash(self, homework_dir: str, student_id: str) -> str:
+        """计算单个学生作业文件夹的内容哈希"""
+        return self._hash_directory(Path(homework_dir) / "assignments" / student_id)
+
+    def _hash_directory(self, directory: Path, recursive: bool = False) -> str:
+        """
+        对目录下的文件按相对路径排序后计算组合哈希
+
+        recursive 为 False 时只包括目录下的文件（与读取学生文件时一致）；
+        为 True 时包括所有子目录，如题目中的测试用例
+        """
+        digest = hashlib.sha256()
+        if not directory.exists():
+            return digest.hexdigest()
+
+        for name, entry in sorted(self._scan(directory, "", recursive), key=lambda item: item[0]):
+            digest.update(name.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(self._hash_file(entry).encode("ascii"))
+            digest.update(b"\n")
+        return digest.hexdigest()
+
+    def _scan(self, directory: Path, prefix: str, recursive: bool) -> Iterator[Tuple[str, os.DirEntry]]:
+        """产出 (相对路径, 文件条目)"""
+        for entry in os.scandir(directory):
+            if entry.is_file():
+                yield prefix + entry.name, entry
+            elif recursive and entry.is_dir():
+                yield from self._scan(Path(entry.path), f"{prefix}{entry.name}/", recursive)
+
+    def _hash_file(self, entry: os.DirEntry) -> str:
+        stat = entry.stat()
+        key = os.path.abspath(entry.path)
+        cached = self._files.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        file_digest = hashlib.sha256()
+        with open(entry.path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                file_digest.update(chunk)
+        file_hash = file_digest.hexdigest()
+
+        self._files[key] = [stat.st_size, stat.st_mtime_ns, file_hash]
+        self._dirty = True
+        return file_hash
+
+    def save(self):
+        """保存文件哈希缓存"""
+        if not self._dirty:
+            return
+        with atomic_write(self.manifest_file) as f:
+            json.dump({"files": self._files}, f, ensure_ascii=False)
+        self._dirty = False
@@ -0,0 +1,206 @@
+"""批改调用指标模块：汇总每次调用的耗时、token、重试和费用，导出 JSON 和 Prometheus 文本格式"""
+
+import json
+import math
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import Config
+from .result import GradingResult
+from .output_writer import atomic_write
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法计算百分位数，values 为空时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def estimate_cost(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> Optional[float]:
+    """按 Config 中的单价（每百万 token）估算费用，未配置单价时返回 None"""
+    if not (Config.PRICE_INPUT_PER_1M or Config.PRICE_OUTPUT_PER_1M):
+        return None
+    cached_price = Config.PRICE_CACHED_INPUT_PER_1M or Config.PRICE_INPUT_PER_1M
+    return (
+        (prompt_tokens - cached_tokens) * Config.PRICE_INPUT_PER_1M
+        + cached_tokens * cached_price
+        + completion_tokens * Config.PRICE_OUTPUT_PER_1M
+    ) / 1_000_000
+
+
+def summarize_metrics(results: List[GradingResult], elapsed: Optional[float] = None) -> Dict:
+    """
+    汇总批改结果中的调用指标
+
+    Args:
+        results: 批改结果列表
+        elapsed: 本作业批改阶段的耗时（秒），用于计算吞吐量
+
+    Returns:
+        指标字典，写入 results.json 的 metrics 字段和 metrics.json
+    """
+    call_metrics = [r.metrics for r in results if r.metrics and r.metrics.get("attempts")]
+    usages = [r.usage for r in results if r.usage is not None]
+
+    summary: Dict = {
+        "students": len(results),
+        "api_students": len(call_metrics),
+        "cache_hits": sum(1 for r in results if r.metrics and r.metrics.get("cache_hit")),
+        # 打包请求的调用指标由组内每名学生各记录一份，按组内人数折算
+        "attempts": round(sum(m["attempts"] / m.get("pack_size", 1) for m in call_metrics)),
+        # 级联批改的学生单独记录了重试次数（两个模型各自的第一次请求都不算重试）
+        "retries": round(sum(m.get("retries", m["attempts"] - 1) / m.get("pack_size", 1) for m in call_metrics)),
+        "rate_limited": round(sum(m.get("rate_limited", 0) / m.get("pack_size", 1) for m in call_metrics)),
+        "packed_students": sum(1 for m in call_metrics if m.get("pack_size")),
+        "pack_fallbacks": sum(1 for m in call_metrics if m.get("pack_fallback")),
+        "json_repairs": sum(m.get("repairs", 0) for m in call_metrics),
+        "errors": dict(Counter(
+            r.metrics.get("error_class") or "Unknown" for r in results
+            if r.error is not None and r.metrics
+        )),
+        "prompt_tokens": sum(u["prompt_tokens"] for u in usages),
+        "cached_tokens": sum(u["cached_tokens"] for u in usages),
+        "completion_tokens": sum(u["completion_tokens"] for u in usages),
+    }
+
+    for name in ("wall_time", "latency", "ttfb"):
+        values = [m[name] for m in call_metrics if m.get(name) is not None]
+        summary[name] = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+
+    if elapsed:
+        summary["elapsed"] = round(elapsed, 3)
+        summary["students_per_minute"] = round(len(call_metrics) / elapsed * 60, 2)
+
+    checked = [r.checks for r in results if r.checks is not None]
+    if checked:
+        summary["checks"] = {
+            "students": len(checked),
+            "compile_failed": sum(1 for c in checked if not c["compiled"]),
+            "tests_passed": sum(c["passed"] for c in checked),
+            "tests_total": sum(c["total"] for c in checked),
+            "short_circuits": sum(1 for r in results if r.metrics and r.metrics.get("short_circuit")),
+        }
+
+    cascade = summarize_cascade(results)
+    if cascade is not None:
+        summary["cascade"] = cascade
+
+    cost = estimate_cost(
+        summary["prompt_tokens"], summary["cached_tokens"], summary["completion_tokens"]
+    )
+    if cost is not None:
+        summary["estimated_cost"] = round(cost, 6)
+
+    return summary
+
+
+def summarize_cascade(results: List[GradingResult]) -> Optional[Dict]:
+    """
+    汇总级联批改：升级比例、升级原因和节省的时间，未使用级联批改时返回 None
+
+    节省的时间按实际调用了 API 的学生估算：只用便宜模型的学生按强模型的平均耗时计算节省量，
+    再减去升级学生在便宜模型上花费的时间
+    """
+    tiered = [r for r in results if r.tier is not None]
+    if not tiered:
+        return None
+    escalated = [r for r in tiered if r.tier == "strong"]
+
+    called = [r for r in tiered if r.metrics and not r.metrics.get("cache_hit")]
+    strong_times = [r.metrics["strong_wall_time"] for r in called if r.tier == "strong"]
+    time_saved = None
+    if strong_times:
+        average_strong = sum(strong_times) / len(strong_times)
+        time_saved = sum(
+            average_strong - r.metrics["cheap_wall_time"] if r.tier == "cheap"
+            else -r.metrics["cheap_wall_time"]
+            for r in called
+        )
+
+    return {
+        "students": len(tiered),
+        "escalated": len(escalated),
+        "escalation_rate": round(len(escalated) / len(tiered), 4),
+        "reasons": dict(Counter(r.escalation for r in escalated)),
+        "time_saved": round(time_saved, 3) if time_saved is not None else None,
+    }
+
+
+def _prometheus_lines(summary: Dict, homework_name: str) -> List[str]:
+    """按 Prometheus 文本格式（node_exporter textfile collector）输出指标"""
+    label = 'homework="{}"'.format(homework_name.replace("\\", "\\\\").replace('"', '\\"'))
+    lines = []
+
+    def gauge(name: str, help_text: str, value, extra_label: str = ""):
+        if value is None:
+            return
+        if not any(line.startswith(f"# TYPE {name} ") for line in lines):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+        labels = label + ("," + extra_label if extra_label else "")
+        lines.append(f"{name}{{{labels}}} {value}")
+
+    gauge("grade_students", "Students in this grading run", summary["students"])
+    gauge("grade_api_students", "Students graded through the API", summary["api_students"])
+    gauge("grade_cache_hits", "Students served from the response cache", summary["cache_hits"])
+    gauge("grade_attempts", "API calls including retries", summary["attempts"])
+    gauge("grade_retries", "API calls beyond the first per student and model", summary["retries"])
+    gauge("grade_rate_limited", "Rate limited (429) responses", summary["rate_limited"])
+    gauge("grade_packed_students", "Students graded in multi-student requests", summary["packed_students"])
+    gauge("grade_json_repairs", "Follow-up requests to repair unparseable output", summary["json_repairs"])
+    for error_class, count in sorted(summary["errors"].items()):
+        gauge("grade_errors", "Failed students by final error class", count,
+              f'error_class="{error_class}"')
+    for kind in ("prompt", "cached", "completion"):
+        gauge("grade_tokens", "Tokens used by kind", summary[f"{kind}_tokens"],
+              f'kind="{kind}"')
+    for name in ("wall_time", "latency", "ttfb"):
+        for p in PERCENTILES:
+            gauge(f"grade_{name}_seconds", f"{name} per student in seconds",
+                  summary[name][f"p{p}"], f'quantile="{p / 100}"')
+    gauge("grade_elapsed_seconds", "Duration of the grading phase", summary.get("elapsed"))
+    gauge("grade_students_per_minute", "Throughput of API-graded students",
+          summary.get("students_per_minute"))
+    gauge("grade_estimated_cost", "Estimated cost from configured prices",
+          summary.get("estimated_cost"))
+    checks = summary.get("checks")
+    if checks is not None:
+        gauge("grade_compile_failed", "Submissions that failed to compile", checks["compile_failed"])
+        gauge("grade_short_circuits", "Students graded by local checks without an API call",
+              checks["short_circuits"])
+    cascade = summary.get("cascade")
+    if cascade is not None:
+        gauge("grade_cascade_escalation_rate", "Share of students escalated to the strong model",
+              cascade["escalation_rate"])
+        for reason, count in sorted(cascade["reasons"].items()):
+            gauge("grade_cascade_escalated", "Students escalated to the strong model by reason",
+                  count, f'reason="{reason}"')
+        gauge("grade_cascade_time_saved_seconds", "Estimated model time saved by the cascade",
+              cascade["time_saved"])
+    return lines
+
+
+def write_metrics(summary: Dict, homework_name: str, output_path: str) -> str:
+    """将指标写入 metrics.json 和 metrics.prom，返回 metrics.prom 路径"""
+    output_dir = Path(output_path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with atomic_write(output_dir / "metrics.json") as f:
+        json.dump({
+            "homework": homework_name,
+            "generated_at": datetime.now().isoformat(),
+            "metrics": summary
+        }, f, ensure_ascii=False, indent=2)
+
+    output_file = output_dir / "metrics.prom"
+    with atomic_write(output_file) as f:
+        f.write("\n".join(_prometheus_lines(summary, homework_name)) + "\n")
+
+    return str(output_file)
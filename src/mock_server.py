@@ -0,0 +1,450 @@
+"""
+本地 OpenAI 兼容模拟服务，用于离线测试
+
+支持的接口:
+    POST /v1/chat/completions         返回确定性的批改 JSON（打包请求返回每名学生一项的 results 数组）
+    POST /v1/files                    上传文件（multipart/form-data）
+    GET  /v1/files/{id}               查询文件
+    GET  /v1/files/{id}/content       下载文件内容
+    POST /v1/batches                  创建 batch
+    GET  /v1/batches/{id}             查询 batch（创建 batch_delay 秒后完成）
+
+chat completions 可以注入延迟和故障，用于压测（见 src/benchmark.py）:
+    --latency fixed:0.5 | uniform:0.2,1.5 | lognormal:0.8,0.5   每个请求的响应延迟（秒）
+    --error-429 0.05 / --error-500 0.02                       按比例返回 429（带 Retry-After）或 500
+    --malformed 0.03                                          按比例返回格式错误的 JSON
+    --rpm 600                                                 每分钟请求上限，返回 x-ratelimit-* 响应头，超出时 429
+
+用法:
+    python -m src.mock_server --port 8000 --batch-delay 2
+    python -m src.mock_server --port 8000 --latency lognormal:0.8,0.5 --error-429 0.05 --rpm 600
+    OPENAI_API_KEY=test OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python main.py homework/example --batch
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+
+def parse_latency(spec: str) -> Tuple[str, List[float]]:
+    """
+    解析延迟分布，返回 (分布类型, 参数)
+
+    fixed:S / uniform:LOW,HIGH / lognormal:MEDIAN,SIGMA，空字符串或 0 表示无延迟
+    """
+    if not spec or spec == "0":
+        return "fixed", [0.0]
+    kind, _, params = spec.partition(":")
+    arity = {"fixed": 1, "uniform": 2, "lognormal": 2}
+    try:
+        values = [float(v) for v in params.split(",")] if params else []
+    except ValueError:
+        values = []
+    if kind not in arity or len(values) != arity[kind] or (kind == "lognormal" and values[0] <= 0):
+        raise ValueError(f"无法解析的延迟分布: {spec}（可用 fixed:S、uniform:LOW,HIGH、lognormal:MEDIAN,SIGMA）")
+    return kind, values
+
+
+class FaultConfig:
+    """chat completions 的延迟和故障注入配置"""
+
+    def __init__(self, latency: str = "", error_429: float = 0.0, error_500: float = 0.0,
+                 malformed: float = 0.0, rpm: int = 0, seed: Optional[int] = None):
+        self.latency = latency
+        self.latency_kind, self.latency_params = parse_latency(latency)
+        self.error_429 = error_429
+        self.error_500 = error_500
+        self.malformed = malformed
+        self.rpm = rpm
+        self.seed = seed
+
+    def sample_latency(self, rng: random.Random) -> float:
+        """按配置的分布采样一次响应延迟（秒）"""
+        params = self.latency_params
+        if self.latency_kind == "uniform":
+            return rng.uniform(params[0], params[1])
+        if self.latency_kind == "lognormal":
+            return rng.lognormvariate(math.log(params[0]), params[1])
+        return params[0]
+
+
+class MockState:
+    """模拟服务的内存状态"""
+
+    def __init__(self, batch_delay: float = 0.0, faults: Optional[FaultConfig] = None):
+        self.batch_delay = batch_delay
+        self.faults = faults or FaultConfig()
+        self.files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(self.faults.seed)
+        # 最近 60 秒内的请求时间，用于 --rpm 限流
+        self.request_times: deque = deque()
+        # 各类响应的计数（ok / 429 / 500 / malformed / rpm_429）
+        self.stats: Counter = Counter()
+
+
+# 格式错误的模型输出：前两种可以在本地修复，最后一种只能重新请求
+_MALFORMED_TEMPLATES = [
+    "批改结果如下：\n```json\n{{\"score\": {score}, \"comments\": \"模拟批改结果\", \"deductions\": [],}}\n```",
+    "{{\"score\": {score}, \"comments\": \"模拟批改结果（输出被截断",
+    "抱歉，我暂时无法给出评分。",
+]
+
+
+# 打包请求中每名学生的小节标题（见 src/packing.py）
+_PACKED_SECTION_PATTERN = re.compile(r"^### 学生 (S\d+)$", re.MULTILINE)
+
+
+def _fake_result(content: str) -> Dict:
+    digest = hashlib.sha256(content.encode("utf-8")).digest()
+    score = 60 + digest[0] % 41
+    return {
+        "score": score,
+        "comments": "模拟批改结果",
+        "deductions": [{"reason": "模拟扣分", "points": 100 - score}] if score < 100 else []
+    }
+
+
+def fake_completion(body: Dict, malformed_variant: Optional[int] = None) -> Dict:
+    """根据请求内容生成确定性的批改结果；malformed_variant 不为空时返回对应的格式错误输出"""
+    content = "".join(m.get("content") or "" for m in body.get("messages", []))
+    prompt_tokens = max(1, len(content) // 4)
+
+    sections = list(_PACKED_SECTION_PATTERN.finditer(content))
+    if sections:
+        # 打包请求：按每名学生小节的内容各自生成结果
+        results = []
+        for index, match in enumerate(sections):
+            end = sections[index + 1].start() if index + 1 < len(sections) else len(content)
+            results.append(dict(id=match.group(1), **_fake_result(content[match.end():end])))
+        result = {"results": results}
+        score = results[0]["score"]
+    else:
+        result = _fake_result(content)
+        score = result["score"]
+
+    completion_text = json.dumps(result, ensure_ascii=False)
+    if malformed_variant is not None:
+        completion_text = _MALFORMED_TEMPLATES[malformed_variant].format(score=score)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": completion_text},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": max(1, len(completion_text) // 4),
+            "total_tokens": prompt_tokens + max(1, len(completion_text) // 4),
+            "prompt_tokens_details": {"cached_tokens": 0}
+        }
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = MockState()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: Dict, headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, headers: Optional[Dict[str, str]] = None):
+        self._send_json(status, {"error": {"message": message, "type": "mock_error"}}, headers)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            self.handle_chat_completion(json.loads(self._read_body()))
+        elif path.endswith("/files"):
+            self.handle_file_upload(self._read_body())
+        elif path.endswith("/batches"):
+            self.handle_batch_create(json.loads(self._read_body()))
+        else:
+            self._send_error(404, f"Unknown path: {self.path}")
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) >= 3 and parts[-2] == "files":
+            self.handle_file_get(parts[-1])
+        elif len(parts) >= 4 and parts[-3] == "files" and parts[-1] == "content":
+            self.handle_file_content(parts[-2])
+        elif len(parts) >= 3 and parts[-2] == "batches":
+            self.handle_batch_get(parts[-1])
+        else:
+            self._send_error(404, f"Unknown path: {self.path}")
+
+    # chat completions
+
+    def _rate_limit_headers(self, now: float) -> Tuple[bool, Dict[str, str]]:
+        """按 --rpm 记录请求并返回 (是否超限, x-ratelimit-* 响应头)（需持有锁）"""
+        rpm = self.state.faults.rpm
+        if rpm <= 0:
+            return False, {}
+        times = self.state.request_times
+        while times and now - times[0] >= 60:
+            times.popleft()
+        limited = len(times) >= rpm
+        if not limited:
+            times.append(now)
+        reset = 60 - (now - times[0]) if times else 0.0
+        return limited, {
+            "x-ratelimit-limit-requests": str(rpm),
+            "x-ratelimit-remaining-requests": str(max(0, rpm - len(times))),
+            "x-ratelimit-reset-requests": f"{reset:.3f}s",
+        }
+
+    def handle_chat_completion(self, body: Dict):
+        faults = self.state.faults
+        with self.state.lock:
+            limited, headers = self._rate_limit_headers(time.time())
+            rng = self.state.random
+            delay = faults.sample_latency(rng)
+            roll = rng.random()
+            malformed_variant = rng.randrange(len(_MALFORMED_TEMPLATES))
+
+        if limited:
+            with self.state.lock:
+                self.state.stats["rpm_429"] += 1
+            headers["retry-after"] = headers["x-ratelimit-reset-requests"].rstrip("s")
+            self._send_error(429, "Rate limit reached for requests", headers)
+            return
+
+        time.sleep(delay)
+        if roll < faults.error_429:
+            outcome = "429"
+            self._send_error(429, "Rate limit reached (injected)", {**headers, "retry-after": "1"})
+        elif roll < faults.error_429 + faults.error_500:
+            outcome = "500"
+            self._send_error(500, "Internal server error (injected)", headers)
+        elif roll < faults.error_429 + faults.error_500 + faults.malformed:
+            outcome = "malformed"
+            self._send_json(200, fake_completion(body, malformed_variant), headers)
+        else:
+            outcome = "ok"
+            self._send_json(200, fake_completion(body), headers)
+        with self.state.lock:
+            self.state.stats[outcome] += 1
+
+    # files
+
+    def _parse_multipart(self, raw: bytes) -> Tuple[Dict[str, str], Optional[Tuple[str, bytes]]]:
+        """解析 multipart/form-data，返回 (普通字段, (文件名, 文件内容))"""
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = message_from_bytes(header + raw, policy=HTTP)
+        fields: Dict[str, str] = {}
+        file_part = None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True) or b""
+            if filename:
+                file_part = (filename, payload)
+            elif name:
+                fields[name] = payload.decode("utf-8")
+        return fields, file_part
+
+    def _file_object(self, file_id: str) -> Dict:
+        info = self.state.files[file_id]
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(info["content"]),
+            "created_at": info["created_at"],
+            "filename": info["filename"],
+            "purpose": info["purpose"],
+            "status": "processed"
+        }
+
+    def _store_file(self, filename: str, content: bytes, purpose: str) -> str:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        with self.state.lock:
+            self.state.files[file_id] = {
+                "filename": filename,
+                "content": content,
+                "purpose": purpose,
+                "created_at": int(time.time())
+            }
+        return file_id
+
+    def handle_file_upload(self, raw: bytes):
+        fields, file_part = self._parse_multipart(raw)
+        if file_part is None:
+            self._send_error(400, "Missing file")
+            return
+        file_id = self._store_file(file_part[0], file_part[1], fields.get("purpose", "batch"))
+        self._send_json(200, self._file_object(file_id))
+
+    def handle_file_get(self, file_id: str):
+        if file_id not in self.state.files:
+            self._send_error(404, f"No such file: {file_id}")
+            return
+        self._send_json(200, self._file_object(file_id))
+
+    def handle_file_content(self, file_id: str):
+        if file_id not in self.state.files:
+            self._send_error(404, f"No such file: {file_id}")
+            return
+        content = self.state.files[file_id]["content"]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    # batches
+
+    def handle_batch_create(self, body: Dict):
+        input_file_id = body.get("input_file_id")
+        if input_file_id not in self.state.files:
+            self._send_error(400, f"No such file: {input_file_id}")
+            return
+        batch_id = f"batch_{uuid.uuid4().hex[:24]}"
+        lines = self.state.files[input_file_id]["content"].decode("utf-8").splitlines()
+        with self.state.lock:
+            self.state.batches[batch_id] = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": body.get("endpoint"),
+                "input_file_id": input_file_id,
+                "completion_window": body.get("completion_window", "24h"),
+                "status": "in_progress",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": len([l for l in lines if l.strip()]), "completed": 0, "failed": 0},
+                "_ready_at": time.time() + self.state.batch_delay
+            }
+        self._send_json(200, self._batch_object(batch_id))
+
+    def _batch_object(self, batch_id: str) -> Dict:
+        batch = self.state.batches[batch_id]
+        return {k: v for k, v in batch.items() if not k.startswith("_")}
+
+    def _complete_batch(self, batch_id: str):
+        """执行 batch 中的所有请求并生成输出文件（需持有锁）"""
+        batch = self.state.batches[batch_id]
+        content = self.state.files[batch["input_file_id"]]["content"].decode("utf-8")
+        output_lines = []
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output_lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": fake_completion(request["body"])
+                },
+                "error": None
+            }, ensure_ascii=False))
+
+        output_id = f"file-{uuid.uuid4().hex[:24]}"
+        self.state.files[output_id] = {
+            "filename": f"{batch_id}_output.jsonl",
+            "content": ("\n".join(output_lines) + "\n").encode("utf-8"),
+            "purpose": "batch_output",
+            "created_at": int(time.time())
+        }
+        batch["status"] = "completed"
+        batch["output_file_id"] = output_id
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"]["completed"] = len(output_lines)
+
+    def handle_batch_get(self, batch_id: str):
+        with self.state.lock:
+            if batch_id not in self.state.batches:
+                self._send_error(404, f"No such batch: {batch_id}")
+                return
+            batch = self.state.batches[batch_id]
+            if batch["status"] == "in_progress" and time.time() >= batch["_ready_at"]:
+                self._complete_batch(batch_id)
+            data = self._batch_object(batch_id)
+        self._send_json(200, data)
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8000,
+                  batch_delay: float = 0.0,
+                  faults: Optional[FaultConfig] = None) -> ThreadingHTTPServer:
+    """创建模拟服务（port 为 0 时自动分配端口）"""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(batch_delay, faults)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    # 压测时并发连接较多，加大监听队列
+    server.request_queue_size = 256
+    return server
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser):
+    """添加延迟和故障注入参数（模拟服务和压测脚本共用）"""
+    parser.add_argument("--latency", default="",
+                        help="响应延迟分布: fixed:S / uniform:LOW,HIGH / lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--error-429", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--error-500", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--malformed", type=float, default=0.0, help="返回格式错误 JSON 的比例")
+    parser.add_argument("--rpm", type=int, default=0, help="每分钟请求上限（返回 x-ratelimit-* 响应头），0 表示不限制")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+
+
+def fault_config_from_args(args: argparse.Namespace) -> FaultConfig:
+    return FaultConfig(
+        latency=args.latency,
+        error_429=args.error_429,
+        error_500=args.error_500,
+        malformed=args.malformed,
+        rpm=args.rpm,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-delay", type=float, default=0.0,
+                        help="batch 创建后多少秒变为 completed")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.batch_delay, fault_config_from_args(args))
+    print(f"模拟服务已启动: http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
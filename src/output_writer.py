@@ -1,95 +1,224 @@
 import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict
-
-from .grader import GradingResult
-
-
-def write_json_result(results: List[GradingResult], homework_name: str, output_path: str) -> str:
-    """将批改结果写入 JSON 文件"""
-    output_data = {
-        "homework": homework_name,
-        "graded_at": datetime.now().isoformat(),
-        "total_students": len(results),
-        "students": [r.to_dict() for r in results]
+from typing import Dict, IO, Iterable, Iterator, List, Optional
+
+from .cascade import ESCALATION_REASONS
+from .dedup import build_duplicate_groups
+from .result import GradingResult
+
+# 每个学生的报告片段和索引所在目录（位于输出目录下）
+FRAGMENT_DIR_NAME = "report.d"
+FRAGMENT_INDEX_NAME = "index.json"
+
+
+@contextmanager
+def atomic_write(path: Path, mode: str = "w") -> Iterator[IO]:
+    """
+    原子写入文件：先写同目录下的临时文件并 fsync，成功后再替换目标文件
+
+    写入过程中崩溃只会留下临时文件，不会留下写了一半的目标文件
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, path)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.unlink(temp_name)
+        raise
+
+
+def _statistics(scores: List[int], total: int) -> Dict:
+    return {
+        "average_score": round(sum(scores) / len(scores), 2),
+        "max_score": max(scores),
+        "min_score": min(scores),
+        "graded_count": len(scores),
+        "error_count": total - len(scores)
     }
 
-    # 计算统计信息
-    valid_scores = [r.score for r in results if r.error is None]
-    if valid_scores:
-        output_data["statistics"] = {
-            "average_score": round(sum(valid_scores) / len(valid_scores), 2),
-            "max_score": max(valid_scores),
-            "min_score": min(valid_scores),
-            "graded_count": len(valid_scores),
-            "error_count": len(results) - len(valid_scores)
-        }
 
+def write_json_result(results: Iterable[GradingResult], homework_name: str, output_path: str,
+                      metrics: Optional[Dict] = None) -> str:
+    """
+    将批改结果写入 JSON 文件，metrics 为本次批改的调用指标汇总（可选）
+
+    逐个学生写出，不在内存中构建完整文档；统计信息在学生列表之后写入
+    """
     output_file = Path(output_path) / "results.json"
-    output_file.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=2)
+    valid_scores: List[int] = []
+    duplicates: List[Dict] = []
+    total = 0
+    with atomic_write(output_file) as f:
+        f.write("{\n")
+        f.write(f'  "homework": {json.dumps(homework_name, ensure_ascii=False)},\n')
+        f.write(f'  "graded_at": "{datetime.now().isoformat()}",\n')
+        f.write('  "students": [')
+        for r in results:
+            student = json.dumps(r.to_dict(), ensure_ascii=False, indent=2)
+            f.write(("\n" if total == 0 else ",\n") + "    " + student.replace("\n", "\n    "))
+            total += 1
+            if r.error is None:
+                valid_scores.append(r.score)
+            if r.duplicate_of:
+                duplicates.append({"student_id": r.student_id, "duplicate_of": r.duplicate_of})
+        f.write("\n  ],\n" if total else "],\n")
+        f.write(f'  "total_students": {total}')
+
+        # 统计信息
+        tail: Dict = {}
+        if valid_scores:
+            tail["statistics"] = _statistics(valid_scores, total)
+        duplicate_groups = build_duplicate_groups(duplicates)
+        if duplicate_groups:
+            tail["duplicate_groups"] = duplicate_groups
+        if metrics is not None:
+            tail["metrics"] = metrics
+        for key, value in tail.items():
+            text = json.dumps(value, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            f.write(f',\n  "{key}": {text}')
+        f.write("\n}\n")
 
     return str(output_file)
 
 
-def write_markdown_report(results: List[GradingResult], homework_name: str, output_path: str) -> str:
-    """将批改结果写入 Markdown 报告"""
-    output_file = Path(output_path) / "report.md"
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-
+def render_student_section(r: GradingResult) -> str:
+    """渲染单个学生的详细批改结果（报告片段）"""
     lines = [
-        f"# {homework_name} 作业批改报告",
-        f"\n批改时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-        f"\n学生总数: {len(results)}",
+        f"### 学号: {r.student_id}",
+        f"**分数: {r.score}**\n",
     ]
-
-    # 统计信息
-    valid_scores = [r.score for r in results if r.error is None]
-    if valid_scores:
-        lines.extend([
-            "\n## 统计信息",
-            f"- 平均分: {round(sum(valid_scores) / len(valid_scores), 2)}",
-            f"- 最高分: {max(valid_scores)}",
-            f"- 最低分: {min(valid_scores)}",
-            f"- 成功批改: {len(valid_scores)} 人",
-            f"- 批改失败: {len(results) - len(valid_scores)} 人",
-        ])
-
-    # 成绩汇总表
-    lines.extend([
-        "\n## 成绩汇总",
-        "\n| 学号 | 分数 | 状态 |",
-        "| --- | --- | --- |",
-    ])
-
-    for r in sorted(results, key=lambda x: x.student_id):
-        status = "成功" if r.error is None else "失败"
-        lines.append(f"| {r.student_id} | {r.score} | {status} |")
-
-    # 详细批改结果
-    lines.append("\n## 详细批改结果\n")
-
-    for r in sorted(results, key=lambda x: x.student_id):
-        lines.append(f"### 学号: {r.student_id}")
-        lines.append(f"**分数: {r.score}**\n")
-
-        if r.error:
-            lines.append(f"**错误:** {r.error}\n")
-        else:
-            lines.append(f"**评语:** {r.comments}\n")
-
-            if r.deductions:
-                lines.append("**扣分项:**")
-                for d in r.deductions:
-                    lines.append(f"- {d.get('reason', '未知原因')} (-{d.get('points', 0)}分)")
-                lines.append("")
-
-        lines.append("---\n")
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+    if r.duplicate_of:
+        lines.append(f"**与 {r.duplicate_of} 的提交重复（去除注释和空白后相同），沿用其批改结果**\n")
+    if r.checks is not None:
+        check_line = "编译成功" if r.checks["compiled"] else "编译失败"
+        if r.checks["total"]:
+            check_line += f"，测试用例通过 {r.checks['passed']}/{r.checks['total']}"
+        lines.append(f"**编译测试:** {check_line}\n")
+    if r.tier == "strong":
+        lines.append(f"**由强模型批改（升级原因: {ESCALATION_REASONS.get(r.escalation, r.escalation)}）**\n")
+
+    if r.error:
+        lines.append(f"**错误:** {r.error}\n")
+    else:
+        lines.append(f"**评语:** {r.comments}\n")
+
+        if r.deductions:
+            lines.append("**扣分项:**")
+            for d in r.deductions:
+                lines.append(f"- {d.get('reason', '未知原因')} (-{d.get('points', 0)}分)")
+            lines.append("")
+
+    lines.append("---\n")
+    return "\n".join(lines) + "\n"
+
+
+def _load_fragment_index(fragment_dir: Path) -> Dict[str, Dict]:
+    index_file = fragment_dir / FRAGMENT_INDEX_NAME
+    if not index_file.exists():
+        return {}
+    try:
+        with open(index_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("students", {})
+    except (json.JSONDecodeError, OSError):
+        return {}
+
+
+def write_markdown_report(results: Iterable[GradingResult], homework_name: str, output_path: str,
+                          incremental: bool = False,
+                          student_ids: Optional[Iterable[str]] = None) -> str:
+    """
+    将批改结果写入 Markdown 报告
+
+    每个学生的详细结果渲染为 report.d/<学号>.md 片段，report.d/index.json 记录每个学生的分数和状态；
+    report.md 由索引（统计信息、成绩汇总表）和片段拼接而成，不在内存中构建完整报告。
+
+    Args:
+        results: 要渲染的学生结果。incremental 为 False 时是全部学生，否则只是发生变化的学生
+        incremental: 为 True 且已有索引时只重新渲染 results 中的学生，其余学生沿用已有片段
+        student_ids: 报告中应包含的全部学号（可选），不在其中的旧片段会被删除
+    """
+    output_dir = Path(output_path)
+    fragment_dir = output_dir / FRAGMENT_DIR_NAME
+    fragment_dir.mkdir(parents=True, exist_ok=True)
+
+    index = _load_fragment_index(fragment_dir) if incremental else {}
+    if not incremental:
+        # 全量渲染：清除旧片段
+        for fragment in fragment_dir.glob("*.md"):
+            fragment.unlink()
+
+    for r in results:
+        with atomic_write(fragment_dir / f"{r.student_id}.md") as f:
+            f.write(render_student_section(r))
+        index[r.student_id] = {"score": r.score, "ok": r.error is None}
+
+    if student_ids is not None:
+        keep = set(student_ids)
+        for student_id in [sid for sid in index if sid not in keep]:
+            del index[student_id]
+            fragment = fragment_dir / f"{student_id}.md"
+            if fragment.exists():
+                fragment.unlink()
+
+    with atomic_write(fragment_dir / FRAGMENT_INDEX_NAME) as f:
+        json.dump({"homework": homework_name, "students": index}, f, ensure_ascii=False)
+
+    return assemble_markdown_report(index, homework_name, output_dir)
+
+
+def assemble_markdown_report(index: Dict[str, Dict], homework_name: str, output_dir: Path) -> str:
+    """根据索引和片段文件拼接 report.md"""
+    output_file = output_dir / "report.md"
+    fragment_dir = output_dir / FRAGMENT_DIR_NAME
+    student_ids = sorted(index)
+    valid_scores = [index[sid]["score"] for sid in student_ids if index[sid]["ok"]]
+
+    with atomic_write(output_file) as f:
+        f.write(f"# {homework_name} 作业批改报告\n")
+        f.write(f"\n批改时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"\n学生总数: {len(student_ids)}\n")
+
+        # 统计信息
+        if valid_scores:
+            stats = _statistics(valid_scores, len(student_ids))
+            f.write("\n## 统计信息\n")
+            f.write(f"- 平均分: {stats['average_score']}\n")
+            f.write(f"- 最高分: {stats['max_score']}\n")
+            f.write(f"- 最低分: {stats['min_score']}\n")
+            f.write(f"- 成功批改: {stats['graded_count']} 人\n")
+            f.write(f"- 批改失败: {stats['error_count']} 人\n")
+
+        # 成绩汇总表
+        f.write("\n## 成绩汇总\n")
+        f.write("\n| 学号 | 分数 | 状态 |\n")
+        f.write("| --- | --- | --- |\n")
+        for sid in student_ids:
+            status = "成功" if index[sid]["ok"] else "失败"
+            f.write(f"| {sid} | {index[sid]['score']} | {status} |\n")
+
+        # 详细批改结果
+        f.write("\n## 详细批改结果\n\n")
+        for sid in student_ids:
+            try:
+                with open(fragment_dir / f"{sid}.md", "r", encoding="utf-8") as fragment:
+                    shutil.copyfileobj(fragment, f)
+            except FileNotFoundError:
+                # 片段被误删等情况：不中断整个报告，运行 report 子命令可从结果存储全量重新生成
+                f.write(f"### 学号: {sid}\n"
+                        f"**分数: {index[sid]['score']}**\n\n"
+                        f"**详细批改结果缺失（报告片段文件不存在），"
+                        f"可运行 `python main.py report` 重新生成报告**\n\n---\n\n")
 
     return str(output_file)
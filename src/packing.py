@@ -0,0 +1,98 @@
+"""请求打包模块：把多名学生的提交放进同一个请求，分摊题目和附件的 token"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from .config import Config
+
+T = TypeVar("T")
+
+
+def plan_packs(items: Iterable[Tuple[T, int]], max_tokens: int,
+               max_students: int) -> Iterator[List[T]]:
+    """
+    按顺序把 (项目, token 数) 贪心分组，每组 token 合计不超过 max_tokens、人数不超过 max_students
+
+    单项超过预算时单独成组。边读取边产出分组，不需要先拿到全部项目
+    """
+    pack: List[T] = []
+    pack_tokens = 0
+    for item, tokens in items:
+        if pack and (pack_tokens + tokens > max_tokens or len(pack) >= max_students):
+            yield pack
+            pack, pack_tokens = [], 0
+        pack.append(item)
+        pack_tokens += tokens
+    if pack:
+        yield pack
+
+
+def pack_label(index: int) -> str:
+    """打包请求中学生的匿名编号（S1、S2 ...），不向模型暴露学号"""
+    return f"S{index + 1}"
+
+
+def format_packed_submissions(submissions: List[Tuple[str, str]]) -> str:
+    """将 [(匿名编号, 格式化后的学生文件), ...] 拼接为 prompt 中的学生提交部分"""
+    return "\n\n".join(
+        f"### 学生 {label}\n\n{files_formatted}" for label, files_formatted in submissions
+    )
+
+
+def packed_response_schema() -> Dict:
+    """json_schema 响应格式使用的打包结果结构：results 数组，每项为带 id 的批改结果"""
+    item = dict(Config.GRADING_RESPONSE_SCHEMA)
+    item["properties"] = dict(item["properties"], id={"type": "string", "description": "学生编号"})
+    item["required"] = ["id"] + item["required"]
+    return {
+        "type": "object",
+        "properties": {"results": {"type": "array", "items": item}},
+        "required": ["results"],
+        "additionalProperties": False
+    }
+
+
+def _valid_entry(entry) -> bool:
+    if not isinstance(entry, dict):
+        return False
+    score = entry.get("score")
+    if isinstance(score, bool) or not isinstance(score, (int, float)):
+        return False
+    if not isinstance(entry.get("comments", ""), str):
+        return False
+    deductions = entry.get("deductions", [])
+    return isinstance(deductions, list) and all(isinstance(d, dict) for d in deductions)
+
+
+def split_packed_results(result_json: Dict, labels: List[str]) -> Dict[str, Dict]:
+    """
+    按匿名编号拆分打包请求的批改结果
+
+    缺失、重复或字段不合法的条目被丢弃，调用方对这些学生单独重新批改
+
+    Returns:
+        {匿名编号: {"score": ..., "comments": ..., "deductions": [...]}}
+    """
+    entries = result_json.get("results")
+    if not isinstance(entries, list):
+        return {}
+
+    wanted = set(labels)
+    seen: Dict[str, Optional[Dict]] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        label = str(entry.get("id", "")).strip()
+        if label not in wanted:
+            continue
+        # 同一编号出现多次说明模型混淆了学生，两条都不采用
+        seen[label] = None if label in seen else entry
+
+    return {
+        label: {
+            "score": int(entry["score"]),
+            "comments": entry.get("comments", ""),
+            "deductions": entry.get("deductions", [])
+        }
+        for label, entry in seen.items()
+        if entry is not None and _valid_entry(entry)
+    }
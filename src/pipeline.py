@@ -1,5 +1,9 @@
+import itertools
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import Dict, List, Optional, Set, Tuple
 
 from tqdm import tqdm
 
@@ -8,22 +12,116 @@ from .file_reader import (
     read_statement_attachments,
     format_attachments_for_prompt,
     list_student_folders,
-    read_student_files,
-    format_student_files_for_prompt
+    format_student_files_for_prompt,
+    SubmissionLoader
 )
-from .grader import Grader, GradingResult
-from .output_writer import write_json_result, write_markdown_report
+from .cascade import ESCALATION_REASONS
+from .checks import CheckRunner, format_check_report, short_circuit_reason
+from .config import Config
+from .dedup import find_duplicates, submission_fingerprint
+from .similarity import find_similar_pairs, write_similarity_report
+from .journal import ResultJournal
+from .manifest import SubmissionManifest
+from .metrics import summarize_metrics, write_metrics
+from .packing import plan_packs
+from .result import GradingResult
 from .result_manager import ResultManager
+from .work_queue import QUEUE_FILE_NAME, WorkQueue
+
+
+class HomeworkJob:
+    """单个作业目录一次批改所需的全部状态（准备 → 批改 → 汇总）"""
+
+    def __init__(self, homework_dir: str, output_path: Path):
+        self.homework_dir = homework_dir
+        self.homework_name = Path(homework_dir).name
+        self.output_path = output_path
+        self.result_manager = ResultManager(output_path / "results.json")
+        self.manifest = SubmissionManifest(output_path / "manifest.json")
+        self.journal = ResultJournal(output_path / "journal.jsonl")
+        self.statement_hash = ""
+        self.is_regrade_mode = False
+        self.students_to_grade: List[str] = []
+        self.pending_students: List[str] = []
+        self.students_to_call: List[str] = []
+        self.submission_hashes: Dict[str, str] = {}
+        self.duplicate_of: Dict[str, str] = {}
+        self.duplicate_tokens: Dict[str, int] = {}
+        # 检测重复提交时已读取的学生文件，批改时直接使用，不再重复读取
+        self.preloaded_files: Dict[str, List[Dict]] = {}
+        self.homework_description = ""
+        self.attachments: List[Dict[str, str]] = []
+        self.attachments_formatted = ""
+        # 本作业第一个学生开始批改、最后一个学生批改完成的时间，用于计算本作业的吞吐量
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def mark_started(self):
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+
+    def mark_finished(self):
+        self.finished_at = max(self.finished_at or 0.0, time.monotonic())
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        """本作业批改阶段的耗时（多个作业共享线程池时各自计算），没有调用批改时为 None"""
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return self.finished_at - self.started_at
+
+    def record_result(self, result: GradingResult):
+        """补充内容哈希后写入结果日志"""
+        result.submission_hash = self.submission_hashes[result.student_id]
+        result.statement_hash = self.statement_hash
+        self.journal.append(result)
 
 
 class GradingPipeline:
-    def __init__(self):
-        self.grader = Grader()
+    def __init__(self, concurrency: Optional[int] = None, cache_mode: str = "use",
+                 prompt_layout: Optional[str] = None,
+                 response_format: Optional[str] = None,
+                 hedge: Optional[bool] = None,
+                 cascade_model: Optional[str] = None):
+        self.concurrency = concurrency if concurrency is not None else Config.CONCURRENCY
+        if self.concurrency < 1:
+            raise ValueError("并发数必须为正整数")
+        # Grader 在第一次需要调用 API 时才创建（导入 openai、检查 API Key、建立连接池），
+        # 没有学生需要批改时不做这些工作
+        self._grader_options = {
+            "max_concurrency": self.concurrency,
+            "cache_mode": cache_mode,
+            "prompt_layout": prompt_layout,
+            "response_format": response_format,
+            "hedge": hedge,
+            "cascade_model": cascade_model
+        }
+        self._grader = None
+        self._check_runner: Optional[CheckRunner] = None
+
+    def _ensure_grader(self):
+        """创建 Grader（导入 openai、检查 API Key），只在第一次调用时执行"""
+        if self._grader is None:
+            from .grader import Grader
+            self._grader = Grader(**self._grader_options)
+        return self._grader
+
+    @property
+    def grader(self):
+        return self._ensure_grader()
 
     def run(self, homework_dir: str,
             output_dir: Optional[str] = None,
             regrade_students: Optional[List[str]] = None,
-            regrade_failed: bool = False) -> List[GradingResult]:
+            regrade_failed: bool = False,
+            incremental: bool = False,
+            resume: bool = False,
+            batch: bool = False,
+            dedup: bool = False,
+            similarity: bool = False,
+            distributed: bool = False,
+            pack: bool = False,
+            checks: bool = False) -> List[GradingResult]:
         """
         运行批改流程
 
@@ -32,35 +130,190 @@ class GradingPipeline:
             output_dir: 输出目录路径（可选），默认为作业目录下的 results/
             regrade_students: 要重新批改的学号列表（可选）
             regrade_failed: 是否重新批改所有失败的学生
+            incremental: 是否只批改提交或题目发生变化的学生
+            resume: 是否从上次中断的结果日志继续，只批改日志中缺失的学生
+            batch: 是否通过 Batch API 离线批改
+            dedup: 是否检测重复提交，每组重复提交只批改一次
+            similarity: 是否生成全体学生的相似提交报告（similarity.md）
+            distributed: 是否作为分布式工作进程，从输出目录中的共享任务队列领取学生
+            pack: 是否把多名学生的提交打包进同一个请求，分摊题目和附件的 token
+            checks: 是否在调用 LLM 之前编译学生提交并运行 statements/tests/ 中的测试用例
 
         Returns:
-            批改结果列表
+            批改结果列表（由其他工作进程汇总时为空列表）
         """
-        homework_path = Path(homework_dir)
-        homework_name = homework_path.name
-        output_path = Path(output_dir) if output_dir else homework_path / "results"
-        result_file = output_path / "results.json"
+        output_path = Path(output_dir) if output_dir else Path(homework_dir) / "results"
+        all_results = self.run_many(
+            [(homework_dir, output_path)],
+            regrade_students=regrade_students,
+            regrade_failed=regrade_failed,
+            incremental=incremental,
+            resume=resume,
+            batch=batch,
+            dedup=dedup,
+            similarity=similarity,
+            distributed=distributed,
+            pack=pack,
+            checks=checks
+        )
+        return all_results.get(homework_dir, [])
+
+    def run_many(self, homeworks: List[Tuple[str, Path]],
+                 regrade_students: Optional[List[str]] = None,
+                 regrade_failed: bool = False,
+                 incremental: bool = False,
+                 resume: bool = False,
+                 batch: bool = False,
+                 dedup: bool = False,
+                 similarity: bool = False,
+                 distributed: bool = False,
+                 pack: bool = False,
+                 checks: bool = False) -> Dict[str, List[GradingResult]]:
+        """
+        批改多个作业目录
 
-        # 判断是否为重新批改模式
-        is_regrade_mode = bool(regrade_students) or regrade_failed
+        每个作业的题目和附件只读取一次；所有作业的学生进入同一个全局任务队列，
+        共享并发数、速率限制和响应缓存，批改结果仍分别写入各自的输出目录。
+
+        Args:
+            homeworks: [(作业目录, 输出目录), ...]
+            其余参数与 run() 相同，对每个作业生效
 
-        # 初始化结果管理器
-        result_manager = ResultManager(result_file)
+        Returns:
+            {作业目录: 批改结果列表}
+        """
+        jobs: List[HomeworkJob] = []
+        for homework_dir, output_path in homeworks:
+            if len(homeworks) > 1:
+                print("=" * 50)
+            job = self._prepare_job(
+                homework_dir, output_path,
+                regrade_students=regrade_students,
+                regrade_failed=regrade_failed,
+                incremental=incremental,
+                resume=resume,
+                dedup=dedup,
+                distributed=distributed
+            )
+            if job is not None:
+                jobs.append(job)
+
+        if not jobs:
+            return {}
+
+        # 在启动批改线程之前创建 Grader，API Key 等配置错误直接报告，而不是让每个学生各自失败
+        # （分布式模式下队列中可能有其他工作进程加入的学生）
+        if distributed or any(job.students_to_call for job in jobs):
+            self._ensure_grader()
+        # 执行批改
+        grading_started = time.monotonic()
+        if checks and batch:
+            print("提示: Batch API 批改不运行编译测试预检查")
+        elif checks:
+            self._check_runner = CheckRunner(Config.CHECK_WORKERS)
+            if not distributed:
+                # 分布式模式下学生由哪个进程批改事先未知，领取后再检查
+                for job in jobs:
+                    self._check_runner.schedule(job.homework_dir, job.students_to_call)
+        try:
+            if batch:
+                for job in jobs:
+                    self._grade_students_batch(job, resume=resume)
+            elif distributed:
+                self._grade_students_distributed(jobs)
+            else:
+                self._grade_students(jobs, pack=pack)
+        finally:
+            if self._check_runner is not None:
+                self._check_runner.close()
+                self._check_runner = None
+        elapsed = time.monotonic() - grading_started
+
+        all_results: Dict[str, List[GradingResult]] = {}
+        for job in jobs:
+            # 分布式模式下只由第一个发现队列完成的工作进程汇总输出
+            if distributed and not job.journal.claim_finalize():
+                print(f"{job.homework_name}: 队列已完成，结果由其他工作进程汇总")
+                job.journal.close()
+                continue
+            all_results[job.homework_dir] = self._finalize_job(
+                job, similarity=similarity,
+                elapsed=job.elapsed if job.elapsed is not None else elapsed
+            )
+
+        self._print_run_stats()
+        return all_results
+
+    def _prepare_job(self, homework_dir: str, output_path: Path,
+                     regrade_students: Optional[List[str]],
+                     regrade_failed: bool,
+                     incremental: bool,
+                     resume: bool,
+                     dedup: bool,
+                     distributed: bool = False) -> Optional[HomeworkJob]:
+        """确定要批改的学生、读取题目和附件；没有需要批改的学生时返回 None"""
+        job = HomeworkJob(homework_dir, output_path)
+        homework_name = job.homework_name
+        if not distributed:
+            self._remove_finalized_queue(output_path)
+
+        # 判断是否为重新批改模式（增量批改同样合并到已有结果）
+        job.is_regrade_mode = bool(regrade_students) or regrade_failed or incremental
+        job.statement_hash = job.manifest.statement_hash(homework_dir)
 
         # 确定要批改的学生列表
         students_to_grade = self._determine_students_to_grade(
             homework_dir=homework_dir,
-            result_manager=result_manager,
+            result_manager=job.result_manager,
             regrade_students=regrade_students,
-            regrade_failed=regrade_failed
+            regrade_failed=regrade_failed,
+            incremental=incremental,
+            manifest=job.manifest,
+            statement_hash=job.statement_hash
         )
 
         if not students_to_grade:
-            print("没有需要批改的学生。")
-            return []
+            job.manifest.save()
+            print(f"{homework_name}: 没有需要批改的学生。")
+            return None
+
+        # 批改前记录内容哈希，避免批改期间文件变化导致记录不一致
+        job.students_to_grade = students_to_grade
+        job.submission_hashes = {
+            sid: job.manifest.submission_hash(homework_dir, sid) for sid in students_to_grade
+        }
+        job.manifest.save()
+
+        # 结果日志：每完成一个学生立即落盘，中断后可用 resume 继续
+        if distributed:
+            # 共享任务队列代替结果日志，队列中已完成的学生无需再批改
+            job.journal = WorkQueue(
+                output_path / QUEUE_FILE_NAME, lease_seconds=Config.QUEUE_LEASE_SECONDS
+            )
+            if job.journal.is_finalized():
+                # 其他工作进程已经汇总输出：不再重新加入学生，否则会把整个作业再批改一遍
+                print(f"{homework_name}: 分布式任务队列已完成并汇总，本进程直接退出"
+                      f"（重新分布式批改前先不带 --worker 运行一次，或删除 {QUEUE_FILE_NAME}）")
+                job.journal.close()
+                return None
+            journaled = job.journal.replay()
+            job.pending_students = [sid for sid in students_to_grade if sid not in journaled]
+            print(f"任务队列: 已完成 {len(students_to_grade) - len(job.pending_students)} 人，"
+                  f"剩余 {len(job.pending_students)} 人")
+        elif resume:
+            journaled = job.journal.replay()
+            job.pending_students = [sid for sid in students_to_grade if sid not in journaled]
+            print(f"从结果日志恢复: 已完成 {len(students_to_grade) - len(job.pending_students)} 人，"
+                  f"剩余 {len(job.pending_students)} 人")
+        else:
+            job.journal.reset()
+            job.pending_students = students_to_grade
 
         # 打印批改信息
-        if is_regrade_mode:
+        if incremental and not regrade_students and not regrade_failed:
+            print(f"增量批改作业: {homework_name}")
+            print(f"需要批改的学生数: {len(students_to_grade)}")
+        elif job.is_regrade_mode:
             print(f"重新批改作业: {homework_name}")
             print(f"重新批改学生数: {len(students_to_grade)}")
         else:
@@ -70,77 +323,188 @@ class GradingPipeline:
 
         # 读取作业描述
         print("读取作业描述...")
-        homework_description = read_homework_description(homework_dir)
-        print(f"作业描述长度: {len(homework_description)} 字符")
+        job.homework_description = read_homework_description(homework_dir)
+        print(f"作业描述长度: {len(job.homework_description)} 字符")
 
         # 读取附件
         print("读取作业附件...")
-        attachments = read_statement_attachments(homework_dir)
-        attachments_formatted = format_attachments_for_prompt(attachments)
-        if attachments:
-            print(f"附件数量: {len(attachments)} 个")
+        job.attachments = read_statement_attachments(homework_dir)
+        job.attachments_formatted = format_attachments_for_prompt(job.attachments)
+        if job.attachments:
+            print(f"附件数量: {len(job.attachments)} 个")
         else:
             print("无附件")
 
-        # 执行批改
-        results = self._grade_students(
-            homework_dir=homework_dir,
-            student_ids=students_to_grade,
-            homework_description=homework_description,
-            attachments_formatted=attachments_formatted
+        # 检测重复提交：每组只批改代表学生，其余学生沿用代表的结果
+        if dedup:
+            job.duplicate_of, job.duplicate_tokens, submissions = self._find_duplicate_submissions(
+                homework_dir, students_to_grade
+            )
+            group_count = len(set(job.duplicate_of.values()))
+            print(f"重复提交: {group_count} 组，共 {len(job.duplicate_of)} 人无需单独批改")
+        job.students_to_call = [
+            sid for sid in job.pending_students if sid not in job.duplicate_of
+        ]
+        if dedup:
+            # 只保留需要调用 API 的学生，重复学生的文件不再需要
+            job.preloaded_files = {
+                sid: submissions[sid] for sid in job.students_to_call if sid in submissions
+            }
+        if distributed:
+            job.journal.enqueue(job.students_to_call)
+
+        return job
+
+    def _finalize_job(self, job: HomeworkJob, similarity: bool = False,
+                      elapsed: Optional[float] = None) -> List[GradingResult]:
+        """将结果日志写入结果存储，导出 results.json、report.md 和调用指标，并打印统计信息"""
+        homework_name = job.homework_name
+        output_path = job.output_path
+
+        # 重复提交的学生复制代表的批改结果
+        journaled = job.journal.replay()
+        for sid in job.pending_students:
+            if sid in job.duplicate_of:
+                result = GradingResult.from_dict(journaled[job.duplicate_of[sid]])
+                result.student_id = sid
+                result.duplicate_of = job.duplicate_of[sid]
+                result.usage = None
+                result.metrics = None
+                result.submission_tokens = job.duplicate_tokens.get(sid)
+                job.record_result(result)
+
+        # 最终结果以结果日志为准（包含之前中断前已完成的学生）
+        journaled = job.journal.replay()
+        results = [GradingResult.from_dict(journaled[sid]) for sid in job.students_to_grade]
+
+        metrics = summarize_metrics(results, elapsed)
+
+        # 写入结果存储（重新批改时只覆盖本次批改的学生），再从存储导出报告
+        print(f"\n生成批改报告: {homework_name}")
+        job.result_manager.save_results(results, replace=not job.is_regrade_mode)
+        json_path, md_path = job.result_manager.export(
+            homework_name, str(output_path), metrics=metrics,
+            changed=results if job.is_regrade_mode else None
         )
-
-        # 保存结果（合并或全新）
-        print(f"\n生成批改报告...")
-
-        if is_regrade_mode:
-            # 合并模式
-            merged_data = result_manager.merge_results(results, homework_name)
-            json_path = result_manager.save_merged_results(merged_data, str(output_path))
-            print(f"JSON 结果已保存: {json_path}")
-
-            # 重新生成 Markdown 报告（基于合并后的完整数据）
-            all_results = [
-                GradingResult(
-                    student_id=s["student_id"],
-                    score=s["score"],
-                    comments=s["comments"],
-                    deductions=s["deductions"],
-                    error=s["error"]
-                )
-                for s in merged_data["students"]
-            ]
-            md_path = write_markdown_report(all_results, homework_name, str(output_path))
-            print(f"Markdown 报告已保存: {md_path}")
+        job.result_manager.close()
+        print(f"JSON 结果已保存: {json_path}")
+        print(f"Markdown 报告已保存: {md_path}")
+
+        metrics_path = write_metrics(metrics, homework_name, str(output_path))
+        print(f"调用指标已保存: {metrics_path}")
+
+        # 最终结果已写入，结果日志不再需要；分布式任务队列保留并标记为已汇总，
+        # 避免较晚启动的工作进程重新创建队列、再批改一遍
+        if isinstance(job.journal, WorkQueue):
+            job.journal.mark_finalized()
+            job.journal.close()
         else:
-            # 全新模式
-            json_path = write_json_result(results, homework_name, str(output_path))
-            print(f"JSON 结果已保存: {json_path}")
+            job.journal.remove()
 
-            md_path = write_markdown_report(results, homework_name, str(output_path))
-            print(f"Markdown 报告已保存: {md_path}")
+        if similarity:
+            similarity_path = self._write_similarity_report(
+                job.homework_dir, homework_name, output_path, job.attachments
+            )
+            print(f"相似提交报告已保存: {similarity_path}")
 
         # 打印统计信息
-        self._print_summary(results, is_regrade=is_regrade_mode)
+        self._print_summary(results, is_regrade=job.is_regrade_mode, homework_name=homework_name,
+                            metrics=metrics)
 
         return results
 
+    def _find_duplicate_submissions(
+        self,
+        homework_dir: str,
+        student_ids: List[str]
+    ) -> Tuple[Dict[str, str], Dict[str, int], Dict[str, List[Dict]]]:
+        """
+        读取所有学生文件并检测重复提交
+
+        Returns:
+            ({重复学生学号: 代表学号}, {学号: 提交 token 数}, {学号: 已读取的学生文件})
+        """
+        fingerprints: Dict[str, str] = {}
+        submission_tokens: Dict[str, int] = {}
+        submissions: Dict[str, List[Dict]] = {}
+        with self._create_loader(homework_dir, student_ids) as loader:
+            for student_id in student_ids:
+                try:
+                    student_files = loader.get(student_id)
+                except Exception:
+                    # 读取失败的学生交给正常批改流程报告错误
+                    continue
+                # 空文件夹不参与分组，由正常批改流程报告错误
+                if student_files:
+                    fingerprints[student_id] = submission_fingerprint(student_files)
+                    submission_tokens[student_id] = sum(f["tokens"] for f in student_files)
+                    submissions[student_id] = student_files
+
+        return find_duplicates(fingerprints), submission_tokens, submissions
+
+    def _write_similarity_report(
+        self,
+        homework_dir: str,
+        homework_name: str,
+        output_path: Path,
+        attachments: List[Dict[str, str]]
+    ) -> str:
+        """对作业目录下的所有学生（不只是本次批改的学生）生成相似提交报告"""
+        all_students = list_student_folders(homework_dir)
+        submissions: Dict[str, List[Dict]] = {}
+        with self._create_loader(homework_dir, all_students) as loader:
+            for student_id in all_students:
+                try:
+                    submissions[student_id] = loader.get(student_id)
+                except Exception:
+                    continue
+
+        pairs = find_similar_pairs(
+            submissions,
+            threshold=Config.SIMILARITY_THRESHOLD,
+            base_files=attachments
+        )
+        return write_similarity_report(
+            pairs, homework_name, str(output_path),
+            threshold=Config.SIMILARITY_THRESHOLD,
+            student_count=len(submissions)
+        )
+
     def _determine_students_to_grade(
         self,
         homework_dir: str,
         result_manager: ResultManager,
         regrade_students: Optional[List[str]],
-        regrade_failed: bool
+        regrade_failed: bool,
+        incremental: bool = False,
+        manifest: Optional[SubmissionManifest] = None,
+        statement_hash: Optional[str] = None
     ) -> List[str]:
         """确定要批改的学生列表"""
 
         # 全量批改模式
-        if not regrade_students and not regrade_failed:
+        if not regrade_students and not regrade_failed and not incremental:
             return list_student_folders(homework_dir)
 
         # 重新批改模式：收集所有需要重新批改的学号
         students_to_grade: Set[str] = set()
 
+        # 添加提交或题目发生变化的学号（包括新提交的学生）
+        if incremental:
+            graded_hashes = result_manager.get_graded_hashes()
+            changed_ids = []
+            for sid in list_student_folders(homework_dir):
+                previous = graded_hashes.get(sid)
+                if (previous is None
+                        or previous["statement_hash"] != statement_hash
+                        or previous["submission_hash"] != manifest.submission_hash(homework_dir, sid)):
+                    changed_ids.append(sid)
+            if changed_ids:
+                print(f"发现 {len(changed_ids)} 个提交或题目有变化的学生")
+                students_to_grade.update(changed_ids)
+            else:
+                print("所有学生的提交和题目均未变化")
+
         # 添加指定的学号
         if regrade_students:
             students_to_grade.update(regrade_students)
@@ -171,58 +535,374 @@ class GradingPipeline:
 
         return sorted(valid_students)
 
-    def _grade_students(
-        self,
-        homework_dir: str,
-        student_ids: List[str],
-        homework_description: str,
-        attachments_formatted: str = ""
-    ) -> List[GradingResult]:
-        """批改指定学生列表"""
-        results: List[GradingResult] = []
-
-        print("\n开始批改...")
-        for student_id in tqdm(student_ids, desc="批改进度"):
+    def _grade_students(self, jobs: List[HomeworkJob], pack: bool = False):
+        """
+        批改所有作业中需要调用 API 的学生
+
+        所有作业的学生进入同一个全局队列（按作业、学号顺序），共享同一个线程池和调度器；
+        每个学生完成时立即写入所属作业的结果日志。pack 为 True 时同一作业的相邻学生按 token 预算
+        打包进同一个请求
+        """
+        tasks = [(job, sid) for job in jobs for sid in job.students_to_call]
+        if not tasks:
+            return
+        if pack and self.grader.cascade_model:
+            print("提示: 级联批改不支持请求打包，逐个学生批改")
+            pack = False
+
+        mode = "，打包请求" if pack else ""
+        print(f"\n开始批改... (学生数: {len(tasks)}，并发数: {self.concurrency}{mode})")
+        loaders = {id(job): self._create_job_loader(job, job.students_to_call) for job in jobs}
+
+        def grade_unit(job: HomeworkJob, unit) -> List[GradingResult]:
+            job.mark_started()
+            try:
+                if pack:
+                    return self._grade_pack(job, loaders[id(job)], unit)
+                return [self._grade_student(job, loaders[id(job)], unit)]
+            finally:
+                job.mark_finished()
+
+        units = self._iter_packs(jobs, loaders) if pack else iter(tasks)
+        try:
+            if self.concurrency == 1:
+                with tqdm(total=len(tasks), desc="批改进度") as progress:
+                    for job, unit in units:
+                        for result in grade_unit(job, unit):
+                            job.record_result(result)
+                            progress.update(1)
+                return
+
+            # 最多同时提交 concurrency × 2 个任务，完成一个再从 units 取下一个：
+            # 打包分组随批改进度逐步生成，学生文件仍由 SubmissionLoader 按顺序预读
+            max_pending = self.concurrency * 2
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor, \
+                    tqdm(total=len(tasks), desc="批改进度") as progress:
+                pending: Dict = {}
+                try:
+                    for job, unit in itertools.islice(units, max_pending):
+                        pending[executor.submit(grade_unit, job, unit)] = job
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            job = pending.pop(future)
+                            for result in future.result():
+                                job.record_result(result)
+                                progress.update(1)
+                        for job, unit in itertools.islice(units, len(done)):
+                            pending[executor.submit(grade_unit, job, unit)] = job
+                except BaseException:
+                    # 中断（如 Ctrl-C）时取消尚未开始的任务，只等待进行中的请求
+                    for future in pending:
+                        future.cancel()
+                    raise
+        finally:
+            for loader in loaders.values():
+                loader.close()
+
+    def _iter_packs(self, jobs: List[HomeworkJob], loaders: Dict[int, SubmissionLoader]):
+        """
+        按学号顺序把每个作业的学生分组，每组提交的 token 合计不超过 PACK_MAX_TOKENS
+
+        产出 (作业, [(学号, 学生文件), ...])；读取失败的学生文件为 None，由单独批改记录错误
+        """
+        for job in jobs:
+            loader = loaders[id(job)]
+
+            def sized(job=job, loader=loader):
+                for student_id in job.students_to_call:
+                    try:
+                        student_files = loader.get(student_id)
+                    except Exception:
+                        student_files = None
+                    tokens = sum(f["tokens"] for f in student_files) if student_files else 0
+                    yield (student_id, student_files), tokens
+
+            for members in plan_packs(sized(), Config.PACK_MAX_TOKENS, Config.PACK_MAX_STUDENTS):
+                yield job, members
+
+    def _grade_pack(self, job: HomeworkJob, loader: SubmissionLoader,
+                    members: List[Tuple[str, Optional[List[Dict]]]]) -> List[GradingResult]:
+        """在一个请求中批改一组学生，结果缺失或不合法的学生回退为单独批改"""
+        packable = []
+        short_circuited: Dict[str, GradingResult] = {}
+        for student_id, student_files in members:
+            if not student_files:
+                continue
+            check = self._get_check(job, student_id)
+            reason = short_circuit_reason(check)
+            if reason is not None:
+                short_circuited[student_id] = self._short_circuit_result(
+                    student_id, check, reason, sum(f["tokens"] for f in student_files)
+                )
+            else:
+                packable.append((student_id, student_files, check))
+
+        graded: Dict[str, GradingResult] = {}
+        if len(packable) > 1:
+            try:
+                graded = self.grader.grade_packed(
+                    job.homework_description,
+                    [(sid, self._format_submission(files, check)) for sid, files, check in packable],
+                    job.attachments_formatted
+                )
+            except Exception:
+                graded = {}
+        checks = {sid: check for sid, _, check in packable}
+
+        results = []
+        for student_id, student_files in members:
+            result = short_circuited.get(student_id) or graded.get(student_id)
+            if result is not None:
+                if student_id in graded:
+                    result.submission_tokens = sum(f["tokens"] for f in student_files)
+                    result.checks = checks[student_id]
+            else:
+                result = self._grade_student(job, loader, student_id, student_files)
+                if len(packable) > 1 and student_files and result.metrics is not None:
+                    result.metrics["pack_fallback"] = True
+            results.append(result)
+        return results
+
+    def _grade_students_distributed(self, jobs: List[HomeworkJob]):
+        """
+        作为分布式工作进程批改：从各作业的共享任务队列领取学生，直到队列全部完成
+
+        本进程的 concurrency 个线程各自循环领取任务；后台线程定期为持有的租约续期。
+        其他进程持有的任务只要租约未过期就等待，过期（对方崩溃）后重新领取批改。
+        """
+        worker_id = jobs[0].journal.worker_id
+        print(f"\n开始分布式批改... (工作进程: {worker_id}，并发数: {self.concurrency})")
+
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(Config.QUEUE_LEASE_SECONDS / 3):
+                for job in jobs:
+                    # 续期失败（如数据库暂时被锁）不能让线程退出，否则租约到期后任务会被其他进程重复领取
+                    try:
+                        job.journal.heartbeat()
+                    except Exception as e:
+                        tqdm.write(f"警告: {job.homework_name} 的租约续期失败，将在下次心跳时重试: {e}")
+
+        # 学生由哪个进程批改事先未知，不做预读，领取后再读取文件
+        loaders = {id(job): self._create_job_loader(job, []) for job in jobs}
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+
+        with tqdm(desc="本进程批改") as progress:
+            def work():
+                for job in jobs:
+                    queue = job.journal
+                    while not stop.is_set():
+                        student_id = queue.claim()
+                        if student_id is None:
+                            if queue.is_finished():
+                                break
+                            # 剩余任务都被其他进程持有，等待完成或租约过期
+                            stop.wait(Config.QUEUE_POLL_INTERVAL)
+                            continue
+                        job.mark_started()
+                        result = self._grade_student(job, loaders[id(job)], student_id)
+                        job.mark_finished()
+                        job.record_result(result)
+                        progress.update(1)
+
             try:
-                student_files = read_student_files(homework_dir, student_id)
+                with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                    futures = [executor.submit(work) for _ in range(self.concurrency)]
+                    try:
+                        for future in as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        # 中断时不再领取新任务；已领取未完成的任务在租约过期后由其他进程接手
+                        stop.set()
+                        raise
+            finally:
+                stop.set()
+                for loader in loaders.values():
+                    loader.close()
+
+    @staticmethod
+    def _remove_finalized_queue(output_path: Path):
+        """删除已汇总的分布式任务队列（未汇总的队列可能仍有工作进程在使用，保留）"""
+        queue_file = output_path / QUEUE_FILE_NAME
+        if not queue_file.exists():
+            return
+        queue = WorkQueue(queue_file)
+        if queue.is_finalized():
+            queue.remove()
+            print(f"已删除已汇总的分布式任务队列: {queue_file}")
+        else:
+            queue.close()
+
+    def _create_loader(self, homework_dir: str, student_ids: List[str],
+                       preloaded: Optional[Dict[str, List[Dict]]] = None) -> SubmissionLoader:
+        """创建学生文件预读器，预读窗口覆盖所有并发槽位"""
+        return SubmissionLoader(
+            homework_dir,
+            student_ids,
+            token_budget=Config.MAX_STUDENT_TOKENS,
+            max_workers=Config.IO_WORKERS,
+            prefetch=max(Config.IO_WORKERS, self.concurrency * 2),
+            preloaded=preloaded
+        )
 
-                if not student_files:
-                    results.append(GradingResult(
+    def _create_job_loader(self, job: HomeworkJob, student_ids: List[str]) -> SubmissionLoader:
+        """批改用的预读器：检测重复提交时已读取的文件交给预读器，作业本身不再持有"""
+        preloaded, job.preloaded_files = job.preloaded_files, {}
+        return self._create_loader(job.homework_dir, student_ids, preloaded)
+
+    def _grade_students_batch(self, job: HomeworkJob, resume: bool = False):
+        """通过 Batch API 批改单个作业中需要调用 API 的学生"""
+        student_ids = job.students_to_call
+        if not student_ids:
+            return
+
+        results: Dict[str, GradingResult] = {}
+        requests: Dict[str, List[Dict[str, str]]] = {}
+
+        submission_tokens: Dict[str, int] = {}
+
+        job.mark_started()
+        if self.grader.cascade_model:
+            print("提示: Batch API 批改不使用级联批改，所有学生都由强模型批改")
+        print(f"\n渲染批量请求: {job.homework_name}")
+        with self._create_job_loader(job, student_ids) as loader:
+            for student_id in student_ids:
+                try:
+                    student_files = loader.get(student_id)
+                    submission_tokens[student_id] = sum(f["tokens"] for f in student_files)
+                    if not student_files:
+                        results[student_id] = GradingResult(
+                            student_id=student_id,
+                            score=0,
+                            comments="",
+                            deductions=[],
+                            error="学生文件夹为空"
+                        )
+                        continue
+
+                    messages = self.grader.build_messages(
+                        job.homework_description,
+                        format_student_files_for_prompt(student_files),
+                        job.attachments_formatted
+                    )
+                    cached_result = self.grader.lookup_cache(student_id, messages)
+                    if cached_result is not None:
+                        self.grader.record_cache_hit()
+                        results[student_id] = cached_result
+                    else:
+                        requests[student_id] = messages
+
+                except Exception as e:
+                    results[student_id] = GradingResult(
                         student_id=student_id,
                         score=0,
                         comments="",
                         deductions=[],
-                        error="学生文件夹为空"
-                    ))
-                    continue
-
-                files_formatted = format_student_files_for_prompt(student_files)
-
-                result = self.grader.grade_assignment(
-                    student_id=student_id,
-                    homework_description=homework_description,
-                    student_files_formatted=files_formatted,
-                    attachments_formatted=attachments_formatted
-                )
-                results.append(result)
-
-            except Exception as e:
-                results.append(GradingResult(
+                        error=f"处理异常: {e}"
+                    )
+
+        if requests:
+            print(f"提交批量请求: {len(requests)} 个（另有 {len(results)} 个无需调用 API）")
+            from .batch import BatchGrader
+            batch_grader = BatchGrader(self.grader, job.output_path)
+            results.update(batch_grader.grade(
+                requests,
+                resume=resume,
+                on_status=lambda status: print(f"批量任务状态: {status}")
+            ))
+        job.mark_finished()
+
+        for student_id in student_ids:
+            result = results[student_id]
+            result.submission_tokens = submission_tokens.get(student_id)
+            job.record_result(result)
+
+    def _grade_student(
+        self,
+        job: HomeworkJob,
+        loader: SubmissionLoader,
+        student_id: str,
+        student_files: Optional[List[Dict]] = None
+    ) -> GradingResult:
+        """批改单个学生（student_files 为已读取的学生文件，可选），任何异常都转换为带 error 的结果"""
+        try:
+            if student_files is None:
+                student_files = loader.get(student_id)
+
+            if not student_files:
+                return GradingResult(
                     student_id=student_id,
                     score=0,
                     comments="",
                     deductions=[],
-                    error=f"处理异常: {e}"
-                ))
+                    error="学生文件夹为空",
+                    submission_tokens=0
+                )
 
-        return results
+            submission_tokens = sum(f["tokens"] for f in student_files)
+            check = self._get_check(job, student_id)
+            reason = short_circuit_reason(check)
+            if reason is not None:
+                return self._short_circuit_result(student_id, check, reason, submission_tokens)
+
+            result = self.grader.grade_assignment(
+                student_id=student_id,
+                homework_description=job.homework_description,
+                student_files_formatted=self._format_submission(student_files, check),
+                attachments_formatted=job.attachments_formatted,
+                check_score=check["score"] if check else None
+            )
+            result.submission_tokens = submission_tokens
+            result.checks = check
+            return result
+
+        except Exception as e:
+            return GradingResult(
+                student_id=student_id,
+                score=0,
+                comments="",
+                deductions=[],
+                error=f"处理异常: {e}"
+            )
+
+    def _get_check(self, job: HomeworkJob, student_id: str) -> Optional[Dict]:
+        """编译测试预检查的结果，未启用预检查或无需检查时为 None"""
+        if self._check_runner is None:
+            return None
+        return self._check_runner.get(job.homework_dir, student_id)
+
+    @staticmethod
+    def _format_submission(student_files: List[Dict], check: Optional[Dict]) -> str:
+        """格式化学生文件，有编译测试结果时附在最后"""
+        files_formatted = format_student_files_for_prompt(student_files)
+        if check is not None:
+            files_formatted += "\n\n" + format_check_report(check)
+        return files_formatted
+
+    @staticmethod
+    def _short_circuit_result(student_id: str, check: Dict, reason: str,
+                              submission_tokens: int) -> GradingResult:
+        """编译测试预检查已能确定结果（如无法编译）时，不调用 LLM 直接给出 0 分"""
+        return GradingResult(
+            student_id=student_id,
+            score=0,
+            comments=f"{reason}，未调用模型批改。",
+            deductions=[{"reason": reason, "points": 100}],
+            submission_tokens=submission_tokens,
+            checks=check,
+            metrics={"wall_time": 0.0, "attempts": 0, "short_circuit": True}
+        )
 
-    def _print_summary(self, results: List[GradingResult], is_regrade: bool = False):
-        """打印批改统计摘要"""
+    def _print_summary(self, results: List[GradingResult], is_regrade: bool = False,
+                       homework_name: str = "", metrics: Optional[Dict] = None):
+        """打印单个作业的批改统计摘要"""
         action = "重新批改" if is_regrade else "批改"
 
         print("\n" + "=" * 50)
-        print(f"{action}完成!")
+        print(f"{homework_name} {action}完成!" if homework_name else f"{action}完成!")
         print("=" * 50)
 
         valid_results = [r for r in results if r.error is None]
@@ -231,6 +911,57 @@ class GradingPipeline:
         print(f"成功{action}: {len(valid_results)} 人")
         print(f"{action}失败: {len(error_results)} 人")
 
+        token_counts = [r for r in results if r.submission_tokens is not None]
+        if token_counts:
+            total_tokens = sum(r.submission_tokens for r in token_counts)
+            print(f"学生提交 token: 总计 {total_tokens}，平均 {total_tokens / len(token_counts):.0f}")
+            largest = sorted(token_counts, key=lambda r: r.submission_tokens, reverse=True)[:5]
+            print("提交 token 最多的学生: " + ", ".join(
+                f"{r.student_id}({r.submission_tokens})" for r in largest
+            ))
+
+        usages = [r.usage for r in results if r.usage is not None]
+        if usages:
+            prompt_tokens = sum(u["prompt_tokens"] for u in usages)
+            cached_tokens = sum(u["cached_tokens"] for u in usages)
+            completion_tokens = sum(u["completion_tokens"] for u in usages)
+            hit_ratio = cached_tokens / prompt_tokens * 100 if prompt_tokens else 0.0
+            print(f"输入 token: {prompt_tokens}（其中前缀缓存命中 {cached_tokens}，命中率 {hit_ratio:.1f}%）")
+            print(f"输出 token: {completion_tokens}")
+
+        if metrics and metrics["api_students"]:
+            for name, label in (("wall_time", "单个学生耗时"), ("latency", "请求延迟"), ("ttfb", "首字节时间")):
+                quantiles = metrics[name]
+                if quantiles["p50"] is None:
+                    continue
+                print(f"{label}: p50 {quantiles['p50']:.2f}s / p95 {quantiles['p95']:.2f}s / "
+                      f"p99 {quantiles['p99']:.2f}s")
+            print(f"API 请求: {metrics['attempts']} 次（重试 {metrics['retries']} 次，"
+                  f"被限流 {metrics['rate_limited']} 次，JSON 修复请求 {metrics['json_repairs']} 次）")
+            if metrics["packed_students"] or metrics["pack_fallbacks"]:
+                print(f"打包批改: {metrics['packed_students']} 人，"
+                      f"回退单独批改 {metrics['pack_fallbacks']} 人")
+            if "students_per_minute" in metrics:
+                print(f"吞吐量: {metrics['students_per_minute']:.1f} 人/分钟")
+        if metrics and "estimated_cost" in metrics:
+            print(f"估算费用: {metrics['estimated_cost']:.4f}")
+        if metrics and "checks" in metrics:
+            checks = metrics["checks"]
+            line = f"编译测试预检查: {checks['students']} 人，编译失败 {checks['compile_failed']} 人"
+            if checks["tests_total"]:
+                line += f"，测试用例通过 {checks['tests_passed']}/{checks['tests_total']}"
+            if checks["short_circuits"]:
+                line += f"，{checks['short_circuits']} 人未调用 LLM"
+            print(line)
+        if metrics and "cascade" in metrics:
+            cascade = metrics["cascade"]
+            print(f"级联批改: {cascade['escalated']}/{cascade['students']} 人升级到强模型"
+                  f"（{cascade['escalation_rate']:.1%}）")
+            for reason, count in sorted(cascade["reasons"].items(), key=lambda item: -item[1]):
+                print(f"  - {ESCALATION_REASONS.get(reason, reason)}: {count} 人")
+            if cascade["time_saved"] is not None:
+                print(f"估算节省模型耗时: {cascade['time_saved']:.1f}s")
+
         if valid_results:
             scores = [r.score for r in valid_results]
             print(f"本次平均分: {sum(scores) / len(scores):.2f}")
@@ -241,3 +972,23 @@ class GradingPipeline:
             print(f"\n{action}失败的学生:")
             for r in error_results:
                 print(f"  - {r.student_id}: {r.error}")
+
+    def _print_run_stats(self):
+        """打印所有作业共享的调度统计（响应缓存、限流、熔断、对冲请求）"""
+        if self._grader is None:
+            return
+        limiter = self.grader.rate_limiter
+        breaker = self.grader.circuit_breaker
+        if (not self.grader.cache_hits and not limiter.throttled_count
+                and not self.grader.hedges_sent and not breaker.open_count):
+            return
+
+        print("\n" + "-" * 50)
+        if self.grader.cache_hits:
+            print(f"缓存命中: {self.grader.cache_hits} 人（未调用 API）")
+        if limiter.throttled_count:
+            print(f"被限流次数: {limiter.throttled_count}（当前并发上限: {limiter.concurrency_limit}）")
+        if breaker.open_count:
+            print(f"熔断次数: {breaker.open_count}（服务连续出错时暂停发送请求）")
+        if self.grader.hedges_sent:
+            print(f"对冲请求: 发出 {self.grader.hedges_sent} 次，其中 {self.grader.hedges_won} 次先于原请求返回")
@@ -0,0 +1,395 @@
+"""批改预估模块：不调用 API，渲染每个学生的 prompt 并统计 token，估算费用和耗时"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .config import Config
+from .file_reader import (
+    count_tokens,
+    format_attachments_for_prompt,
+    format_student_files_for_prompt,
+    list_student_folders,
+    load_ignore_patterns,
+    read_homework_description,
+    read_statement_attachments,
+    read_student_files,
+    tiktoken
+)
+from .manifest import SubmissionManifest
+from .metrics import percentile
+from .output_writer import atomic_write
+from .packing import format_packed_submissions, pack_label, plan_packs
+from .prompts import build_messages, build_packed_messages, build_prefix
+from .result_manager import ResultManager
+
+# 预估结果（同时作为下次预估的 token 缓存），位于输出目录下
+PLAN_FILE_NAME = "plan.json"
+
+# chat 格式中每条消息的额外 token 和回复起始的 token（与 OpenAI 的计数方式一致）
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+
+# 服务商只缓存至少这么长的相同前缀（OpenAI 为 1024 tokens）
+_MIN_CACHED_PREFIX = 1024
+
+# 需要计算的学生少于该数量时直接在当前进程中计算，不启动进程池
+_MIN_PARALLEL_STUDENTS = 32
+
+# 上次批改的延迟样本少于该数量，或中位数低于该秒数（如模拟服务）时不可信，改用 PLAN_LATENCY_SECONDS
+_MIN_LATENCY_SAMPLES = 5
+_MIN_PLAUSIBLE_LATENCY = 0.5
+
+
+def count_message_tokens(messages: List[Dict[str, str]]) -> int:
+    """统计请求消息的输入 token 数（含每条消息的格式开销）"""
+    return sum(count_tokens(m["content"]) + _MESSAGE_OVERHEAD for m in messages) + _REPLY_OVERHEAD
+
+
+def parse_model_prices(spec: str) -> Dict[str, Tuple[float, float, float]]:
+    """解析 MODEL_PRICES，返回 {模型: (输入, 缓存输入, 输出)}，单价为每百万 token"""
+    prices = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        try:
+            model, values = item.split("=", 1)
+            input_price, cached_price, output_price = (float(v) for v in values.split("/"))
+        except ValueError:
+            raise ValueError(f"无效的模型单价: {item}（格式为 模型=输入/缓存输入/输出）")
+        prices[model.strip()] = (input_price, cached_price or input_price, output_price)
+    return prices
+
+
+def configured_prices(cascade_model: Optional[str] = None) -> Dict[str, Optional[Tuple[float, float, float]]]:
+    """本次可能使用的模型（OPENAI_MODEL、级联批改的便宜模型、MODEL_PRICES 中的模型）及其单价，未配置单价时为 None"""
+    prices: Dict[str, Optional[Tuple[float, float, float]]] = dict(parse_model_prices(Config.MODEL_PRICES))
+    if Config.OPENAI_MODEL not in prices:
+        if Config.PRICE_INPUT_PER_1M or Config.PRICE_OUTPUT_PER_1M:
+            prices[Config.OPENAI_MODEL] = (
+                Config.PRICE_INPUT_PER_1M,
+                Config.PRICE_CACHED_INPUT_PER_1M or Config.PRICE_INPUT_PER_1M,
+                Config.PRICE_OUTPUT_PER_1M
+            )
+        else:
+            prices[Config.OPENAI_MODEL] = None
+    if cascade_model and cascade_model not in prices:
+        prices[cascade_model] = None
+    return prices
+
+
+def _plan_student(homework_dir: str, student_id: str, layout: str, pack: bool,
+                  homework_description: str, attachments_formatted: str,
+                  ignore_patterns: List[str]) -> Dict:
+    """读取单个学生的文件并渲染 prompt，统计 token（在进程池中执行）"""
+    files = read_student_files(homework_dir, student_id, Config.MAX_STUDENT_TOKENS, ignore_patterns)
+    entry = {
+        "submission_tokens": sum(f["tokens"] for f in files),
+        "truncated": any(
+            f["content"].startswith("[已省略") or "\n[已截断：" in f["content"] for f in files
+        ),
+        "prompt_tokens": 0
+    }
+    if not files:
+        # 空提交不调用 API
+        return entry
+    formatted = format_student_files_for_prompt(files)
+    entry["prompt_tokens"] = count_message_tokens(
+        build_messages(layout, homework_description, formatted, attachments_formatted)
+    )
+    if pack:
+        # 打包请求中该学生所占的部分（编号长度对 token 数几乎没有影响）
+        entry["section_tokens"] = count_tokens(format_packed_submissions([(pack_label(0), formatted)]))
+    return entry
+
+
+def _plan_student_task(args) -> Tuple[str, Dict]:
+    student_id = args[1]
+    return student_id, _plan_student(*args)
+
+
+def _cache_key(statement_hash: str, layout: str, pack: bool) -> str:
+    """题目、prompt 模板、布局、截断预算或分词方式变化时缓存失效"""
+    payload = json.dumps([
+        statement_hash, layout, pack, Config.MAX_STUDENT_TOKENS,
+        "tiktoken" if tiktoken is not None else "estimate",
+        Config.SYSTEM_MESSAGE, Config.GRADING_PROMPT_TEMPLATE, Config.GRADING_PREFIX_TEMPLATE,
+        Config.GRADING_STUDENT_TEMPLATE, Config.GRADING_PACKED_TEMPLATE,
+        Config.GRADING_PACKED_STUDENTS_TEMPLATE
+    ], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _load_cache(plan_file: Path, cache_key: str) -> Dict[str, Dict]:
+    try:
+        with open(plan_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+    return data.get("students", {}) if data.get("cache_key") == cache_key else {}
+
+
+def _history(output_path: Path) -> Dict[str, Optional[float]]:
+    """
+    上次批改实际的平均输出 token 数和请求延迟中位数（没有可信记录时为 None）
+
+    只统计实际调用了 API 的学生；延迟样本太少或明显偏低时不可信，返回 None 由调用方使用默认值
+    """
+    manager = ResultManager(output_path / "results.json")
+    completion_tokens: List[int] = []
+    latencies: List[float] = []
+    if manager.has_results():
+        for r in manager.iter_results():
+            # 命中缓存、重复提交和预检查短路的学生没有发出请求（attempts 为 0）
+            if not r.metrics or not r.metrics.get("attempts"):
+                continue
+            if r.usage and r.error is None:
+                completion_tokens.append(r.usage["completion_tokens"])
+            if r.metrics.get("latency") is not None:
+                latencies.append(r.metrics["latency"])
+        manager.close()
+
+    latency = percentile(latencies, 50) if len(latencies) >= _MIN_LATENCY_SAMPLES else None
+    if latency is not None and latency < _MIN_PLAUSIBLE_LATENCY:
+        latency = None
+    return {
+        "output_tokens": sum(completion_tokens) / len(completion_tokens) if completion_tokens else None,
+        "latency": latency
+    }
+
+
+class HomeworkPlan:
+    """单个作业的预估结果：每个学生的 token 数和实际要发送的请求"""
+
+    def __init__(self, homework_dir: str, output_path: Path):
+        self.homework_dir = homework_dir
+        self.homework_name = Path(homework_dir).name
+        self.output_path = output_path
+        self.students: Dict[str, Dict] = {}
+        # 每个请求的 (输入 token, 学生数)
+        self.requests: List[Tuple[int, int]] = []
+        self.prefix_tokens = 0
+        self.cached_students = 0
+        self.history: Dict[str, Optional[float]] = {}
+
+
+def plan_homeworks(homeworks: List[Tuple[str, Path]], layout: Optional[str] = None,
+                   pack: bool = False) -> List[HomeworkPlan]:
+    """
+    渲染每个作业全部学生的 prompt 并统计 token，结果写入各输出目录的 plan.json
+
+    学生文件的内容哈希未变化时直接复用 plan.json 中的 token 数，不再读取和分词；
+    需要重新计算的学生较多时在进程池中并行计算
+    """
+    layout = layout or Config.PROMPT_LAYOUT
+    if layout not in ("classic", "prefix"):
+        raise ValueError(f"未知的 prompt 布局: {layout}")
+
+    plans = []
+    executor: Optional[ProcessPoolExecutor] = None
+    try:
+        for homework_dir, output_path in homeworks:
+            plan = HomeworkPlan(homework_dir, Path(output_path))
+            manifest = SubmissionManifest(plan.output_path / "manifest.json")
+            student_ids = list_student_folders(homework_dir)
+            statement_hash = manifest.statement_hash(homework_dir)
+            hashes = {sid: manifest.submission_hash(homework_dir, sid) for sid in student_ids}
+            manifest.save()
+
+            description = read_homework_description(homework_dir)
+            attachments_formatted = format_attachments_for_prompt(read_statement_attachments(homework_dir))
+            plan_file = plan.output_path / PLAN_FILE_NAME
+            cache_key = _cache_key(statement_hash, layout, pack)
+            cached = _load_cache(plan_file, cache_key)
+
+            todo = []
+            for sid in student_ids:
+                entry = cached.get(sid)
+                if entry is not None and entry.get("submission_hash") == hashes[sid]:
+                    plan.students[sid] = entry
+                    plan.cached_students += 1
+                else:
+                    todo.append(sid)
+
+            patterns = load_ignore_patterns(homework_dir)
+            tasks = [
+                (homework_dir, sid, layout, pack, description, attachments_formatted, patterns)
+                for sid in todo
+            ]
+            if len(tasks) >= _MIN_PARALLEL_STUDENTS:
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+                computed = executor.map(_plan_student_task, tasks, chunksize=8)
+            else:
+                computed = map(_plan_student_task, tasks)
+            for sid, entry in computed:
+                entry["submission_hash"] = hashes[sid]
+                plan.students[sid] = entry
+            plan.students = {sid: plan.students[sid] for sid in student_ids}
+
+            _build_requests(plan, layout, pack, description, attachments_formatted)
+            plan.history = _history(plan.output_path)
+
+            with atomic_write(plan_file) as f:
+                json.dump({
+                    "homework": plan.homework_name,
+                    "generated_at": datetime.now().isoformat(),
+                    "cache_key": cache_key,
+                    "prompt_layout": layout,
+                    "pack": pack,
+                    "students": plan.students
+                }, f, ensure_ascii=False, indent=2)
+            plans.append(plan)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return plans
+
+
+def _build_requests(plan: HomeworkPlan, layout: str, pack: bool,
+                    description: str, attachments_formatted: str):
+    """按批改时的方式把学生组织成请求（打包时按 PACK_MAX_TOKENS 分组）"""
+    if layout == "prefix":
+        plan.prefix_tokens = count_tokens(build_prefix(description, attachments_formatted)) + _MESSAGE_OVERHEAD
+
+    called = [(sid, entry) for sid, entry in plan.students.items() if entry["prompt_tokens"]]
+    if not pack:
+        plan.requests = [(entry["prompt_tokens"], 1) for _, entry in called]
+        return
+
+    # 不含学生提交的打包请求
+    packed_base = count_message_tokens(build_packed_messages(layout, description, [], attachments_formatted))
+    sized = ((entry, entry["submission_tokens"]) for _, entry in called)
+    for members in plan_packs(sized, Config.PACK_MAX_TOKENS, Config.PACK_MAX_STUDENTS):
+        if len(members) == 1:
+            plan.requests.append((members[0]["prompt_tokens"], 1))
+        else:
+            plan.requests.append((packed_base + sum(m["section_tokens"] for m in members), len(members)))
+
+
+def _estimate_cost(prices: Tuple[float, float, float], input_tokens: int, cached_tokens: int,
+                   output_tokens: float) -> float:
+    input_price, cached_price, output_price = prices
+    return (
+        (input_tokens - cached_tokens) * input_price
+        + cached_tokens * cached_price
+        + output_tokens * output_price
+    ) / 1_000_000
+
+
+def summarize_plans(plans: List[HomeworkPlan], concurrency: int,
+                    cascade_model: Optional[str] = None) -> Dict:
+    """汇总所有作业的 token、费用和耗时预估（所有作业共享并发和限流，与批改时一致）"""
+    requests = [request for plan in plans for request in plan.requests]
+    students = sum(count for _, count in requests)
+    input_tokens = sum(tokens for tokens, _ in requests)
+
+    # 输出 token 和延迟优先使用上次批改的实际值
+    history_outputs = [p.history["output_tokens"] for p in plans if p.history.get("output_tokens")]
+    history_latencies = [p.history["latency"] for p in plans if p.history.get("latency")]
+    output_per_student = (sum(history_outputs) / len(history_outputs)) if history_outputs \
+        else Config.PLAN_OUTPUT_TOKENS
+    latency = (sum(history_latencies) / len(history_latencies)) if history_latencies \
+        else Config.PLAN_LATENCY_SECONDS
+    output_tokens = output_per_student * students
+
+    # prefix 布局下同一作业的后续请求可以命中服务商的前缀缓存
+    cached_tokens = sum(
+        plan.prefix_tokens * (len(plan.requests) - 1)
+        for plan in plans if plan.prefix_tokens >= _MIN_CACHED_PREFIX and plan.requests
+    )
+
+    costs = {
+        model: round(_estimate_cost(prices, input_tokens, cached_tokens, output_tokens), 4)
+        if prices is not None else None
+        for model, prices in configured_prices(cascade_model).items()
+    }
+
+    # 吞吐量受并发数、RPM、TPM 中最紧的一个限制（请求数 / 秒）
+    limits = {"concurrency": concurrency / latency}
+    if Config.RPM_LIMIT:
+        limits["rpm"] = Config.RPM_LIMIT / 60
+    if Config.TPM_LIMIT and requests:
+        tokens_per_request = (input_tokens + output_tokens) / len(requests)
+        limits["tpm"] = Config.TPM_LIMIT / 60 / tokens_per_request
+    bottleneck = min(limits, key=limits.get)
+    wall_time = len(requests) / limits[bottleneck] if requests else 0.0
+    if requests:
+        # 最后一批请求至少需要一个完整的请求延迟
+        wall_time = max(wall_time, latency)
+
+    return {
+        "students": sum(len(plan.students) for plan in plans),
+        "api_students": students,
+        "requests": len(requests),
+        "input_tokens": input_tokens,
+        "cached_tokens": cached_tokens,
+        "output_tokens": round(output_tokens),
+        "output_tokens_per_student": round(output_per_student),
+        "output_source": "history" if history_outputs else "config",
+        "latency": round(latency, 3),
+        "latency_source": "history" if history_latencies else "config",
+        "concurrency": concurrency,
+        "bottleneck": bottleneck,
+        "wall_time": round(wall_time, 1),
+        "costs": costs
+    }
+
+
+def _format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.0f} 秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} 分钟"
+    return f"{seconds / 3600:.1f} 小时"
+
+
+def print_plan(plans: List[HomeworkPlan], summary: Dict, top: int = 10):
+    """打印每个作业的 token 分布、提交最大的学生，以及总体的费用和耗时预估"""
+    for plan in plans:
+        entries = plan.students
+        called = {sid: e for sid, e in entries.items() if e["prompt_tokens"]}
+        print("\n" + "=" * 50)
+        print(f"{plan.homework_name}: {len(entries)} 名学生"
+              f"（{len(entries) - len(called)} 人提交为空，{plan.cached_students} 人复用上次预估）")
+        print("=" * 50)
+        if not called:
+            continue
+        prompt_tokens = [e["prompt_tokens"] for e in called.values()]
+        total = sum(prompt_tokens)
+        print(f"输入 token: 总计 {total}，平均每人 {total / len(called):.0f}，"
+              f"p50 {percentile(prompt_tokens, 50)} / p95 {percentile(prompt_tokens, 95)} / "
+              f"最大 {max(prompt_tokens)}")
+        if plan.prefix_tokens:
+            print(f"共享前缀（题目和附件）: {plan.prefix_tokens} token")
+        if len(plan.requests) != len(called):
+            print(f"打包后请求数: {len(plan.requests)}（{len(called)} 人）")
+        truncated = [sid for sid, e in called.items() if e["truncated"]]
+        if truncated:
+            print(f"超出 MAX_STUDENT_TOKENS 被截断: {len(truncated)} 人")
+        largest = sorted(called, key=lambda sid: called[sid]["prompt_tokens"], reverse=True)[:top]
+        print(f"输入 token 最多的 {len(largest)} 名学生:")
+        for sid in largest:
+            entry = called[sid]
+            mark = "（已截断）" if entry["truncated"] else ""
+            print(f"  - {sid}: {entry['prompt_tokens']}（提交 {entry['submission_tokens']}）{mark}")
+
+    print("\n" + "-" * 50)
+    print(f"预计调用 API: {summary['api_students']} 人，{summary['requests']} 个请求")
+    print(f"输入 token: {summary['input_tokens']}"
+          + (f"（其中预计命中前缀缓存 {summary['cached_tokens']}）" if summary["cached_tokens"] else ""))
+    source = "上次批改的平均值" if summary["output_source"] == "history" else "PLAN_OUTPUT_TOKENS"
+    print(f"输出 token: 约 {summary['output_tokens']}（每人 {summary['output_tokens_per_student']}，按{source}）")
+    print("预计费用（全部使用该模型）:")
+    for model, cost in summary["costs"].items():
+        print(f"  - {model}: " + (f"{cost:.4f}" if cost is not None else "未配置单价（MODEL_PRICES）"))
+    source = "上次批改的延迟中位数" if summary["latency_source"] == "history" else "PLAN_LATENCY_SECONDS"
+    bottleneck = {"concurrency": "并发数", "rpm": "RPM_LIMIT", "tpm": "TPM_LIMIT"}[summary["bottleneck"]]
+    print(f"预计耗时: {_format_duration(summary['wall_time'])}"
+          f"（并发 {summary['concurrency']}，单个请求 {summary['latency']:.1f}s 按{source}，瓶颈为 {bottleneck}）")
+    if tiktoken is None:
+        print("提示: 未安装 tiktoken，token 数按字符估算")
@@ -0,0 +1,80 @@
+"""prompt 渲染模块：按 prompt 布局把题目、附件和学生提交渲染为请求消息（不依赖 API 客户端）"""
+
+from typing import Dict, List, Tuple
+
+from .config import Config
+from .packing import format_packed_submissions
+
+
+def _attachments_section(attachments_formatted: str) -> str:
+    if not attachments_formatted:
+        return ""
+    return f"\n## 作业附件（参考文件）\n{attachments_formatted}\n\n"
+
+
+def build_prefix(homework_description: str, attachments_formatted: str = "") -> str:
+    """prefix 布局中对所有学生字节相同的 system 前缀（题目、附件和批改要求）"""
+    return Config.GRADING_PREFIX_TEMPLATE.format(
+        system_message=Config.SYSTEM_MESSAGE,
+        homework_description=homework_description,
+        attachments_section=_attachments_section(attachments_formatted)
+    )
+
+
+def build_messages(layout: str, homework_description: str,
+                   student_files_formatted: str,
+                   attachments_formatted: str = "") -> List[Dict[str, str]]:
+    """
+    渲染批改请求的消息列表
+
+    classic 布局下题目和学生文件都在 user 消息中；prefix 布局下题目、附件和批改要求
+    组成对所有学生都字节相同的 system 消息，学生文件单独放在最后的 user 消息中，
+    以便命中 OpenAI 兼容服务的前缀缓存。
+    """
+    if layout == "prefix":
+        return [
+            {"role": "system", "content": build_prefix(homework_description, attachments_formatted)},
+            {"role": "user", "content": Config.GRADING_STUDENT_TEMPLATE.format(
+                student_files=student_files_formatted
+            )}
+        ]
+
+    prompt = Config.GRADING_PROMPT_TEMPLATE.format(
+        homework_description=homework_description,
+        attachments_section=_attachments_section(attachments_formatted),
+        student_files=student_files_formatted
+    )
+
+    return [
+        {"role": "system", "content": Config.SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_packed_messages(layout: str, homework_description: str,
+                          submissions: List[Tuple[str, str]],
+                          attachments_formatted: str = "") -> List[Dict[str, str]]:
+    """
+    渲染打包请求的消息列表，submissions 为 [(匿名编号, 格式化后的学生文件), ...]
+
+    prefix 布局沿用与单独批改字节相同的 system 前缀，只替换 user 消息
+    """
+    formatted = format_packed_submissions(submissions)
+
+    if layout == "prefix":
+        return [
+            {"role": "system", "content": build_prefix(homework_description, attachments_formatted)},
+            {"role": "user", "content": Config.GRADING_PACKED_STUDENTS_TEMPLATE.format(
+                count=len(submissions), submissions=formatted
+            )}
+        ]
+
+    return [
+        {"role": "system", "content": Config.SYSTEM_MESSAGE},
+        {"role": "user", "content": Config.GRADING_PACKED_TEMPLATE.format(
+            count=len(submissions),
+            homework_description=homework_description,
+            attachments_section=_attachments_section(attachments_formatted),
+            submissions=formatted
+        )}
+    ]
@@ -0,0 +1,178 @@
+"""请求调度模块：RPM/TPM 令牌桶 + AIMD 自适应并发"""
+
+import re
+import threading
+import time
+from typing import Mapping, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数（中文约 1 字 1 token，其余约 4 字符 1 token）"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """
+    解析限流响应头中的时间，返回秒数
+
+    支持 "2"、"0.5"、"20ms"、"1s"、"6m0s"、"1h2m3.5s" 等格式
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+class TokenBucket:
+    """按分钟配额连续补充的令牌桶，capacity <= 0 表示不限制"""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = float(capacity_per_minute)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        self.updated_at = now
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / 60.0)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """返回获得 amount 个令牌还需等待的秒数（0 表示可以立即获取）"""
+        if not self.enabled:
+            return 0.0
+        self._refill(now)
+        # 单次请求超过桶容量时，等桶满即可放行，避免永久阻塞
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) * 60.0 / self.capacity
+
+    def consume(self, amount: float):
+        if self.enabled:
+            self.tokens -= amount
+
+    def clamp(self, remaining: float):
+        """用服务端返回的剩余额度校正本地估计"""
+        if self.enabled:
+            self.tokens = min(self.tokens, remaining)
+
+
+class RateLimiter:
+    """
+    位于 LLM 客户端前的请求调度器
+
+    - RPM / TPM 两个令牌桶控制请求和 token 速率
+    - 在途请求数采用 AIMD：连续成功时 +1，遇到 429 时减半
+    - 读取 x-ratelimit-* 与 Retry-After 响应头，额度耗尽时全局暂停
+    """
+
+    def __init__(self, max_concurrency: int = 1, rpm: int = 0, tpm: int = 0,
+                 min_concurrency: int = 1):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency_limit = self.max_concurrency
+        self.in_flight = 0
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.paused_until = 0.0
+        self.throttled_count = 0
+        self._success_streak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, estimated_tokens: int = 0):
+        """阻塞直到获得并发槽位且速率额度允许发出请求"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.in_flight >= self.concurrency_limit:
+                    self._cond.wait()
+                    continue
+
+                wait = max(
+                    self.paused_until - now,
+                    self.request_bucket.wait_time(1, now),
+                    self.token_bucket.wait_time(estimated_tokens, now),
+                )
+                if wait > 0:
+                    self._cond.wait(timeout=wait)
+                    continue
+
+                self.request_bucket.consume(1)
+                self.token_bucket.consume(estimated_tokens)
+                self.in_flight += 1
+                return
+
+    def release(self, estimated_tokens: int = 0, used_tokens: Optional[int] = None):
+        """释放并发槽位，并用实际 token 用量校正 TPM 桶"""
+        with self._cond:
+            self.in_flight -= 1
+            if used_tokens is not None:
+                self.token_bucket.consume(used_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    def on_success(self, headers: Optional[Mapping[str, str]] = None):
+        """请求成功：加性增大并发上限，并根据响应头同步剩余额度"""
+        with self._cond:
+            self._success_streak += 1
+            if (self._success_streak >= self.concurrency_limit
+                    and self.concurrency_limit < self.max_concurrency):
+                self.concurrency_limit += 1
+                self._success_streak = 0
+            if headers is not None:
+                self._apply_headers(headers)
+            self._cond.notify_all()
+
+    def on_rate_limited(self, headers: Optional[Mapping[str, str]] = None,
+                        default_wait: float = 1.0) -> float:
+        """
+        收到 429：乘性减小并发上限，并暂停所有请求到 Retry-After 之后
+
+        返回本次建议等待的秒数
+        """
+        with self._cond:
+            self.throttled_count += 1
+            self._success_streak = 0
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit // 2)
+
+            wait = None
+            if headers is not None:
+                wait = parse_duration(headers.get("retry-after-ms"))
+                wait = wait / 1000.0 if wait is not None else parse_duration(headers.get("retry-after"))
+                self._apply_headers(headers)
+            if wait is None:
+                wait = default_wait
+
+            self.paused_until = max(self.paused_until, time.monotonic() + wait)
+            self._cond.notify_all()
+            return wait
+
+    def _apply_headers(self, headers: Mapping[str, str]):
+        """根据 x-ratelimit-remaining-* / x-ratelimit-reset-* 校正本地状态（需持有锁）"""
+        now = time.monotonic()
+        for kind, bucket in (("requests", self.request_bucket), ("tokens", self.token_bucket)):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining_value = float(remaining)
+            except ValueError:
+                continue
+            bucket.clamp(remaining_value)
+            if remaining_value <= 0:
+                reset = parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
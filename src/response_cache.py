@@ -0,0 +1,135 @@
+"""LLM 响应缓存模块：以请求内容哈希为键的 SQLite 持久化缓存"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 每写入多少条缓存检查一次总大小，长时间运行时也不会超出 max_bytes 太多
+EVICT_EVERY_PUTS = 100
+
+
+def make_cache_key(model: str, temperature: float, max_tokens: int,
+                   messages: List[Dict[str, str]],
+                   response_format: Optional[Dict] = None) -> str:
+    """
+    根据模型参数、完整消息（system + 渲染后的 prompt）和响应格式（包括 JSON Schema）计算缓存键
+
+    不同 RESPONSE_FORMAT 下模型输出的结构不同，不能互相复用
+    """
+    payload = json.dumps(
+        [model, temperature, max_tokens, messages, response_format],
+        ensure_ascii=False,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    内容寻址的响应缓存
+
+    - 仅缓存成功解析的模型输出
+    - 超过 max_age_days 的条目过期
+    - 总大小超过 max_bytes 时按最近访问时间淘汰
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = 0, max_age_days: float = 0):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if self.max_age_seconds and now - created_at > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            return response
+
+    def put(self, key: str, model: str, response: str):
+        """写入缓存（覆盖同键旧值），每 EVICT_EVERY_PUTS 次写入执行一次淘汰"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, model, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now)
+            )
+            self._conn.commit()
+            self._puts += 1
+            due = self._puts % EVICT_EVERY_PUTS == 0
+        if due and (self.max_bytes or self.max_age_seconds):
+            self.evict()
+
+    def evict(self) -> int:
+        """按年龄和总大小淘汰条目，返回删除的条目数"""
+        removed = 0
+        with self._lock:
+            if self.max_age_seconds:
+                cursor = self._conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?",
+                    (time.time() - self.max_age_seconds,)
+                )
+                removed += cursor.rowcount
+
+            if self.max_bytes:
+                total = self._conn.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()[0]
+                if total > self.max_bytes:
+                    rows = self._conn.execute(
+                        "SELECT key, size FROM responses ORDER BY accessed_at"
+                    ).fetchall()
+                    stale_keys = []
+                    for key, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        stale_keys.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+                    removed += len(stale_keys)
+
+            self._conn.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
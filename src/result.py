@@ -0,0 +1,90 @@
+"""批改结果数据结构（不依赖 openai，只读取已有结果时不需要加载 API 客户端）"""
+
+from typing import Dict, List, Optional
+
+
+class GradingResult:
+    def __init__(self, student_id: str, score: int, comments: str,
+                 deductions: List[Dict], error: Optional[str] = None,
+                 submission_hash: Optional[str] = None,
+                 statement_hash: Optional[str] = None,
+                 usage: Optional[Dict[str, int]] = None,
+                 submission_tokens: Optional[int] = None,
+                 duplicate_of: Optional[str] = None,
+                 metrics: Optional[Dict] = None,
+                 tier: Optional[str] = None,
+                 escalation: Optional[str] = None,
+                 confidence: Optional[float] = None,
+                 checks: Optional[Dict] = None):
+        self.student_id = student_id
+        self.score = score
+        self.comments = comments
+        self.deductions = deductions
+        self.error = error
+        # 批改时学生提交和题目目录的内容哈希，用于增量批改
+        self.submission_hash = submission_hash
+        self.statement_hash = statement_hash
+        # API 返回的 token 用量（prompt_tokens / completion_tokens / cached_tokens），命中本地缓存时为空
+        self.usage = usage
+        # 学生提交文件（截断后）的 token 数
+        self.submission_tokens = submission_tokens
+        # 与其他学生提交重复时，记录实际被批改的代表学号
+        self.duplicate_of = duplicate_of
+        # 调用指标：总耗时、最后一次请求的延迟和首字节时间、请求次数、被限流次数、失败时的错误类型
+        self.metrics = metrics
+        # 级联批改时给出最终结果的层级（cheap / strong）、升级到强模型的原因和便宜模型的自评置信度
+        self.tier = tier
+        self.escalation = escalation
+        self.confidence = confidence
+        # 编译测试预检查的结果（编译是否成功、各测试用例状态）
+        self.checks = checks
+
+    def to_dict(self) -> Dict:
+        data = {
+            "student_id": self.student_id,
+            "score": self.score,
+            "comments": self.comments,
+            "deductions": self.deductions,
+            "error": self.error
+        }
+        if self.submission_hash is not None:
+            data["submission_hash"] = self.submission_hash
+        if self.statement_hash is not None:
+            data["statement_hash"] = self.statement_hash
+        if self.usage is not None:
+            data["usage"] = self.usage
+        if self.submission_tokens is not None:
+            data["submission_tokens"] = self.submission_tokens
+        if self.duplicate_of is not None:
+            data["duplicate_of"] = self.duplicate_of
+        if self.tier is not None:
+            data["tier"] = self.tier
+        if self.escalation is not None:
+            data["escalation"] = self.escalation
+        if self.confidence is not None:
+            data["confidence"] = self.confidence
+        if self.checks is not None:
+            data["checks"] = self.checks
+        if self.metrics is not None:
+            data["metrics"] = self.metrics
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "GradingResult":
+        return cls(
+            student_id=data["student_id"],
+            score=data["score"],
+            comments=data["comments"],
+            deductions=data["deductions"],
+            error=data["error"],
+            submission_hash=data.get("submission_hash"),
+            statement_hash=data.get("statement_hash"),
+            usage=data.get("usage"),
+            submission_tokens=data.get("submission_tokens"),
+            duplicate_of=data.get("duplicate_of"),
+            metrics=data.get("metrics"),
+            tier=data.get("tier"),
+            escalation=data.get("escalation"),
+            confidence=data.get("confidence"),
+            checks=data.get("checks")
+        )
@@ -3,111 +3,109 @@
 import json
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from .grader import GradingResult
+from .result import GradingResult
+from .output_writer import (
+    FRAGMENT_DIR_NAME,
+    FRAGMENT_INDEX_NAME,
+    write_json_result,
+    write_markdown_report
+)
+from .result_store import ResultStore
 
 
 class ResultManager:
-    """管理批改结果文件的读取、合并和写入"""
+    """
+    管理批改结果的读取、写入和导出
 
-    def __init__(self, result_file: Path):
-        self.result_file = result_file
-        self._existing_data: Optional[Dict] = None
-
-    def load_existing_results(self) -> Optional[Dict]:
-        """加载已有的结果文件"""
-        if not self.result_file.exists():
-            return None
+    结果以输出目录下的 results.sqlite3 为准，每次批改只 upsert 本次批改的学生；
+    results.json 由结果存储导出。旧版本只有 results.json 的输出目录会在首次使用时自动导入。
+    """
 
+    def __init__(self, result_file: Path):
+        self.result_file = Path(result_file)
+        self.store_file = self.result_file.with_name("results.sqlite3")
+        self._store: Optional[ResultStore] = None
+
+    @property
+    def store(self) -> ResultStore:
+        if self._store is None:
+            self._store = ResultStore(self.store_file)
+            if self._store.is_empty() and self.result_file.exists():
+                self._import_json()
+        return self._store
+
+    def has_results(self) -> bool:
+        """输出目录中是否已有批改结果"""
+        return self.store_file.exists() or self.result_file.exists()
+
+    def _import_json(self):
+        """将已有的 results.json 导入结果存储"""
         try:
             with open(self.result_file, "r", encoding="utf-8") as f:
-                self._existing_data = json.load(f)
-            return self._existing_data
+                data = json.load(f)
         except json.JSONDecodeError as e:
             raise ValueError(f"结果文件格式错误: {e}")
+        self._store.import_students(
+            data.get("students", []),
+            data.get("graded_at") or datetime.now().isoformat()
+        )
 
     def get_failed_student_ids(self) -> List[str]:
         """获取所有批改失败的学生ID"""
-        if self._existing_data is None:
-            self.load_existing_results()
-
-        if self._existing_data is None:
+        if not self.has_results():
             return []
+        return self.store.failed_student_ids()
 
-        failed_ids = []
-        for student in self._existing_data.get("students", []):
-            if student.get("error") is not None:
-                failed_ids.append(student["student_id"])
+    def get_graded_hashes(self) -> Dict[str, Dict[str, Optional[str]]]:
+        """获取每个学生上次批改时记录的提交哈希和题目哈希"""
+        if not self.has_results():
+            return {}
 
-        return failed_ids
+        return {
+            student["student_id"]: {
+                "submission_hash": student.get("submission_hash"),
+                "statement_hash": student.get("statement_hash")
+            }
+            for student in self.store.iter_students()
+        }
 
-    def merge_results(self, new_results: List[GradingResult],
-                      homework_name: str) -> Dict:
+    def save_results(self, results: List[GradingResult], replace: bool = False):
         """
-        将新批改结果合并到已有结果中
+        写入本次批改结果
 
-        策略：新结果覆盖旧结果（按 student_id 匹配）
+        replace 为 False（重新批改、增量批改）时按学号覆盖，其余学生保持不变；
+        为 True（全量批改）时以本次结果为全部结果。被覆盖的结果保留在历史记录中。
         """
-        if self._existing_data is None:
-            self.load_existing_results()
-
-        # 如果没有已有数据，直接返回新数据格式
-        if self._existing_data is None:
-            return self._build_result_data(
-                [r.to_dict() for r in new_results],
-                homework_name
-            )
-
-        # 创建已有学生结果的映射
-        existing_students = {
-            s["student_id"]: s
-            for s in self._existing_data.get("students", [])
-        }
-
-        # 用新结果覆盖
-        for result in new_results:
-            existing_students[result.student_id] = result.to_dict()
+        self.store.save(results, replace=replace)
 
-        # 重建完整结果
-        all_students = list(existing_students.values())
+    def iter_results(self) -> Iterator[GradingResult]:
+        """按学号顺序逐个读取全部学生结果"""
+        for student in self.store.iter_students():
+            yield GradingResult.from_dict(student)
 
-        return self._build_result_data(all_students, homework_name)
-
-    def _build_result_data(self, students: List[Dict],
-                           homework_name: str) -> Dict:
-        """构建标准结果数据结构"""
-        output_data = {
-            "homework": homework_name,
-            "graded_at": datetime.now().isoformat(),
-            "total_students": len(students),
-            "students": students
-        }
-
-        # 计算统计信息
-        valid_scores = [
-            s["score"] for s in students
-            if s.get("error") is None
-        ]
-
-        if valid_scores:
-            output_data["statistics"] = {
-                "average_score": round(sum(valid_scores) / len(valid_scores), 2),
-                "max_score": max(valid_scores),
-                "min_score": min(valid_scores),
-                "graded_count": len(valid_scores),
-                "error_count": len(students) - len(valid_scores)
-            }
-
-        return output_data
-
-    def save_merged_results(self, merged_data: Dict, output_dir: str) -> str:
-        """保存合并后的结果到 JSON 文件"""
-        output_path = Path(output_dir)
-        output_path.mkdir(parents=True, exist_ok=True)
+    def export(self, homework_name: str, output_dir: str,
+               metrics: Optional[Dict] = None,
+               changed: Optional[List[GradingResult]] = None) -> Tuple[str, str]:
+        """
+        从结果存储导出 results.json 和 report.md，返回两个文件的路径
 
-        json_file = output_path / "results.json"
-        with open(json_file, "w", encoding="utf-8") as f:
-            json.dump(merged_data, f, ensure_ascii=False, indent=2)
+        changed 不为空且已有报告片段索引时，report.md 只重新渲染这些学生的片段
+        """
+        json_path = write_json_result(self.iter_results(), homework_name, output_dir, metrics=metrics)
 
-        return str(json_file)
+        index_file = Path(output_dir) / FRAGMENT_DIR_NAME / FRAGMENT_INDEX_NAME
+        if changed is not None and index_file.exists():
+            md_path = write_markdown_report(
+                changed, homework_name, output_dir,
+                incremental=True, student_ids=self.store.student_ids()
+            )
+        else:
+            md_path = write_markdown_report(self.iter_results(), homework_name, output_dir)
+        return json_path, md_path
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
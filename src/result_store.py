@@ -0,0 +1,163 @@
+"""批改结果存储模块：以 SQLite 保存每个学生的最新结果和历史批改记录"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .result import GradingResult
+
+
+class ResultStore:
+    """
+    批改结果的权威存储
+
+    - results 表每个学生一行，按学号逐条 upsert，重新批改个别学生不需要重写全部结果
+    - 被覆盖的旧结果移入 history 表，保留历次批改记录
+    - 使用 WAL 模式，写入在事务中完成，进程崩溃不会留下写了一半的结果
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                student_id TEXT PRIMARY KEY,
+                score INTEGER NOT NULL,
+                error TEXT,
+                data TEXT NOT NULL,
+                graded_at TEXT NOT NULL
+            );
+            -- 部分索引只包含失败的学生，与 failed_student_ids 的查询条件和排序一致
+            DROP INDEX IF EXISTS idx_results_error;
+            CREATE INDEX IF NOT EXISTS idx_results_failed ON results (student_id) WHERE error IS NOT NULL;
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                student_id TEXT NOT NULL,
+                score INTEGER NOT NULL,
+                error TEXT,
+                data TEXT NOT NULL,
+                graded_at TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_history_student ON history (student_id);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM results LIMIT 1").fetchone() is None
+
+    def save(self, results: List[GradingResult], replace: bool = False,
+             graded_at: Optional[str] = None):
+        """
+        写入批改结果，已有结果移入历史
+
+        Args:
+            results: 本次批改结果
+            replace: 为 True 时（全量批改）不在 results 中的学生也移入历史并删除，
+                     否则只覆盖 results 中的学生
+            graded_at: 批改时间，默认为当前时间
+        """
+        graded_at = graded_at or datetime.now().isoformat()
+        rows = [
+            (r.student_id, r.score, r.error, json.dumps(r.to_dict(), ensure_ascii=False), graded_at)
+            for r in results
+        ]
+        with self._lock, self._conn:
+            if replace:
+                self._conn.execute(
+                    "INSERT INTO history (student_id, score, error, data, graded_at) "
+                    "SELECT student_id, score, error, data, graded_at FROM results"
+                )
+                self._conn.execute("DELETE FROM results")
+            else:
+                self._conn.executemany(
+                    "INSERT INTO history (student_id, score, error, data, graded_at) "
+                    "SELECT student_id, score, error, data, graded_at FROM results WHERE student_id = ?",
+                    [(row[0],) for row in rows]
+                )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (student_id, score, error, data, graded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def import_students(self, students: List[Dict], graded_at: str):
+        """导入旧版 results.json 中的学生结果（仅在存储为空时使用）"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO results (student_id, score, error, data, graded_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (s["student_id"], s.get("score", 0), s.get("error"),
+                     json.dumps(s, ensure_ascii=False), graded_at)
+                    for s in students
+                ]
+            )
+
+    def students(self) -> List[Dict]:
+        """所有学生的最新结果（按学号排序）"""
+        return list(self.iter_students())
+
+    def iter_students(self, batch_size: int = 500) -> Iterator[Dict]:
+        """按学号顺序分批读取学生结果，内存占用与学生总数无关"""
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT student_id, data FROM results WHERE student_id > ? "
+                    "ORDER BY student_id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            for last_id, data in rows:
+                yield json.loads(data)
+            if len(rows) < batch_size:
+                return
+
+    def student_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT student_id FROM results ORDER BY student_id").fetchall()
+        return [student_id for (student_id,) in rows]
+
+    def failed_student_ids(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT student_id FROM results WHERE error IS NOT NULL ORDER BY student_id"
+            ).fetchall()
+        return [student_id for (student_id,) in rows]
+
+    def history(self, student_id: str) -> List[Dict]:
+        """某个学生的历次批改结果（从旧到新，不含当前结果），每条附带 graded_at"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data, graded_at FROM history WHERE student_id = ? ORDER BY id",
+                (student_id,)
+            ).fetchall()
+        return [dict(json.loads(data), graded_at=graded_at) for data, graded_at in rows]
+
+    def set_meta(self, key: str, value):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,181 @@
+"""重试策略模块：错误分类、带抖动的退避和熔断器"""
+
+import random
+import threading
+import time
+from typing import Optional
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+from tqdm import tqdm
+
+from .rate_limiter import parse_duration
+
+# 错误类别：rate_limited 交给调度器处理；retryable 退避后重试；fatal 重试也不会成功，直接失败
+RATE_LIMITED = "rate_limited"
+RETRYABLE = "retryable"
+FATAL = "fatal"
+
+# 429 中表示额度用尽（而不是速率超限）的错误码，重试没有意义
+_QUOTA_ERROR_CODES = ("insufficient_quota", "billing_hard_limit_reached")
+
+
+class CircuitOpenError(Exception):
+    """熔断器持续打开超过时限，服务可能已不可用"""
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    判断一次请求失败是否值得重试
+
+    - 429：限流，额度用尽（insufficient_quota）除外
+    - 408、409、5xx、超时、连接错误：服务端或网络的临时问题，可以重试
+    - 其余 4xx（401 密钥错误、400 上下文超长等）：请求本身有问题，重试也不会成功
+    - 熔断器持续打开（CircuitOpenError）：服务长时间不可用，不再重试
+    - 其他异常（响应内容异常等）：按可重试处理
+    """
+    if isinstance(error, CircuitOpenError):
+        return FATAL
+    if isinstance(error, RateLimitError):
+        if getattr(error, "code", None) in _QUOTA_ERROR_CODES:
+            return FATAL
+        return RATE_LIMITED
+    if isinstance(error, (APITimeoutError, APIConnectionError, httpx.TimeoutException)):
+        return RETRYABLE
+    if isinstance(error, APIStatusError):
+        if error.status_code in (408, 409) or error.status_code >= 500:
+            return RETRYABLE
+        return FATAL
+    return RETRYABLE
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """从错误响应的 Retry-After / retry-after-ms 响应头读取服务端建议的等待秒数"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    wait = parse_duration(headers.get("retry-after-ms"))
+    if wait is not None:
+        return wait / 1000.0
+    return parse_duration(headers.get("retry-after"))
+
+
+def backoff_delay(attempt: int, base: float, cap: float,
+                  server_hint: Optional[float] = None,
+                  rng: Optional[random.Random] = None) -> float:
+    """
+    第 attempt 次（从 1 开始）失败后的等待秒数
+
+    采用 full jitter：在 [0, min(cap, base * 2^(attempt-1))] 中均匀取值，避免大量请求同时重试；
+    服务端给出 Retry-After 时至少等待该时长
+    """
+    rng = rng or random
+    delay = rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+    if server_hint is not None:
+        delay = max(delay, server_hint)
+    return delay
+
+
+class CircuitBreaker:
+    """
+    所有批改线程共享的熔断器
+
+    连续 failure_threshold 次可重试的失败（5xx、超时、连接错误）后打开：之后的请求不再发出，
+    而是等待 reset_timeout 秒；到期后只放行一个探测请求（半开状态），探测成功则关闭熔断器，
+    失败则重新打开并将等待时间翻倍（不超过 max_reset_timeout）。
+    服务恢复前会一直按退避间隔发出探测请求；单个请求等待超过 max_open 秒时抛出 CircuitOpenError，
+    不再继续等待（其他请求仍可在服务恢复后正常发出）。
+    failure_threshold <= 0 表示不启用。
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 max_reset_timeout: float = 120.0, max_open: float = 300.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max(max_reset_timeout, reset_timeout)
+        self.max_open = max_open
+        self.state = "closed"
+        self.open_count = 0
+        self._failures = 0
+        self._current_timeout = reset_timeout
+        self._retry_at = 0.0
+        self._probing = False
+        self._cond = threading.Condition()
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def before_request(self) -> bool:
+        """
+        阻塞直到允许发出请求；本次调用等待超过 max_open 秒时抛出 CircuitOpenError
+
+        Returns:
+            本次请求是否为半开状态下的探测请求（为 True 时调用方必须调用 on_success / on_failure，
+            没有发出请求时调用 release_probe）
+        """
+        if not self.enabled:
+            return False
+        deadline = time.monotonic() + self.max_open
+        with self._cond:
+            while True:
+                if self.state == "closed":
+                    return False
+                now = time.monotonic()
+                if now >= self._retry_at and not self._probing:
+                    # 半开：放行一个探测请求
+                    self.state = "half_open"
+                    self._probing = True
+                    return True
+                if now >= deadline:
+                    raise CircuitOpenError(
+                        f"等待服务恢复超过 {self.max_open:.0f} 秒（熔断器未恢复）"
+                    )
+                if self._probing:
+                    self._cond.wait(timeout=deadline - now)
+                else:
+                    self._cond.wait(timeout=min(self._retry_at, deadline) - now)
+
+    def release_probe(self):
+        """探测请求最终没有发出（如对冲请求被取消）：交还探测名额，由下一个等待的请求探测"""
+        if not self.enabled:
+            return
+        with self._cond:
+            if self.state == "half_open" and self._probing:
+                self.state = "open"
+                self._probing = False
+                self._cond.notify_all()
+
+    def on_success(self):
+        """服务端正常响应（包括 429 和 4xx，说明服务仍然可用）"""
+        if not self.enabled:
+            return
+        with self._cond:
+            self._failures = 0
+            if self.state != "closed":
+                self.state = "closed"
+                self._probing = False
+                self._current_timeout = self.reset_timeout
+                self._cond.notify_all()
+
+    def on_failure(self):
+        """记录一次可重试的失败"""
+        if not self.enabled:
+            return
+        with self._cond:
+            now = time.monotonic()
+            if self.state == "half_open":
+                # 探测失败：重新打开，等待时间翻倍
+                self._probing = False
+                self._current_timeout = min(self._current_timeout * 2, self.max_reset_timeout)
+                self.state = "open"
+                self._retry_at = now + self._current_timeout
+                self._cond.notify_all()
+                return
+            self._failures += 1
+            if self.state == "closed" and self._failures >= self.failure_threshold:
+                self.state = "open"
+                self.open_count += 1
+                self._retry_at = now + self._current_timeout
+                tqdm.write(f"警告: 连续 {self._failures} 次请求失败，暂停发送请求 {self._current_timeout:.0f} 秒")
@@ -0,0 +1,162 @@
+"""相似提交检测模块：token shingle + MinHash 签名 + LSH 分桶，近线性时间找出近似抄袭"""
+
+import hashlib
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .dedup import normalize_source
+from .output_writer import atomic_write
+
+_HASH_BITS = 64
+_EMPTY_BIN = 1 << _HASH_BITS
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def shingles(files: List[Dict], k: int = 5) -> Set[int]:
+    """将提交（去除注释和空白后）切分为 k 个 token 的 shingle，返回其 64 位哈希集合"""
+    result: Set[int] = set()
+    for file_info in files:
+        tokens = _WORD_PATTERN.findall(normalize_source(file_info["content"]))
+        for i in range(max(1, len(tokens) - k + 1)):
+            shingle = " ".join(tokens[i:i + k])
+            if shingle:
+                digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=_HASH_BITS // 8).digest()
+                result.add(int.from_bytes(digest, "little"))
+    return result
+
+
+class MinHashLSH:
+    """
+    MinHash 签名 + LSH 分桶
+
+    签名使用单次置换 MinHash（one permutation hashing）：把哈希空间按取模分成
+    bands × rows 个桶，每个桶取最小值，空桶用右侧最近的非空桶值加偏移填充（densification）。
+    每个提交只需遍历一次 shingle，比 k 个独立哈希函数快约 k 倍。
+
+    两个提交在任一 band 上签名完全相同即成为候选对，
+    Jaccard 相似度约高于 (1/bands)^(1/rows) 的提交对大概率会被找到。
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 4):
+        self.bands = bands
+        self.rows = rows
+        self.num_bins = bands * rows
+
+    def signature(self, shingle_set: Set[int]) -> Tuple[int, ...]:
+        num_bins = self.num_bins
+        bins = [_EMPTY_BIN] * num_bins
+        for value in shingle_set:
+            index = value % num_bins
+            if value < bins[index]:
+                bins[index] = value
+
+        filled = [i for i in range(num_bins) if bins[i] != _EMPTY_BIN]
+        if not filled or len(filled) == num_bins:
+            return tuple(bins)
+
+        # 旋转填充空桶：取右侧（循环）最近的非空桶，并按距离加偏移以区分来源
+        signature = list(bins)
+        for i in range(num_bins):
+            if bins[i] != _EMPTY_BIN:
+                continue
+            distance = 1
+            while bins[(i + distance) % num_bins] == _EMPTY_BIN:
+                distance += 1
+            signature[i] = bins[(i + distance) % num_bins] + distance * _EMPTY_BIN
+        return tuple(signature)
+
+    def candidate_pairs(self, signatures: Dict[str, Tuple[int, ...]]) -> Set[Tuple[str, str]]:
+        """通过 LSH 分桶得到候选提交对"""
+        pairs: Set[Tuple[str, str]] = set()
+        for band in range(self.bands):
+            start = band * self.rows
+            buckets: Dict[Tuple[int, ...], List[str]] = {}
+            for student_id, signature in signatures.items():
+                buckets.setdefault(signature[start:start + self.rows], []).append(student_id)
+            for members in buckets.values():
+                if len(members) < 2:
+                    continue
+                members.sort()
+                for i in range(len(members)):
+                    for j in range(i + 1, len(members)):
+                        pairs.add((members[i], members[j]))
+        return pairs
+
+
+def find_similar_pairs(submissions: Dict[str, List[Dict]],
+                       threshold: float = 0.8,
+                       base_files: Iterable[Dict] = (),
+                       k: int = 5) -> List[Dict]:
+    """
+    找出相似度不低于 threshold 的提交对
+
+    Args:
+        submissions: {student_id: 学生文件列表}
+        threshold: Jaccard 相似度阈值
+        base_files: 题目提供的附件（起始代码），其 shingle 不计入相似度
+        k: shingle 长度（token 数）
+
+    Returns:
+        [{"students": [a, b], "similarity": 0.93}, ...]，按相似度降序
+    """
+    base_shingles = shingles(list(base_files), k)
+    shingle_sets = {
+        student_id: shingles(files, k) - base_shingles
+        for student_id, files in submissions.items()
+    }
+    shingle_sets = {sid: s for sid, s in shingle_sets.items() if s}
+
+    lsh = MinHashLSH()
+    signatures = {sid: lsh.signature(s) for sid, s in shingle_sets.items()}
+
+    similar_pairs = []
+    for a, b in lsh.candidate_pairs(signatures):
+        set_a, set_b = shingle_sets[a], shingle_sets[b]
+        similarity = len(set_a & set_b) / len(set_a | set_b)
+        if similarity >= threshold:
+            similar_pairs.append({"students": [a, b], "similarity": round(similarity, 4)})
+
+    similar_pairs.sort(key=lambda p: (-p["similarity"], p["students"]))
+    return similar_pairs
+
+
+def write_similarity_report(pairs: List[Dict], homework_name: str, output_path: str,
+                            threshold: float, student_count: int) -> str:
+    """将相似提交对写入 similarity.md 和 similarity.json，返回 Markdown 文件路径"""
+    output_dir = Path(output_path)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    with atomic_write(output_dir / "similarity.json") as f:
+        json.dump({
+            "homework": homework_name,
+            "generated_at": datetime.now().isoformat(),
+            "threshold": threshold,
+            "total_students": student_count,
+            "pairs": pairs
+        }, f, ensure_ascii=False, indent=2)
+
+    lines = [
+        f"# {homework_name} 相似提交报告",
+        f"\n生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"\n参与比较学生数: {student_count}",
+        f"\n相似度阈值: {threshold}（去除注释、空白及题目附件代码后的 token shingle Jaccard 相似度）",
+        f"\n相似提交对: {len(pairs)} 对",
+    ]
+
+    if pairs:
+        lines.extend([
+            "\n| 学号 A | 学号 B | 相似度 |",
+            "| --- | --- | --- |",
+        ])
+        for pair in pairs:
+            a, b = pair["students"]
+            lines.append(f"| {a} | {b} | {pair['similarity'] * 100:.1f}% |")
+
+    output_file = output_dir / "similarity.md"
+    with atomic_write(output_file) as f:
+        f.write("\n".join(lines) + "\n")
+
+    return str(output_file)
@@ -0,0 +1,113 @@
+"""HTTP 传输模块：按并发数配置连接池和超时的 httpx 客户端，以及对冲请求（hedged request）"""
+
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, wait
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+import httpx
+from openai import DefaultHttpxClient
+
+try:
+    import h2
+except ImportError:  # 可选依赖，未安装时只能使用 HTTP/1.1
+    h2 = None
+
+from .config import Config
+
+T = TypeVar("T")
+
+
+def build_timeout() -> httpx.Timeout:
+    """连接、读取、写入和从连接池获取连接的超时（秒）"""
+    return httpx.Timeout(
+        Config.HTTP_READ_TIMEOUT,
+        connect=Config.HTTP_CONNECT_TIMEOUT,
+        write=Config.HTTP_CONNECT_TIMEOUT,
+        pool=Config.HTTP_READ_TIMEOUT
+    )
+
+
+def build_http_client(max_concurrency: int, hedge: bool = False,
+                      event_hooks: Optional[dict] = None) -> httpx.Client:
+    """
+    创建所有批改线程共享的 httpx 客户端
+
+    连接池大小与并发数一致（开启对冲请求时翻倍），避免线程等待连接或反复建立 TLS 连接；
+    HTTP2=1 且安装了 h2 时启用 HTTP/2，多个请求复用同一个连接。
+    """
+    connections = max_concurrency * (2 if hedge else 1)
+    http2 = Config.HTTP2
+    if http2 and h2 is None:
+        print("警告: 未安装 h2，无法启用 HTTP/2（pip install httpx[http2]），改用 HTTP/1.1")
+        http2 = False
+    return DefaultHttpxClient(
+        timeout=build_timeout(),
+        limits=httpx.Limits(
+            max_connections=connections,
+            max_keepalive_connections=connections
+        ),
+        http2=http2,
+        event_hooks=event_hooks or {}
+    )
+
+
+class LatencyTracker:
+    """记录最近 window 次成功请求的延迟，用于计算对冲请求的等待时间"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """样本不足 min_samples 时返回 None"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+
+def hedged_call(call: Callable[[threading.Event], T], delay: Optional[float],
+                executor: Executor) -> Tuple[T, bool, bool]:
+    """
+    对冲调用：先发出一次 call，超过 delay 秒仍未返回时再发出一次相同的 call，采用先成功的结果
+
+    call 接收一个 Event，该 Event 被设置表示结果已不再需要（另一次调用已成功），
+    尚未发出请求的调用应直接放弃。delay 为 None 时不对冲。
+
+    Returns:
+        (结果, 是否发出了对冲请求, 结果是否来自对冲请求)；两次调用都失败时抛出第一次调用的异常
+    """
+    primary_cancelled = threading.Event()
+    primary = executor.submit(call, primary_cancelled)
+    if delay is None:
+        return primary.result(), False, False
+
+    done, _ = wait([primary], timeout=delay)
+    if done:
+        return primary.result(), False, False
+
+    hedge_cancelled = threading.Event()
+    hedge = executor.submit(call, hedge_cancelled)
+    pending = {primary, hedge}
+    errors: List[Tuple[bool, BaseException]] = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                # 另一次调用如果还在排队就不再发出，已发出的请求结果直接丢弃
+                primary_cancelled.set()
+                hedge_cancelled.set()
+                return future.result(), True, future is hedge
+            errors.append((future is hedge, error))
+
+    errors.sort(key=lambda item: item[0])
+    raise errors[0][1]
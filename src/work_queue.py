@@ -0,0 +1,187 @@
+"""分布式任务队列模块：多台机器通过共享文件系统上的 SQLite 数据库领取学生并写回结果"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .result import GradingResult
+
+# 任务队列数据库（位于输出目录下）
+QUEUE_FILE_NAME = "queue.sqlite3"
+
+# 任务状态
+STATUS_PENDING = "pending"
+STATUS_LEASED = "leased"
+STATUS_DONE = "done"
+
+
+def default_worker_id() -> str:
+    """主机名 + 进程号，区分同一台机器上的多个工作进程"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    基于 SQLite 的租约式任务队列
+
+    - 每个学生是一条任务；工作进程用 claim() 领取任务并获得 lease_seconds 秒的租约
+    - 批改期间由 heartbeat() 定期续约；进程崩溃后租约过期，任务可被其他进程重新领取
+    - 结果写回同一个数据库，接口与 ResultJournal 相同（append / replay / remove），
+      可以直接替换结果日志
+    - 汇总输出后不删除数据库，而是在 meta 中标记 finalized：较晚启动的工作进程看到标记后直接退出，
+      不会重新加入全部学生再批改一遍；数据库由下一次非 --worker 的批改删除
+
+    数据库放在共享文件系统（NFS/SMB）上时 WAL 模式不可用，因此使用默认的回滚日志模式，
+    所有写操作都在 BEGIN IMMEDIATE 事务中完成，依赖 SQLite 的文件锁互斥。
+    """
+
+    def __init__(self, db_path: Path, worker_id: Optional[str] = None,
+                 lease_seconds: float = 300):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.db_path), timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                student_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                worker_id TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def _transaction(self, statements):
+        """在 BEGIN IMMEDIATE 事务中执行 statements(conn)，返回其结果"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = statements(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def enqueue(self, student_ids: List[str]):
+        """加入任务；已存在的任务（包括其他进程加入的、已完成的）保持不变"""
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT OR IGNORE INTO tasks (student_id, status, updated_at) VALUES (?, ?, ?)",
+            [(sid, STATUS_PENDING, now) for sid in student_ids]
+        ))
+
+    def claim(self) -> Optional[str]:
+        """领取一个待批改或租约已过期的任务，没有可领取的任务时返回 None"""
+        def statements(conn):
+            now = time.time()
+            row = conn.execute(
+                "SELECT student_id FROM tasks "
+                "WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                "ORDER BY student_id LIMIT 1",
+                (STATUS_PENDING, STATUS_LEASED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = ?, worker_id = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE student_id = ?",
+                (STATUS_LEASED, self.worker_id, now + self.lease_seconds, now, row[0])
+            )
+            return row[0]
+
+        return self._transaction(statements)
+
+    def heartbeat(self):
+        """为本进程持有的所有租约续期"""
+        now = time.time()
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE status = ? AND worker_id = ?",
+            (now + self.lease_seconds, now, STATUS_LEASED, self.worker_id)
+        ))
+
+    def append(self, result: GradingResult):
+        """写回一个学生的结果并标记为完成"""
+        now = time.time()
+        payload = json.dumps(result.to_dict(), ensure_ascii=False)
+        self._transaction(lambda conn: conn.execute(
+            "INSERT INTO tasks (student_id, status, worker_id, result, updated_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(student_id) DO UPDATE SET status = excluded.status, "
+            "worker_id = excluded.worker_id, lease_expires = NULL, "
+            "result = excluded.result, updated_at = excluded.updated_at",
+            (result.student_id, STATUS_DONE, self.worker_id, payload, now)
+        ))
+
+    def replay(self) -> Dict[str, Dict]:
+        """返回已完成任务的结果 {student_id: 结果字典}"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT student_id, result FROM tasks WHERE status = ?", (STATUS_DONE,)
+            ).fetchall()
+        return {student_id: json.loads(result) for student_id, result in rows}
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM tasks GROUP BY status"
+            ).fetchall()
+        counts = {STATUS_PENDING: 0, STATUS_LEASED: 0, STATUS_DONE: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def is_finished(self) -> bool:
+        counts = self.counts()
+        return counts[STATUS_PENDING] == 0 and counts[STATUS_LEASED] == 0
+
+    def claim_finalize(self) -> bool:
+        """所有任务完成后，只有第一个调用的进程负责汇总输出"""
+        def statements(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('finalized_by', ?)",
+                (self.worker_id,)
+            )
+            return cursor.rowcount == 1
+
+        return self._transaction(statements)
+
+    def mark_finalized(self):
+        """汇总输出已写入最终文件"""
+        self._transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('finalized', ?)", (self.worker_id,)
+        ))
+
+    def is_finalized(self) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM meta WHERE key = 'finalized'").fetchone()
+        return row is not None
+
+    def remove(self):
+        """删除队列数据库（队列已汇总且不再有工作进程使用时）"""
+        with self._lock:
+            self._conn.close()
+            for suffix in ("", "-journal"):
+                path = Path(str(self.db_path) + suffix)
+                if path.exists():
+                    path.unlink()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()